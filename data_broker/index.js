@@ -23,6 +23,9 @@ io.on('connection', (socket) => {
   socket.on('blink',   forward('blink'));
   socket.on('eSense',  forward('eSense'));
   socket.on('handGesture',  forward('handGesture'));
+  socket.on('spectralFeatures', forward('spectralFeatures'));
+  // EEG bruto: ~8 pacotes/s por player, repassado sem log
+  socket.on('rawEeg', (payload) => socket.broadcast.emit('rawEeg', payload));
 
   socket.on('raceStarted', forward('raceStarted'));
   socket.on('hasFinished',  forward('hasFinished'));
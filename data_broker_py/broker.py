@@ -0,0 +1,310 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from pathlib import Path
+import socketio
+from aiohttp import web
+from event_log import EventLog
+
+# ==============================================================================
+# SEÇÃO DE CONFIGURAÇÃO DO LOGGING
+# ==============================================================================
+log_format = '%(asctime)s - %(levelname)s - [%(name)s] - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logging.getLogger("engineio.server").setLevel(logging.WARNING)
+logging.getLogger("socketio.server").setLevel(logging.WARNING)
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+log = logging.getLogger(__name__)
+
+# ==============================================================================
+# SEÇÃO DE CONFIGURAÇÃO DO SERVIÇO
+# ==============================================================================
+BROKER_PORT = int(os.getenv('BROKER_PORT', '3000'))
+CORS_ORIGINS = ['http://localhost:8080', 'http://127.0.0.1:8080', 'http://localhost:5173', 'http://localhost:8000']
+# Intervalo dos frames de eSense para clientes que pedirem batching (0 = desativado)
+ESENSE_BATCH_MS = int(os.getenv('ESENSE_BATCH_MS', '0'))
+# Tamanho máximo do buffer de envio de cada cliente; quando cheio, descarta o item mais antigo
+CLIENT_BUFFER_SIZE = int(os.getenv('CLIENT_BUFFER_SIZE', '1000'))
+# Pacotes pendentes no engine.io a partir dos quais o cliente é considerado lento
+CLIENT_HIGH_WATERMARK = int(os.getenv('CLIENT_HIGH_WATERMARK', '256'))
+STATS_INTERVAL_SECONDS = float(os.getenv('STATS_INTERVAL_SECONDS', '30'))
+# Log durável de todas as mensagens (vazio = desativado) e consumo com replay por offset
+EVENT_LOG_DIR = os.getenv('EVENT_LOG_DIR', 'event_log')
+EVENT_LOG_SEGMENT_MB = int(os.getenv('EVENT_LOG_SEGMENT_MB', '64'))
+EVENT_LOG_FSYNC = os.getenv('EVENT_LOG_FSYNC', '0') == '1'
+# Retenção: segmentos fechados mais antigos são apagados acima do tamanho total ou da idade (0 = sem limite)
+EVENT_LOG_RETENTION_MB = int(os.getenv('EVENT_LOG_RETENTION_MB', '2048'))
+EVENT_LOG_RETENTION_HOURS = float(os.getenv('EVENT_LOG_RETENTION_HOURS', '168'))
+REPLAY_BATCH_SIZE = int(os.getenv('REPLAY_BATCH_SIZE', '500'))
+
+# Mesmos eventos repassados pelo broker em Node (data_broker/index.js)
+FORWARDED_EVENTS = ['blink', 'eSense', 'rawEeg', 'spectralFeatures', 'handGesture', 'raceStarted', 'hasFinished', 'gameEvent']
+# Clientes que nunca chamaram 'subscribe' recebem tudo, como no broker em Node
+LEGACY_ROOM = 'legacy'
+
+event_log = EventLog(Path(EVENT_LOG_DIR), EVENT_LOG_SEGMENT_MB * 1024 * 1024, EVENT_LOG_FSYNC,
+                     retention_bytes=EVENT_LOG_RETENTION_MB * 1024 * 1024,
+                     retention_seconds=EVENT_LOG_RETENTION_HOURS * 3600) if EVENT_LOG_DIR else None
+
+
+def _is_origin_allowed(origin, environ) -> bool:
+    # Navegadores seguem a mesma lista do broker em Node. Os clientes Python (coletor, worker,
+    # aquisição) mandam como Origin a própria URL do broker, aceita como mesma origem.
+    same_origin = f"{environ.get('wsgi.url_scheme', 'http')}://{environ.get('HTTP_HOST')}"
+    return origin is None or origin in CORS_ORIGINS or origin == same_origin
+
+
+sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins=_is_origin_allowed)
+app = web.Application()
+sio.attach(app)
+
+
+class ClientChannel:
+    """Fila de envio limitada de um cliente, drenada por uma task própria."""
+
+    def __init__(self, sid: str, maxlen: int):
+        self.sid = sid
+        self.pending = deque(maxlen=maxlen)
+        self.wakeup = asyncio.Event()
+        self.batch = False
+        self.frame = []
+        # Consumidor durável: lê do event log a partir de `cursor` em vez de receber o fan-out
+        self.durable = False
+        self.cursor = 0
+        # Offset da última entrada enviada nesta inscrição: vai como 'prev' para o cliente ordenar
+        self.last_sent = None
+        self.topics = set()
+        self.sent = 0
+        self.dropped = 0
+        self.task = None
+
+    def push(self, event: str, payload):
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append((event, payload))
+        self.wakeup.set()
+
+    def add_to_frame(self, payload):
+        if len(self.frame) >= CLIENT_BUFFER_SIZE:
+            self.frame.pop(0)
+            self.dropped += 1
+        self.frame.append(payload)
+
+
+channels = {}
+current_session_id = None
+stats = {'received': 0}
+
+
+def _engineio_backlog(sid: str) -> int:
+    """Quantidade de pacotes já entregues ao engine.io e ainda não escritos no socket do cliente."""
+    eio_sid = sio.manager.eio_sid_from_sid(sid, '/')
+    eio_socket = sio.eio.sockets.get(eio_sid) if eio_sid else None
+    queue = getattr(eio_socket, 'queue', None)
+    return queue.qsize() if queue is not None else 0
+
+
+async def _drain_channel(channel: ClientChannel):
+    while True:
+        await channel.wakeup.wait()
+        channel.wakeup.clear()
+        while channel.pending:
+            # Backpressure: enquanto o cliente não escoa o que já está no engine.io, o excesso
+            # fica no buffer limitado dele (e é descartado lá), sem segurar os demais clientes.
+            while _engineio_backlog(channel.sid) > CLIENT_HIGH_WATERMARK:
+                await asyncio.sleep(0.01)
+            event, payload = channel.pending.popleft()
+            await sio.emit(event, payload, to=channel.sid)
+            channel.sent += 1
+
+
+async def _drain_durable(channel: ClientChannel):
+    while True:
+        entries = event_log.read(channel.cursor, max_records=REPLAY_BATCH_SIZE)
+        if not entries:
+            channel.wakeup.clear()
+            await channel.wakeup.wait()
+            continue
+        for offset, event, payload in entries:
+            while _engineio_backlog(channel.sid) > CLIENT_HIGH_WATERMARK:
+                await asyncio.sleep(0.01)
+            if event in channel.topics:
+                await sio.emit('logEntry', {'offset': offset, 'prev': channel.last_sent, 'event': event, 'payload': payload},
+                               to=channel.sid)
+                channel.last_sent = offset
+                channel.sent += 1
+            channel.cursor = offset + 1
+
+
+def _track_session(event: str, payload):
+    """Acompanha a corrida ativa para rotear eventos sem 'sessionId' (eSense, handGesture)."""
+    global current_session_id
+    if not isinstance(payload, dict):
+        return
+    event_type = payload.get('eventType') if event == 'gameEvent' else event
+    if event_type == 'raceStarted' and payload.get('sessionId'):
+        current_session_id = payload['sessionId']
+        log.info(f"Corrida iniciada. Sessão ativa: {current_session_id}")
+    elif event == 'hasFinished' and payload.get('sessionId') == current_session_id:
+        log.info(f"Corrida encerrada. Sessão {current_session_id} finalizada.")
+        current_session_id = None
+
+
+def _target_rooms(event: str, payload) -> list:
+    session_id = payload.get('sessionId') if isinstance(payload, dict) else None
+    session_id = session_id or current_session_id
+    rooms = [LEGACY_ROOM, f'topic:{event}']
+    if session_id:
+        rooms.append(f'session:{session_id}/{event}')
+    return rooms
+
+
+def _fan_out(event: str, payload, sender_sid: str):
+    for channel in channels.values():
+        if channel.durable:
+            channel.wakeup.set()
+    for sid, _ in sio.manager.get_participants('/', _target_rooms(event, payload)):
+        channel = channels.get(sid)
+        if sid == sender_sid or channel is None:
+            continue
+        if event == 'eSense' and channel.batch and ESENSE_BATCH_MS > 0:
+            channel.add_to_frame(payload)
+        else:
+            channel.push(event, payload)
+
+
+def _make_forwarder(event: str):
+    async def forward(sid, payload):
+        log.debug(f"[{event}] recebido: {payload}")
+        stats['received'] += 1
+        if event_log is not None:
+            event_log.append(event, payload)
+        _track_session(event, payload)
+        _fan_out(event, payload, sid)
+    return forward
+
+
+for _event in FORWARDED_EVENTS:
+    sio.on(_event, _make_forwarder(_event))
+
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    channel = ClientChannel(sid, CLIENT_BUFFER_SIZE)
+    channel.task = asyncio.ensure_future(_drain_channel(channel))
+    channels[sid] = channel
+    await sio.enter_room(sid, LEGACY_ROOM)
+    log.info(f"Cliente conectado: {sid}")
+    # A inscrição pode vir já no handshake (auth), sem janela em que o cliente recebe tudo
+    if isinstance(auth, dict) and auth.get('topics') is not None:
+        await _apply_subscription(sid, auth)
+
+
+@sio.event
+async def disconnect(sid, *args):
+    channel = channels.pop(sid, None)
+    if channel and channel.task:
+        channel.task.cancel()
+    log.info(f"Cliente desconectado: {sid}")
+
+
+async def _apply_subscription(sid: str, data: dict) -> dict:
+    topics = data.get('topics') or FORWARDED_EVENTS
+    channel = channels[sid]
+    await sio.leave_room(sid, LEGACY_ROOM)
+
+    if data.get('durable'):
+        if event_log is None:
+            log.warning(f"Cliente {sid} pediu inscrição durável, mas o event log está desativado.")
+            return {'error': 'event log desativado'}
+        from_offset = data.get('fromOffset')
+        channel.durable = True
+        channel.topics = set(topics)
+        channel.cursor = event_log.next_offset if from_offset is None else max(int(from_offset), event_log.first_offset)
+        # A primeira entrada aponta para fromOffset - 1, que é onde o cliente parou
+        channel.last_sent = None if from_offset is None else int(from_offset) - 1
+        if from_offset is not None and int(from_offset) < event_log.first_offset:
+            log.warning(f"Cliente {sid} pediu o offset {from_offset}, já removido pela retenção (primeiro: {event_log.first_offset}).")
+        channel.task.cancel()
+        channel.task = asyncio.ensure_future(_drain_durable(channel))
+        log.info(f"Cliente {sid} inscrito (durável) em {topics} a partir do offset {channel.cursor}")
+        return {'fromOffset': channel.cursor, 'nextOffset': event_log.next_offset}
+
+    session_id = data.get('sessionId')
+    rooms = [f'session:{session_id}/{topic}' if session_id else f'topic:{topic}' for topic in topics]
+    for room in rooms:
+        await sio.enter_room(sid, room)
+    channel.batch = bool(data.get('batch'))
+    log.info(f"Cliente {sid} inscrito em {rooms}")
+    return {'rooms': rooms}
+
+
+@sio.event
+async def subscribe(sid, data):
+    """
+    Inscreve o cliente apenas nos tópicos de interesse. Payload:
+      {'topics': ['eSense', ...], 'sessionId': opcional, 'batch': opcional}
+    Sem 'topics', assume todos. Com 'sessionId', só recebe eventos daquela corrida.
+    Com 'batch' (e ESENSE_BATCH_MS > 0), recebe o eSense agrupado em 'eSenseBatch'.
+    Com 'durable', recebe os tópicos como 'logEntry' ({offset, prev, event, payload}) lidos do
+    event log a partir de 'fromOffset' (ou do fim do log, se omitido).
+    """
+    return await _apply_subscription(sid, data or {})
+
+
+@sio.event
+async def unsubscribe(sid, data=None):
+    """Remove todas as inscrições e volta a receber tudo (modo legado)."""
+    for room in sio.rooms(sid):
+        if room != sid:
+            await sio.leave_room(sid, room)
+    await sio.enter_room(sid, LEGACY_ROOM)
+    channel = channels.get(sid)
+    if channel:
+        channel.batch = False
+        if channel.durable:
+            channel.durable = False
+            channel.task.cancel()
+            channel.task = asyncio.ensure_future(_drain_channel(channel))
+
+
+async def _esense_batch_loop():
+    interval = ESENSE_BATCH_MS / 1000
+    while True:
+        await asyncio.sleep(interval)
+        for channel in list(channels.values()):
+            if channel.frame:
+                frame, channel.frame = channel.frame, []
+                channel.push('eSenseBatch', {'samples': frame})
+
+
+async def _stats_loop():
+    last_received = 0
+    while True:
+        await asyncio.sleep(STATS_INTERVAL_SECONDS)
+        received = stats['received']
+        rate = (received - last_received) / STATS_INTERVAL_SECONDS
+        last_received = received
+        dropped = sum(channel.dropped for channel in channels.values())
+        backlog = sum(len(channel.pending) for channel in channels.values())
+        log.info(f"Clientes: {len(channels)} | Recebidos: {rate:.1f} msg/s | Pendentes: {backlog} | Descartados: {dropped}")
+        if event_log is not None:
+            event_log.enforce_retention()
+
+
+async def _start_background_tasks(app):
+    if ESENSE_BATCH_MS > 0:
+        sio.start_background_task(_esense_batch_loop)
+    sio.start_background_task(_stats_loop)
+
+
+app.on_startup.append(_start_background_tasks)
+
+if __name__ == '__main__':
+    log.info(f"Broker (Python) aguardando conexões em :{BROKER_PORT} ...")
+    if event_log is None:
+        log.warning("Event log desativado (EVENT_LOG_DIR vazio): mensagens não poderão ser reprocessadas.")
+    if ESENSE_BATCH_MS > 0:
+        log.info(f"Batching de eSense ativo: frames a cada {ESENSE_BATCH_MS} ms.")
+    web.run_app(app, port=BROKER_PORT, print=None)
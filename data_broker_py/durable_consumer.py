@@ -0,0 +1,69 @@
+# durable_consumer.py - lado cliente do consumo durável (mensagens 'logEntry' do broker-py)
+#
+# O python-engineio entrega cada mensagem em uma thread própria, então os 'logEntry' de um
+# replay chegam aos handlers em paralelo e fora de ordem. Este consumidor enfileira as entradas
+# e as processa em uma única thread, em ordem de offset. Como o broker só envia os tópicos
+# inscritos, os offsets têm lacunas; por isso cada entrada traz 'prev', o offset da entrada
+# anterior enviada na mesma inscrição (ou fromOffset - 1 na primeira), e a fila segue essa cadeia.
+#
+# Usado pelo raw_data_collector e pelo pipeline_worker (copiado para as imagens pelo compose).
+import queue
+import logging
+import threading
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class OrderedLogConsumer:
+    """
+    `handle(event, payload)` roda para cada entrada, na ordem do log, e `commit(next_offset)`
+    logo depois; o offset confirmado só avança. `committed_offset` é o próximo offset a ler
+    (o que foi enviado ao broker como fromOffset), ou None para começar do fim do log.
+    """
+
+    def __init__(self, handle: Callable, commit: Callable, committed_offset: Optional[int]):
+        self._handle = handle
+        self._commit = commit
+        # Último offset processado; None = ainda não há ponto de partida (a cadeia começa em prev None)
+        self._last = None if committed_offset is None else committed_offset - 1
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='durable-consumer', daemon=True)
+        self._thread.start()
+
+    def submit(self, entry: dict):
+        """Chamado pelo handler 'logEntry' (em qualquer thread): só enfileira."""
+        self._queue.put(entry)
+
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        waiting = {}
+        while True:
+            entry = self._queue.get()
+            if 'prev' not in entry:
+                # Broker sem encadeamento: processa na ordem de chegada
+                self._process(entry)
+                continue
+            if self._last is not None and entry['offset'] <= self._last:
+                continue  # já processada (replay após reconexão)
+            prev = entry['prev']
+            if self._last is not None and prev is not None and prev < self._last:
+                # Replay que partiu de um offset confirmado antes do fim da fila: segue direto
+                prev = self._last
+            waiting[prev] = entry
+            while self._last in waiting:
+                self._process(waiting.pop(self._last))
+            if len(waiting) > 1000:
+                log.warning(f"{len(waiting)} entradas aguardando o offset seguinte a {self._last}.")
+
+    def _process(self, entry: dict):
+        offset = entry['offset']
+        try:
+            self._handle(entry.get('event'), entry.get('payload') or {})
+        except Exception:
+            log.error(f"Falha ao processar a entrada {offset} ({entry.get('event')}) do event log.", exc_info=True)
+        if self._last is None or offset > self._last:
+            self._last = offset
+            self._commit(offset + 1)
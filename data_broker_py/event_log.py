@@ -0,0 +1,215 @@
+# event_log.py - log local append-only e segmentado de todas as mensagens do broker
+#
+# Cada segmento é um par de arquivos nomeados pelo offset da primeira mensagem:
+#   00000000000000000000.log   -> registros [offset: u64][tamanho: u32][json de (evento, payload)]
+#   00000000000000000000.index -> uma posição u64 (dentro do .log) por registro
+# As leituras usam mmap, então um replay completo roda na velocidade do disco.
+# Retenção: segmentos fechados são apagados, do mais antigo para o mais novo, enquanto o total
+# passar de `retention_bytes` ou o segmento tiver a última escrita há mais de `retention_seconds`.
+# O segmento ativo nunca é apagado; leituras anteriores ao primeiro offset começam nele.
+#
+# Uso para recuperação: python event_log.py <diretório> [offset_inicial] > eventos.jsonl
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import bisect
+import logging
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct('>QI')
+INDEX_ENTRY = struct.Struct('>Q')
+
+
+class _Segment:
+    def __init__(self, directory: Path, base_offset: int):
+        self.base_offset = base_offset
+        self.log_path = directory / f"{base_offset:020d}.log"
+        self.index_path = directory / f"{base_offset:020d}.index"
+        self.count = 0
+        self.size = 0
+        self._maps = None
+
+    @property
+    def next_offset(self) -> int:
+        return self.base_offset + self.count
+
+    def recover(self):
+        """Reconstrói o índice a partir do .log, descartando um registro final incompleto (escrita interrompida)."""
+        self.log_path.touch(exist_ok=True)
+        positions = []
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos + RECORD_HEADER.size <= len(data):
+            offset, length = RECORD_HEADER.unpack_from(data, pos)
+            end = pos + RECORD_HEADER.size + length
+            if end > len(data) or offset != self.base_offset + len(positions):
+                break
+            positions.append(pos)
+            pos = end
+        if pos != len(data):
+            log.warning(f"Segmento {self.log_path.name}: descartando {len(data) - pos} bytes de um registro incompleto.")
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(pos)
+        with open(self.index_path, 'wb') as f:
+            f.write(b''.join(INDEX_ENTRY.pack(p) for p in positions))
+        self.count = len(positions)
+        self.size = pos
+
+    def load_sealed(self):
+        self.count = self.index_path.stat().st_size // INDEX_ENTRY.size
+        self.size = self.log_path.stat().st_size
+
+    def maps(self, sealed: bool):
+        """Retorna (mmap do log, mmap do índice). Segmentos fechados mantêm o mapeamento em cache."""
+        if sealed and self._maps is not None:
+            return self._maps
+        if self.count == 0:
+            return None
+        with open(self.log_path, 'rb') as log_file, open(self.index_path, 'rb') as index_file:
+            maps = (mmap.mmap(log_file.fileno(), self.size, access=mmap.ACCESS_READ),
+                    mmap.mmap(index_file.fileno(), self.count * INDEX_ENTRY.size, access=mmap.ACCESS_READ))
+        if sealed:
+            self._maps = maps
+        return maps
+
+    def close(self):
+        if self._maps is not None:
+            for m in self._maps:
+                m.close()
+            self._maps = None
+
+
+class EventLog:
+    """Log durável de mensagens do broker, endereçado por offsets sequenciais."""
+
+    def __init__(self, directory: Path, segment_max_bytes: int = 64 * 1024 * 1024, fsync: bool = False,
+                 retention_bytes: int = 0, retention_seconds: float = 0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self.retention_bytes = retention_bytes
+        self.retention_seconds = retention_seconds
+
+        bases = sorted(int(p.stem) for p in self.directory.glob('*.log'))
+        self.segments = [_Segment(self.directory, base) for base in bases] or [_Segment(self.directory, 0)]
+        for segment in self.segments[:-1]:
+            segment.load_sealed()
+        self.segments[-1].recover()
+        self._open_active()
+        log.info(f"Event log aberto em {self.directory}: {len(self.segments)} segmento(s), próximo offset {self.next_offset}.")
+
+    def _open_active(self):
+        active = self.segments[-1]
+        self._log_file = open(active.log_path, 'ab')
+        self._index_file = open(active.index_path, 'ab')
+
+    def _roll_segment(self):
+        self._log_file.close()
+        self._index_file.close()
+        self.segments.append(_Segment(self.directory, self.next_offset))
+        self.segments[-1].recover()
+        self._open_active()
+        self.enforce_retention()
+
+    def enforce_retention(self) -> int:
+        """Apaga os segmentos fechados mais antigos fora da retenção. Retorna quantos foram apagados."""
+        removed = 0
+        now = time.time()
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            total = sum(segment.size for segment in self.segments)
+            too_big = self.retention_bytes and total > self.retention_bytes
+            too_old = self.retention_seconds and now - oldest.log_path.stat().st_mtime > self.retention_seconds
+            if not (too_big or too_old):
+                break
+            oldest.close()
+            oldest.log_path.unlink()
+            oldest.index_path.unlink()
+            self.segments.pop(0)
+            removed += 1
+        if removed:
+            log.info(f"Retenção do event log: {removed} segmento(s) apagado(s); primeiro offset agora {self.first_offset}.")
+        return removed
+
+    @property
+    def next_offset(self) -> int:
+        return self.segments[-1].next_offset
+
+    @property
+    def first_offset(self) -> int:
+        return self.segments[0].base_offset
+
+    def append(self, event: str, payload) -> int:
+        active = self.segments[-1]
+        if active.size >= self.segment_max_bytes:
+            self._roll_segment()
+            active = self.segments[-1]
+        offset = active.next_offset
+        body = json.dumps([event, payload], separators=(',', ':')).encode('utf-8')
+        self._log_file.write(RECORD_HEADER.pack(offset, len(body)) + body)
+        self._index_file.write(INDEX_ENTRY.pack(active.size))
+        self._log_file.flush()
+        self._index_file.flush()
+        if self.fsync:
+            os.fsync(self._log_file.fileno())
+        active.size += RECORD_HEADER.size + len(body)
+        active.count += 1
+        return offset
+
+    def read(self, from_offset: int, max_records: int = 500) -> list:
+        """Lê até `max_records` mensagens a partir de `from_offset`, como tuplas (offset, evento, payload)."""
+        from_offset = max(from_offset, self.first_offset)
+        entries = []
+        seg_idx = bisect.bisect_right([s.base_offset for s in self.segments], from_offset) - 1
+        while seg_idx < len(self.segments) and len(entries) < max_records:
+            segment = self.segments[seg_idx]
+            sealed = seg_idx < len(self.segments) - 1
+            maps = segment.maps(sealed) if from_offset < segment.next_offset else None
+            if maps is not None:
+                log_map, index_map = maps
+                stop = min(segment.next_offset, from_offset + max_records - len(entries))
+                for offset in range(from_offset, stop):
+                    (pos,) = INDEX_ENTRY.unpack_from(index_map, (offset - segment.base_offset) * INDEX_ENTRY.size)
+                    _, length = RECORD_HEADER.unpack_from(log_map, pos)
+                    start = pos + RECORD_HEADER.size
+                    event, payload = json.loads(log_map[start:start + length])
+                    entries.append((offset, event, payload))
+                from_offset = stop
+                if not sealed:
+                    log_map.close()
+                    index_map.close()
+            seg_idx += 1
+            if seg_idx < len(self.segments):
+                from_offset = max(from_offset, self.segments[seg_idx].base_offset)
+        return entries
+
+    def close(self):
+        self._log_file.close()
+        self._index_file.close()
+        for segment in self.segments:
+            segment.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    event_log = EventLog(Path(sys.argv[1]))
+    cursor = int(sys.argv[2]) if len(sys.argv) > 2 else event_log.first_offset
+    total, started = 0, time.perf_counter()
+    while True:
+        batch = event_log.read(cursor, max_records=10_000)
+        if not batch:
+            break
+        for offset, event, payload in batch:
+            sys.stdout.write(json.dumps({'offset': offset, 'event': event, 'payload': payload}) + '\n')
+        total += len(batch)
+        cursor = batch[-1][0] + 1
+    elapsed = time.perf_counter() - started
+    log.info(f"Replay de {total} mensagens em {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} msg/s).")
+    event_log.close()
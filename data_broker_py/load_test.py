@@ -0,0 +1,100 @@
+# load_test.py - compara a vazão de fan-out entre brokers (Node em :3000, Python em :3001, por exemplo)
+#
+# Uso: python load_test.py http://localhost:3000 http://localhost:3001
+import os
+import sys
+import time
+import asyncio
+import socketio
+
+N_CONSUMERS = int(os.getenv('N_CONSUMERS', '8'))
+N_MESSAGES = int(os.getenv('N_MESSAGES', '5000'))
+# Encerra a medição quando nenhum consumidor recebe nada por esse tempo
+IDLE_TIMEOUT_SECONDS = float(os.getenv('IDLE_TIMEOUT_SECONDS', '3'))
+# Consumidores se inscrevem só no tópico eSense (rooms); BATCH=1 pede frames 'eSenseBatch'.
+# O broker em Node ignora o evento 'subscribe' e continua enviando tudo.
+SUBSCRIBE = os.getenv('SUBSCRIBE', '0') == '1'
+BATCH = os.getenv('BATCH', '0') == '1'
+
+
+def make_esense_payload(i: int) -> dict:
+    return {
+        'player': 1,
+        'attention': i % 101,
+        'meditation': (i * 7) % 101,
+        'eegPower': {'delta': 150000, 'theta': 30000, 'lowAlpha': 9000, 'highAlpha': 9000,
+                     'lowBeta': 7000, 'highBeta': 7000, 'lowGamma': 5000, 'highGamma': 5000},
+        'poorSignalLevel': 0,
+        'status': 'ok',
+        'source': 'bot',
+        'timeStamp': int(time.time() * 1000),
+    }
+
+
+async def run_load_test(broker_url: str, n_consumers: int, n_messages: int) -> dict:
+    received = [0] * n_consumers
+    last_arrival = [0.0]
+    consumers = []
+
+    for idx in range(n_consumers):
+        client = socketio.AsyncClient()
+
+        def make_handlers(idx):
+            async def on_esense(data):
+                received[idx] += 1
+                last_arrival[0] = time.perf_counter()
+
+            async def on_esense_batch(data):
+                received[idx] += len(data.get('samples', []))
+                last_arrival[0] = time.perf_counter()
+            return on_esense, on_esense_batch
+
+        on_esense, on_esense_batch = make_handlers(idx)
+        client.on('eSense', on_esense)
+        client.on('eSenseBatch', on_esense_batch)
+        await client.connect(broker_url, transports=['websocket'])
+        if SUBSCRIBE or BATCH:
+            await client.call('subscribe', {'topics': ['eSense'], 'batch': BATCH})
+        consumers.append(client)
+
+    producer = socketio.AsyncClient()
+    await producer.connect(broker_url, transports=['websocket'])
+
+    start = time.perf_counter()
+    for i in range(n_messages):
+        await producer.emit('eSense', make_esense_payload(i))
+    send_elapsed = time.perf_counter() - start
+
+    expected = n_consumers * n_messages
+    while sum(received) < expected:
+        await asyncio.sleep(0.05)
+        if time.perf_counter() - max(last_arrival[0], start) > IDLE_TIMEOUT_SECONDS:
+            break
+    elapsed = max(last_arrival[0], start) - start
+
+    for client in consumers + [producer]:
+        await client.disconnect()
+
+    delivered = sum(received)
+    return {
+        'url': broker_url,
+        'sent': n_messages,
+        'delivered': delivered,
+        'delivery_pct': delivered / expected * 100,
+        'send_rate': n_messages / send_elapsed if send_elapsed else float('inf'),
+        'fanout_rate': delivered / elapsed if elapsed else 0.0,
+        'elapsed': elapsed,
+    }
+
+
+async def main(urls):
+    mode = 'batch' if BATCH else ('rooms' if SUBSCRIBE else 'broadcast')
+    print(f"Carga: 1 produtor, {N_CONSUMERS} consumidores, {N_MESSAGES} mensagens eSense ({mode})\n")
+    for url in urls:
+        r = await run_load_test(url, N_CONSUMERS, N_MESSAGES)
+        print(f"{r['url']}: entregues {r['delivered']}/{N_CONSUMERS * N_MESSAGES} ({r['delivery_pct']:.1f}%) "
+              f"em {r['elapsed']:.2f}s | envio {r['send_rate']:.0f} msg/s | fan-out {r['fanout_rate']:.0f} msg/s")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1:] or ['http://localhost:3000']))
@@ -0,0 +1,337 @@
+# analytics_store.py - histórico completo de KPIs em um SQLite local, com agregados incrementais
+#
+# O worker grava aqui os KPIs de cada sessão (além do JSON na Refined e do Firestore). Na mesma
+# transação são atualizados:
+#   - user_stats:        estatísticas de carreira por usuário (email)
+#   - daily_leaderboard: melhor TZF/tempo de cada participante por dia
+#   - metric_histogram:  histogramas de TZF e LFO, de onde saem os percentis
+# Assim ranking, evolução e percentis não precisam ler JSONs nem o Firestore.
+#
+# Há um único banco para todos os workers: em WAL, cada gravação abre BEGIN IMMEDIATE e espera
+# (busy timeout) a do outro processo terminar. Os workers precisam estar no mesmo host (o WAL usa
+# memória compartilhada; não funciona em volume de rede).
+#
+# Uso: python analytics_store.py <banco.db> leaderboard [AAAA-MM-DD] [limite]
+#      python analytics_store.py <banco.db> user <email>
+#      python analytics_store.py <banco.db> percentiles [tzf|lfo]
+#      python analytics_store.py <banco.db> backfill <pasta refined_data> [pasta raw_data]
+import sys
+import json
+import time
+import sqlite3
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+# Resolução dos histogramas: percentis com precisão de 0,1 ponto de TZF e 0,1 s de LFO
+HISTOGRAM_RESOLUTION = {'tzf': 0.1, 'lfo': 0.1}
+DEFAULT_PERCENTILES = [25, 50, 75, 90]
+# Quanto uma gravação espera a de outro worker antes de desistir com 'database is locked'
+BUSY_TIMEOUT_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_kpis (
+    session_id      TEXT    NOT NULL,
+    player          INTEGER NOT NULL,
+    participant     TEXT    NOT NULL,   -- email, ou <sessão>/player_<n> sem usuário associado
+    email           TEXT,
+    race_ts         INTEGER NOT NULL,   -- ms UTC do raceStarted
+    race_date       TEXT    NOT NULL,   -- AAAA-MM-DD (UTC)
+    tzf             REAL,
+    tzc             REAL,
+    calm_focus      REAL,
+    valid_session   REAL,
+    cvf_std_dev     REAL,
+    fatigue_slope   REAL,
+    lfo_seconds     REAL,
+    race_time       REAL,
+    is_winner       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, player)
+);
+CREATE INDEX IF NOT EXISTS idx_session_kpis_email ON session_kpis (email, race_ts);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    email           TEXT PRIMARY KEY,
+    total_races     INTEGER NOT NULL,
+    total_wins      INTEGER NOT NULL,
+    sum_tzf         REAL    NOT NULL,
+    sum_tzc         REAL    NOT NULL,
+    best_tzf        REAL,
+    best_race_time  REAL,
+    sum_lfo         REAL    NOT NULL,
+    lfo_races       INTEGER NOT NULL,
+    first_race_ts   INTEGER NOT NULL,
+    last_race_ts    INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS daily_leaderboard (
+    race_date       TEXT    NOT NULL,
+    participant     TEXT    NOT NULL,
+    races           INTEGER NOT NULL,
+    wins            INTEGER NOT NULL,
+    best_tzf        REAL,
+    best_race_time  REAL,
+    PRIMARY KEY (race_date, participant)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_leaderboard_tzf ON daily_leaderboard (race_date, best_tzf DESC);
+
+CREATE TABLE IF NOT EXISTS metric_histogram (
+    metric  TEXT    NOT NULL,
+    bucket  INTEGER NOT NULL,
+    count   INTEGER NOT NULL,
+    PRIMARY KEY (metric, bucket)
+);
+"""
+
+
+class AnalyticsStore:
+    """Acesso ao banco analítico. Vários processos podem gravar: um por vez (BEGIN IMMEDIATE + busy timeout)."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # O handler do socketio roda fora da thread que criou a conexão
+        self.conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # --------------------------------------------------------------------------
+    # Escrita
+    # --------------------------------------------------------------------------
+    def record_session(self, session_id: str, session_kpis: Dict[str, dict], race_ts: int,
+                       user_mapping: Optional[Dict[int, str]] = None,
+                       race_times: Optional[Dict[int, float]] = None, winner_id: Optional[int] = None) -> bool:
+        """
+        Grava os KPIs de uma sessão e atualiza os agregados. Idempotente: uma sessão já gravada
+        (ex.: reprocessada após um replay do event log) é ignorada e retorna False.
+        """
+        user_mapping = user_mapping or {}
+        race_times = race_times or {}
+        race_date = datetime.fromtimestamp(race_ts / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.conn.execute("SELECT 1 FROM session_kpis WHERE session_id = ? LIMIT 1", (session_id,)).fetchone():
+                self.conn.execute("ROLLBACK")
+                log.info(f"Sessão {session_id} já registrada no banco analítico. Ignorando.")
+                return False
+            for player_key, kpis in session_kpis.items():
+                player_id = int(player_key.split('_')[1])
+                email = user_mapping.get(player_id)
+                participant = email or f"{session_id}/{player_key}"
+                row = {
+                    'session_id': session_id, 'player': player_id, 'participant': participant, 'email': email,
+                    'race_ts': race_ts, 'race_date': race_date,
+                    'tzf': kpis['tzf_percentage'], 'tzc': kpis['tzc_percentage'],
+                    'calm_focus': kpis.get('calm_focus_percentage'), 'valid_session': kpis.get('valid_session_percentage'),
+                    'cvf_std_dev': kpis.get('cvf_attention_std_dev'), 'fatigue_slope': kpis.get('fatigue_slope'),
+                    'lfo_seconds': kpis.get('lfo_avg_recovery_seconds'), 'race_time': race_times.get(player_id),
+                    'is_winner': int(player_id == winner_id),
+                }
+                self._insert_session_row(row)
+                self._update_daily_leaderboard(row)
+                if email:
+                    self._update_user_stats(row)
+                self._add_to_histogram('tzf', row['tzf'])
+                self._add_to_histogram('lfo', row['lfo_seconds'])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def _insert_session_row(self, row: dict):
+        columns = ', '.join(row)
+        placeholders = ', '.join(f':{col}' for col in row)
+        self.conn.execute(f"INSERT INTO session_kpis ({columns}) VALUES ({placeholders})", row)
+
+    def _update_user_stats(self, row: dict):
+        self.conn.execute("""
+            INSERT INTO user_stats (email, total_races, total_wins, sum_tzf, sum_tzc, best_tzf, best_race_time,
+                                    sum_lfo, lfo_races, first_race_ts, last_race_ts)
+            VALUES (:email, 1, :is_winner, :tzf, :tzc, :tzf, :race_time,
+                    COALESCE(:lfo_seconds, 0), :lfo_seconds IS NOT NULL, :race_ts, :race_ts)
+            ON CONFLICT (email) DO UPDATE SET
+                total_races    = total_races + 1,
+                total_wins     = total_wins + excluded.total_wins,
+                sum_tzf        = sum_tzf + excluded.sum_tzf,
+                sum_tzc        = sum_tzc + excluded.sum_tzc,
+                best_tzf       = COALESCE(MAX(best_tzf, excluded.best_tzf), best_tzf, excluded.best_tzf),
+                best_race_time = COALESCE(MIN(best_race_time, excluded.best_race_time), best_race_time, excluded.best_race_time),
+                sum_lfo        = sum_lfo + excluded.sum_lfo,
+                lfo_races      = lfo_races + excluded.lfo_races,
+                first_race_ts  = MIN(first_race_ts, excluded.first_race_ts),
+                last_race_ts   = MAX(last_race_ts, excluded.last_race_ts)
+        """, row)
+
+    def _update_daily_leaderboard(self, row: dict):
+        self.conn.execute("""
+            INSERT INTO daily_leaderboard (race_date, participant, races, wins, best_tzf, best_race_time)
+            VALUES (:race_date, :participant, 1, :is_winner, :tzf, :race_time)
+            ON CONFLICT (race_date, participant) DO UPDATE SET
+                races          = races + 1,
+                wins           = wins + excluded.wins,
+                best_tzf       = COALESCE(MAX(best_tzf, excluded.best_tzf), best_tzf, excluded.best_tzf),
+                best_race_time = COALESCE(MIN(best_race_time, excluded.best_race_time), best_race_time, excluded.best_race_time)
+        """, row)
+
+    def _add_to_histogram(self, metric: str, value: Optional[float]):
+        if value is None:
+            return
+        bucket = int(round(value / HISTOGRAM_RESOLUTION[metric]))
+        self.conn.execute("""
+            INSERT INTO metric_histogram (metric, bucket, count) VALUES (?, ?, 1)
+            ON CONFLICT (metric, bucket) DO UPDATE SET count = count + 1
+        """, (metric, bucket))
+
+    # --------------------------------------------------------------------------
+    # Consultas
+    # --------------------------------------------------------------------------
+    def leaderboard(self, race_date: Optional[str] = None, limit: int = 10) -> List[dict]:
+        """Melhor TZF de cada participante no dia (padrão: hoje, UTC), em ordem decrescente."""
+        race_date = race_date or datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        rows = self.conn.execute("""
+            SELECT participant, best_tzf, best_race_time, races, wins FROM daily_leaderboard
+            WHERE race_date = ? ORDER BY best_tzf DESC LIMIT ?
+        """, (race_date, limit)).fetchall()
+        return [dict(row, rank=i + 1) for i, row in enumerate(rows)]
+
+    def user_stats(self, email: str) -> Optional[dict]:
+        row = self.conn.execute("SELECT * FROM user_stats WHERE email = ?", (email,)).fetchone()
+        if row is None:
+            return None
+        stats = dict(row)
+        stats['average_tzf'] = stats['sum_tzf'] / stats['total_races']
+        stats['average_tzc'] = stats['sum_tzc'] / stats['total_races']
+        stats['average_lfo_seconds'] = stats['sum_lfo'] / stats['lfo_races'] if stats['lfo_races'] else None
+        stats['win_percentage'] = stats['total_wins'] / stats['total_races']
+        return stats
+
+    def user_history(self, email: str, limit: Optional[int] = None) -> List[dict]:
+        """Histórico completo de corridas do usuário (sem o corte de 10 do raceHistory), mais antiga primeiro."""
+        rows = self.conn.execute("""
+            SELECT session_id, race_ts, tzf, tzc, fatigue_slope, lfo_seconds, race_time, is_winner
+            FROM session_kpis WHERE email = ? ORDER BY race_ts DESC LIMIT ?
+        """, (email, -1 if limit is None else limit)).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def percentiles(self, metric: str = 'tzf', percentiles: Optional[List[int]] = None) -> Dict[str, float]:
+        """Percentis (chaves no formato do global_stats do Firestore: '0.25', '0.5', ...) a partir do histograma."""
+        percentiles = percentiles or DEFAULT_PERCENTILES
+        rows = self.conn.execute(
+            "SELECT bucket, count FROM metric_histogram WHERE metric = ? ORDER BY bucket", (metric,)).fetchall()
+        total = sum(row['count'] for row in rows)
+        if not total:
+            return {}
+        result, cumulative, i = {}, 0, 0
+        for p in sorted(percentiles):
+            target = p / 100 * total
+            while i < len(rows) - 1 and cumulative + rows[i]['count'] < target:
+                cumulative += rows[i]['count']
+                i += 1
+            result[str(p / 100)] = round(rows[i]['bucket'] * HISTOGRAM_RESOLUTION[metric], 6)
+        return result
+
+    def total_races(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM session_kpis").fetchone()[0]
+
+    # --------------------------------------------------------------------------
+    # Carga inicial a partir da camada Refined
+    # --------------------------------------------------------------------------
+    def backfill_from_refined(self, refined_path: Path, raw_path: Optional[Path] = None) -> int:
+        """
+        Importa os <sessão>_summary.json existentes. Emails, tempos, vencedor e horário da corrida
+        vêm do <sessão>_race.json ao lado do sumário ou, para sessões anteriores a ele, dos eventos
+        na Raw (`raw_path`). Sem nenhum dos dois a sessão entra sem email, datada pelo mtime do sumário.
+        """
+        imported, without_race_info = 0, []
+        for summary_file in sorted(Path(refined_path).glob('*_summary.json')):
+            session_id = summary_file.name[:-len('_summary.json')]
+            with open(summary_file) as f:
+                session_kpis = json.load(f)
+            race_info = read_race_info(race_info_path(refined_path, session_id))
+            if race_info is None and raw_path is not None:
+                race_info = race_info_from_raw(Path(raw_path) / session_id)
+            if race_info is None:
+                without_race_info.append(session_id)
+                race_info = {'race_ts': int(summary_file.stat().st_mtime * 1000)}
+            if self.record_session(session_id, session_kpis, **race_info):
+                imported += 1
+        if without_race_info:
+            log.warning(f"{len(without_race_info)} sessão(ões) sem participantes nem horário da corrida "
+                        f"(importadas sem email, data = mtime do sumário): {', '.join(without_race_info)}")
+        return imported
+
+
+# ------------------------------------------------------------------------------
+# <sessão>_race.json: participantes e horário da corrida, gravados na Refined junto com o sumário
+# ------------------------------------------------------------------------------
+def race_info_path(refined_path: Path, session_id: str) -> Path:
+    return Path(refined_path) / f"{session_id}_race.json"
+
+def write_race_info(path: Path, race_ts: int, user_mapping: Dict[int, str],
+                    race_times: Dict[int, float], winner_id: Optional[int]):
+    race_info = {
+        'raceStartedMs': int(race_ts),
+        'users': {str(int(player)): email for player, email in user_mapping.items()},
+        'raceTimeSeconds': {str(int(player)): float(seconds) for player, seconds in race_times.items()},
+        'winner': None if winner_id is None else int(winner_id),
+    }
+    with open(path, 'w') as f:
+        json.dump(race_info, f, indent=4)
+
+def read_race_info(path: Path) -> Optional[dict]:
+    """Lê um <sessão>_race.json nos argumentos de `record_session` (None se não existir)."""
+    if not path.exists():
+        return None
+    with open(path) as f:
+        race_info = json.load(f)
+    return {
+        'race_ts': race_info['raceStartedMs'],
+        'user_mapping': {int(player): email for player, email in race_info.get('users', {}).items()},
+        'race_times': {int(player): seconds for player, seconds in race_info.get('raceTimeSeconds', {}).items()},
+        'winner_id': race_info.get('winner'),
+    }
+
+def race_info_from_raw(session_path: Path) -> Optional[dict]:
+    """Mesmo formato de `read_race_info`, a partir do game_events.jsonl da Raw (None sem raceStarted)."""
+    from raw_archive import session_exists
+    from processing_logic import get_race_participants, get_race_start_ms, load_game_events
+    if not session_exists(session_path):
+        return None
+    events_df = load_game_events(session_path)
+    if events_df.empty or not (events_df['eventType'] == 'raceStarted').any():
+        return None
+    user_mapping, race_times, winner_id = get_race_participants(events_df)
+    return {'race_ts': get_race_start_ms(events_df), 'user_mapping': user_mapping,
+            'race_times': race_times, 'winner_id': winner_id}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    store = AnalyticsStore(Path(sys.argv[1]))
+    command, args = sys.argv[2], sys.argv[3:]
+    started = time.perf_counter()
+    if command == 'leaderboard':
+        result = store.leaderboard(args[0] if args else None, int(args[1]) if len(args) > 1 else 10)
+    elif command == 'user':
+        result = {'stats': store.user_stats(args[0]), 'history': store.user_history(args[0])}
+    elif command == 'percentiles':
+        result = store.percentiles(args[0] if args else 'tzf')
+    elif command == 'backfill':
+        raw_path = Path(args[1]) if len(args) > 1 else None
+        result = {'imported': store.backfill_from_refined(Path(args[0]), raw_path), 'total_races': store.total_races()}
+    else:
+        sys.exit(f"Comando desconhecido: {command}")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    log.info(f"Consulta '{command}' em {elapsed_ms:.1f} ms")
+    store.close()
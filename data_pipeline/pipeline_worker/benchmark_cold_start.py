@@ -0,0 +1,107 @@
+# benchmark_cold_start.py - custo da primeira corrida de um worker recém-iniciado
+#
+# Cada medição sobe um processo Python novo (cold start de verdade: interpretador, imports,
+# startup) que processa duas sessões idênticas com run_pipeline. Reporta, por modo:
+#   pronto        do spawn do processo até o worker estar pronto para receber corridas
+#   1ª corrida    run_pipeline da primeira sessão (o que o jogador espera após o fim da corrida)
+#   2ª corrida    run_pipeline da segunda sessão (regime permanente)
+# Modos: 'cold' só abre o banco analítico (como antes do warm start); 'warm' roda worker.warm_start().
+# A diferença entre a 1ª e a 2ª corrida é o que ainda fica para a primeira corrida pagar.
+#
+# Uso: python benchmark_cold_start.py
+#   BENCH_MODES=cold,warm          modos a medir
+#   BENCH_REPEATS=5                processos por modo (reporta a mediana)
+#   BENCH_SESSION_SECONDS=180      duração da sessão sintética
+#   BENCH_DATA_DIR=/tmp/neurorace-bench  onde a sessão modelo fica (reaproveitada)
+#   BENCH_REAL_FIRESTORE=1         usa as credenciais do ambiente (grava as sessões sintéticas no Firestore!)
+#
+# Por padrão os processos medidos rodam sem GOOGLE_APPLICATION_CREDENTIALS (no container do worker elas
+# apontam para o Firestore de produção) e o Firestore falha rápido (NO_GCE_CHECK, sem sondar o servidor
+# de metadados do GCE): os tempos incluem o import do firebase_admin, mas não a ida ao Firebase.
+# Com BENCH_REAL_FIRESTORE=1, a 1ª corrida do modo 'cold' inclui o handshake real.
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+BENCH_DATA_DIR = Path(os.getenv('BENCH_DATA_DIR', Path(tempfile.gettempdir()) / 'neurorace-bench'))
+BENCH_MODES = [m for m in os.getenv('BENCH_MODES', 'cold,warm').split(',') if m]
+BENCH_REPEATS = int(os.getenv('BENCH_REPEATS', '5'))
+BENCH_SESSION_SECONDS = int(os.getenv('BENCH_SESSION_SECONDS', '180'))
+BENCH_REAL_FIRESTORE = os.getenv('BENCH_REAL_FIRESTORE', '0') == '1'
+SESSIONS = ('first', 'second')
+
+
+def template_session() -> Path:
+    """Sessão sintética modelo, gerada uma vez e copiada para cada medição."""
+    from synthetic_sessions import generate_session
+    raw_path = BENCH_DATA_DIR / 'cold_start'
+    session_path = raw_path / f'race-{BENCH_SESSION_SECONDS}s'
+    if not (session_path / 'game_events.jsonl').exists():
+        generate_session(raw_path, session_path.name, BENCH_SESSION_SECONDS)
+    return session_path
+
+
+def run_child(mode: str):
+    """Processo medido: importa o worker, faz o startup do modo e roda as duas sessões."""
+    import worker
+    from analytics_store import AnalyticsStore
+    if mode == 'warm':
+        worker.warm_start()
+    elif worker.ANALYTICS_DB_PATH:
+        worker.analytics_store = AnalyticsStore(Path(worker.ANALYTICS_DB_PATH))
+    timings = {'ready': time.time() - float(os.environ['BENCH_SPAWNED_AT'])}
+    for session_id in SESSIONS:
+        started = time.perf_counter()
+        if not worker.run_pipeline(session_id):
+            sys.exit(f"run_pipeline falhou para {session_id}")
+        timings[session_id] = time.perf_counter() - started
+    print(json.dumps(timings))
+
+
+def measure(mode: str, template: Path) -> dict:
+    with tempfile.TemporaryDirectory(prefix='neurorace-coldstart-') as tmp:
+        data = Path(tmp)
+        for session_id in SESSIONS:
+            shutil.copytree(template, data / 'raw_data' / session_id)
+        env = dict(os.environ, RAW_DATA_PATH=str(data / 'raw_data'), TRUSTED_DATA_PATH=str(data / 'trusted_data'),
+                   REFINED_DATA_PATH=str(data / 'refined_data'), ANALYTICS_DB_PATH=str(data / 'analytics.db'),
+                   LEASE_DIR='', DURABLE_CONSUMER='0')
+        if not BENCH_REAL_FIRESTORE:
+            env.pop('GOOGLE_APPLICATION_CREDENTIALS', None)
+        if not env.get('GOOGLE_APPLICATION_CREDENTIALS'):
+            env['NO_GCE_CHECK'] = 'true'
+        env['BENCH_SPAWNED_AT'] = repr(time.time())
+        result = subprocess.run([sys.executable, __file__, '--child', mode], env=env, cwd=Path(__file__).resolve().parent,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            sys.exit(f"Processo de medição ({mode}) falhou:\n{result.stderr[-2000:]}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    template = template_session()
+    print(f"Sessão de {BENCH_SESSION_SECONDS}s, {BENCH_REPEATS} processo(s) por modo (mediana); "
+          f"Firestore {'real' if BENCH_REAL_FIRESTORE and os.getenv('GOOGLE_APPLICATION_CREDENTIALS') else 'sem credenciais (só import e init do firebase_admin)'}")
+    print(f"{'modo':6} {'pronto':>9} {'1ª corrida':>11} {'2ª corrida':>11} {'1ª - 2ª':>9} {'pronto + 1ª':>12}")
+    for mode in BENCH_MODES:
+        runs = [measure(mode, template) for _ in range(BENCH_REPEATS)]
+        ready, first, second = (statistics.median(run[key] for run in runs) for key in ('ready', *SESSIONS))
+        first_to_ready = statistics.median(run['ready'] + run['first'] for run in runs)
+        print(f"{mode:6} {ready * 1000:7.0f}ms {first * 1000:9.0f}ms {second * 1000:9.0f}ms "
+              f"{(first - second) * 1000:7.0f}ms {first_to_ready * 1000:10.0f}ms")
+
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        logging.disable(logging.CRITICAL)
+        run_child(sys.argv[sys.argv.index('--child') + 1])
+    else:
+        logging.basicConfig(level=logging.WARNING)
+        main()
@@ -0,0 +1,232 @@
+# benchmark_processing.py - microbenchmarks das funções de ETL/KPI do processing_logic
+#
+# Para cada faixa de tamanho (de uma corrida de 15 s a sessões de horas com EEG bruto) gera uma
+# sessão sintética determinística e mede, para cada função, o tempo (mediana de N execuções) e o
+# pico de memória de uma execução à parte: heap Python/numpy (tracemalloc) e buffers do Arrow
+# (pool próprio, que o tracemalloc não enxerga). Sai com código 1 se alguma medida piorar além do limite.
+#
+# Os tempos são comparados em unidades de uma carga de calibração fixa (numpy/pandas/Python puro)
+# medida no início de cada execução, o que absorve boa parte da variação de clock e de carga da
+# máquina. Por isso a baseline de referência fica versionada (benchmark_baselines.json): ela vale em
+# qualquer host com a mesma arquitetura, versão do Python, pandas e pyarrow. Sem baseline, ou com
+# uma de outro ambiente, o benchmark falha (código 2): nada de passar em silêncio sem comparar.
+#
+# Uso: python benchmark_processing.py
+#   BENCH_TIERS=race-15s,race-3min   faixas a rodar (padrão: todas)
+#   BENCH_THRESHOLD=0.25             piora tolerada (25%) antes de acusar regressão
+#   BENCH_UPDATE_BASELINE=1          grava as medidas atuais como nova baseline (versionar o arquivo)
+#   BENCH_ALLOW_NO_BASELINE=1        só mede quando não há baseline do ambiente atual, sem falhar
+#   BENCH_BASELINE_FILE=...          baseline (padrão: benchmark_baselines.json ao lado do script)
+#   BENCH_DATA_DIR=/tmp/neurorace-bench  onde as sessões sintéticas ficam (reaproveitadas)
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import processing_logic as pl
+from synthetic_sessions import generate_session
+
+BASELINE_FILE = Path(os.getenv('BENCH_BASELINE_FILE', Path(__file__).resolve().parent / 'benchmark_baselines.json'))
+BENCH_DATA_DIR = Path(os.getenv('BENCH_DATA_DIR', Path(tempfile.gettempdir()) / 'neurorace-bench'))
+THRESHOLD = float(os.getenv('BENCH_THRESHOLD', '0.25'))
+UPDATE_BASELINE = os.getenv('BENCH_UPDATE_BASELINE', '0') == '1'
+ALLOW_NO_BASELINE = os.getenv('BENCH_ALLOW_NO_BASELINE', '0') == '1'
+# Folgas absolutas: abaixo disso a diferença é ruído de medição
+MIN_SLACK_SECONDS = 0.003
+MIN_SLACK_MB = 1.0
+CALIBRATION_REPEATS = 9
+# Pools do Arrow usados nas medições: ficam vivos até o fim do processo, porque algum buffer
+# alocado neles pode ser liberado depois da medição
+_ARROW_POOLS = []
+
+TIERS = {
+    'race-15s':     {'seconds': 15,   'players': 2, 'raw_eeg': False, 'repeats': 20},
+    'race-3min':    {'seconds': 180,  'players': 2, 'raw_eeg': False, 'repeats': 10},
+    'endurance-1h': {'seconds': 3600, 'players': 4, 'raw_eeg': False, 'repeats': 3},
+    'raw-2h':       {'seconds': 7200, 'players': 2, 'raw_eeg': True,  'repeats': 3},
+}
+
+
+def session_for_tier(name: str, tier: dict) -> Path:
+    """Sessão sintética da faixa, gerada uma vez e reaproveitada (a geração é determinística)."""
+    raw_path = BENCH_DATA_DIR / 'raw_data'
+    session_path = raw_path / name
+    if not (session_path / 'game_events.jsonl').exists():
+        generate_session(raw_path, name, tier['seconds'], n_players=tier['players'], raw_eeg=tier['raw_eeg'])
+    return session_path
+
+
+def build_cases(name: str, session_path: Path) -> dict:
+    """Funções a medir, já com as entradas preparadas (só a função em si entra na medida)."""
+    raw_path = session_path.parent
+    trusted_path = BENCH_DATA_DIR / 'trusted_data'
+    eeg_df = pl.load_eeg_data(session_path)
+    events_df = pl.load_game_events(session_path)
+    trusted_df = pl.transform_and_merge(eeg_df, events_df)
+    pl.process_session(name, raw_path, trusted_path)
+    kpi_df = pd.read_parquet(trusted_path / f'{name}.parquet', columns=pl.KPI_COLUMNS)
+    player_df = kpi_df[kpi_df['player'] == 1]
+    valid_df = player_df[player_df['is_signal_valid']]
+    player_events = player_df[player_df['game_event_type'].notna()]
+
+    cases = {
+        'load_eeg_data': lambda: pl.load_eeg_data(session_path),
+        'load_game_events': lambda: pl.load_game_events(session_path),
+        'transform_and_merge': lambda: pl.transform_and_merge(eeg_df, events_df),
+        'to_trusted_table': lambda: pl.to_trusted_table(trusted_df),
+        'process_session': lambda: pl.process_session(name, raw_path, trusted_path),
+        'process_session_chunked': lambda: pl.process_session_chunked(name, raw_path, trusted_path, chunk_size=50_000),
+        'calculate_post_event_metrics': lambda: pl.calculate_post_event_metrics(valid_df, player_events),
+        'compute_session_kpis': lambda: pl.compute_session_kpis(kpi_df),
+    }
+    if any(session_path.glob('player_*_raw.jsonl')):
+        cases['process_spectral_features'] = lambda: pl.process_spectral_features(name, raw_path, trusted_path)
+    return cases
+
+
+def median_seconds(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate() -> float:
+    """Tempo (mediana) de uma carga fixa parecida com a do ETL: a unidade em que os tempos são comparados."""
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=200_000)
+    df = pd.DataFrame({'key': rng.integers(0, 100, values.size), 'value': values})
+
+    def workload():
+        np.sort(values)
+        df.groupby('key')['value'].mean()
+        sum(i * i for i in range(100_000))
+
+    workload()
+    return median_seconds(workload, CALIBRATION_REPEATS)
+
+
+def machine_fingerprint() -> dict:
+    """O que muda os tempos relativos e a memória; o host não entra (os tempos estão em unidades de calibração)."""
+    return {'machine': platform.machine(), 'python': '.'.join(platform.python_version_tuple()[:2]),
+            'pandas': pd.__version__, 'pyarrow': pa.__version__}
+
+
+def measure(fn, repeats: int) -> dict:
+    seconds = median_seconds(fn, repeats)
+    default_pool = pa.default_memory_pool()
+    arrow_pool = pa.proxy_memory_pool(default_pool)
+    _ARROW_POOLS.append(arrow_pool)
+    pa.set_memory_pool(arrow_pool)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        pa.set_memory_pool(default_pool)
+    return {'seconds': seconds, 'peak_mb': peak / 1024 / 1024, 'arrow_peak_mb': arrow_pool.max_memory() / 1024 / 1024}
+
+
+def compare(current: dict, baseline: dict, calibration: float) -> list:
+    """Lista de regressões: (medida, valor atual, baseline). Tempos em unidades de calibração."""
+    regressions = []
+    relative, slack = current['seconds'] / calibration, MIN_SLACK_SECONDS / calibration
+    if relative > baseline['relative'] * (1 + THRESHOLD) + slack:
+        regressions.append(('tempo relativo', relative, baseline['relative']))
+    for key, metric in (('peak_mb', 'memória'), ('arrow_peak_mb', 'memória Arrow')):
+        if current[key] > baseline[key] * (1 + THRESHOLD) + MIN_SLACK_MB:
+            regressions.append((metric, current[key], baseline[key]))
+    return regressions
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    selected = [t.strip() for t in os.getenv('BENCH_TIERS', ','.join(TIERS)).split(',') if t.strip()]
+    stored = json.loads(BASELINE_FILE.read_text()) if BASELINE_FILE.exists() else {}
+    fingerprint = machine_fingerprint()
+    problem = None
+    if not stored:
+        problem = f"Baseline {BASELINE_FILE} não encontrada."
+    elif stored.get('fingerprint') != fingerprint:
+        problem = f"Baseline {BASELINE_FILE} é de outro ambiente ({stored.get('fingerprint')}; atual: {fingerprint})."
+    if problem and not UPDATE_BASELINE:
+        if not ALLOW_NO_BASELINE:
+            print(f"ERRO: {problem} Gere uma com BENCH_UPDATE_BASELINE=1 (e versione o arquivo) "
+                  f"ou rode com BENCH_ALLOW_NO_BASELINE=1 para só medir.")
+            return 2
+        print(f"{problem} BENCH_ALLOW_NO_BASELINE=1: só medindo, sem comparar.")
+    if problem:
+        stored = {}
+    baselines = stored.get('tiers', {}) if stored else {}
+    calibration = calibrate()
+    print(f"Calibração: {calibration * 1000:.1f} ms"
+          + (f" (baseline: {stored['calibration_seconds'] * 1000:.1f} ms)" if stored else ''))
+    results, failures, not_in_baseline = {}, [], []
+
+    for name in selected:
+        tier = TIERS[name]
+        session_path = session_for_tier(name, tier)
+        size_mb = sum(f.stat().st_size for f in session_path.iterdir()) / 1024 / 1024
+        print(f"\n[{name}] {tier['seconds']}s, {tier['players']} players, "
+              f"EEG bruto: {'sim' if tier['raw_eeg'] else 'não'}, {size_mb:.1f} MB de Raw")
+        # Baseline de tempo reescalada para a calibração atual (o que ela valeria agora nesta máquina)
+        print(f"  {'função':<30} {'tempo':>10} {'baseline':>10} {'pico mem':>10} {'baseline':>10} "
+              f"{'pico Arrow':>11} {'baseline':>10}")
+        results[name] = {}
+        for case_name, fn in build_cases(name, session_path).items():
+            current = measure(fn, tier['repeats'])
+            current['relative'] = current['seconds'] / calibration
+            results[name][case_name] = current
+            baseline = baselines.get(name, {}).get(case_name)
+            if baselines and not baseline:
+                not_in_baseline.append(f"{name}/{case_name}")
+            regressions = compare(current, baseline, calibration) if baseline else []
+            failures.extend((name, case_name, *r) for r in regressions)
+            base_s = f"{baseline['relative'] * calibration * 1000:.1f}ms" if baseline else '-'
+            base_mb = f"{baseline['peak_mb']:.1f}MB" if baseline else '-'
+            base_arrow = f"{baseline['arrow_peak_mb']:.1f}MB" if baseline else '-'
+            flag = '  <-- REGRESSÃO' if regressions else ''
+            print(f"  {case_name:<30} {current['seconds'] * 1000:>8.1f}ms {base_s:>10} "
+                  f"{current['peak_mb']:>8.1f}MB {base_mb:>10} {current['arrow_peak_mb']:>9.1f}MB {base_arrow:>10}{flag}")
+
+    shutil.rmtree(BENCH_DATA_DIR / 'trusted_data', ignore_errors=True)
+
+    if UPDATE_BASELINE:
+        baselines.update(results)
+        BASELINE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE_FILE.write_text(json.dumps({
+            'fingerprint': fingerprint,
+            'calibration_seconds': calibration,
+            'tiers': baselines,
+        }, indent=2) + '\n')
+        print(f"\nBaseline atualizada em {BASELINE_FILE}")
+        return 0
+
+    if failures:
+        print(f"\n{len(failures)} regressão(ões) acima de {THRESHOLD:.0%}:")
+        for tier_name, case_name, metric, value, base in failures:
+            print(f"  {tier_name}/{case_name}: {metric} {value:.4g} vs baseline {base:.4g} (+{(value / base - 1):.0%})")
+        return 1
+    if not_in_baseline and not ALLOW_NO_BASELINE:
+        print(f"\nERRO: sem baseline para {', '.join(not_in_baseline)}. Atualize com BENCH_UPDATE_BASELINE=1.")
+        return 2
+    print(f"\nSem regressões acima de {THRESHOLD:.0%}." if baselines else "\nMedido sem baseline (nada comparado).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# benchmark_trusted_schema.py - Trusted no formato antigo x TRUSTED_SCHEMA atual
+#
+# Grava a mesma sessão sintética nos dois formatos e compara:
+#   size_mb      tamanho do Parquet
+#   kpi_read_s   leitura feita pelo cálculo de KPIs (antes: o arquivo inteiro; agora: só KPI_COLUMNS)
+#   full_read_s  leitura de todas as colunas
+# O formato antigo é o df.to_parquet do DataFrame unificado, com os tipos inferidos pelo pandas
+# (float64 para tudo que tem NaN, strings como object, timestamp em nanossegundos).
+#
+# Uso: python benchmark_trusted_schema.py
+#   BENCH_SESSION_SECONDS=15,180,3600    durações das sessões sintéticas (2 players cada)
+#   BENCH_REPEATS=5                      leituras por medida (reporta a mediana)
+#   BENCH_DATA_DIR=/tmp/neurorace-bench  onde as sessões ficam (reaproveitadas)
+import os
+import sys
+import time
+import logging
+import tempfile
+import statistics
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+import processing_logic as pl
+from synthetic_sessions import generate_session
+
+BENCH_DATA_DIR = Path(os.getenv('BENCH_DATA_DIR', Path(tempfile.gettempdir()) / 'neurorace-bench'))
+BENCH_SESSION_SECONDS = [int(s) for s in os.getenv('BENCH_SESSION_SECONDS', '15,180,3600').split(',') if s]
+BENCH_REPEATS = int(os.getenv('BENCH_REPEATS', '5'))
+
+# Colunas da Trusted antes do TRUSTED_SCHEMA, gravadas com df.to_parquet (float64, timestamp em ns)
+LEGACY_TRUSTED_COLUMNS = ['timestamp', 'player', 'attention', 'meditation', 'poorSignalLevel', 'is_signal_valid',
+                          'game_event_type'] + pl.EEG_BANDS
+
+
+def median_seconds(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def session_for(seconds: int) -> Path:
+    """Sessão sintética de `seconds`, gerada uma vez e reaproveitada (a geração é determinística)."""
+    raw_path = BENCH_DATA_DIR / 'schema_raw'
+    session_path = raw_path / f'race-{seconds}s'
+    if not (session_path / 'game_events.jsonl').exists():
+        generate_session(raw_path, session_path.name, seconds)
+    return session_path
+
+
+def compare_schemas(session_path: Path, out_dir: Path, repeats: int) -> dict:
+    """Grava a mesma sessão nos dois formatos e mede tamanho e leitura (a do KPI e a completa)."""
+    trusted_df = pl.transform_and_merge(pl.load_eeg_data(session_path), pl.load_game_events(session_path))
+    legacy_path, compact_path = out_dir / 'legacy.parquet', out_dir / 'compact.parquet'
+    trusted_df[LEGACY_TRUSTED_COLUMNS].to_parquet(legacy_path, index=False, compression='snappy')
+    pq.write_table(pl.to_trusted_table(trusted_df), compact_path, compression='snappy')
+
+    return {
+        'size_mb': (legacy_path.stat().st_size / 1024 / 1024, compact_path.stat().st_size / 1024 / 1024),
+        'kpi_read_s': (median_seconds(lambda: pd.read_parquet(legacy_path), repeats),
+                       median_seconds(lambda: pd.read_parquet(compact_path, columns=pl.KPI_COLUMNS), repeats)),
+        'full_read_s': (median_seconds(lambda: pd.read_parquet(legacy_path), repeats),
+                        median_seconds(lambda: pd.read_parquet(compact_path), repeats)),
+    }
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    print(f"  {'sessão':<14} {'medida':<12} {'antigo':>10} {'atual':>10} {'razão':>8}")
+    with tempfile.TemporaryDirectory(prefix='neurorace-schema-') as tmp:
+        for seconds in BENCH_SESSION_SECONDS:
+            result = compare_schemas(session_for(seconds), Path(tmp), BENCH_REPEATS)
+            for metric, (legacy, compact) in result.items():
+                scale, unit = (1, 'MB') if metric == 'size_mb' else (1000, 'ms')
+                print(f"  {f'{seconds}s':<14} {metric:<12} {legacy * scale:>8.2f}{unit} {compact * scale:>8.2f}{unit} "
+                      f"{legacy / compact:>7.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,19 @@
 import os
 import json
+import threading
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
+from typing import Iterator, Optional
+from collections import OrderedDict
+from urllib.parse import quote
 from datetime import timedelta, datetime
-import firebase_admin
-from firebase_admin import credentials, firestore
 import logging
+from spectral_features import FEATURE_COLUMNS, RAW_SAMPLE_RATE, compute_spectral_features
+from raw_archive import list_session_files, open_session_file, session_exists
+from analytics_store import race_info_path, write_race_info
 
 # Configura um logger para este módulo. A configuração (formato, nível) será feita no entrypoint (worker.py)
 log = logging.getLogger(__name__)
@@ -16,54 +23,124 @@ FOCUS_THRESHOLD = 70
 CALM_THRESHOLD = 60
 PERCENTILES_TO_CALCULATE = [25, 50, 75, 90]
 
+# --- Índice email -> ID do documento em /users ---
+EMAIL_INDEX_COLLECTION = 'users_by_email'
+USER_ID_CACHE_SIZE = int(os.getenv('USER_ID_CACHE_SIZE', '1024'))
+RACE_HISTORY_LIMIT = 10
+
+# Marcadores em sessions/<id> das atualizações acumulativas já aplicadas (global_stats e perfis).
+# As transações leem o marcador antes de somar: um retry depois do commit (crash antes do
+# leases.complete, lease roubada) não conta a corrida duas vezes.
+SESSION_APPLIED_FIELD = 'pipelineApplied'
+
+# Cliente Firestore do processo: criado uma vez (no startup do worker) e reutilizado em todas
+# as sessões, junto com o canal gRPC. O firebase_admin só é importado quando necessário.
+_firestore_client = None
+
 # ==============================================================================
 # SEÇÃO 1: LÓGICA DO ETL (RAW -> TRUSTED)
 # ==============================================================================
 def load_eeg_data(session_path: Path) -> pd.DataFrame:
     all_eeg_data = []
-    eeg_files = list(session_path.glob("player_*_eeg.jsonl"))
-    for file_path in eeg_files:
+    for file_name in list_session_files(session_path, "player_*_eeg.jsonl"):
         try:
-            df = pd.read_json(file_path, lines=True)
+            with open_session_file(session_path, file_name) as f:
+                df = pd.read_json(f, lines=True)
             all_eeg_data.append(df)
         except Exception:
-            log.warning(f"Falha ao ler ou parsear o arquivo de EEG: {file_path}", exc_info=True)
+            log.warning(f"Falha ao ler ou parsear o arquivo de EEG: {session_path / file_name}", exc_info=True)
     if not all_eeg_data:
         return pd.DataFrame()
     return pd.concat(all_eeg_data, ignore_index=True)
 
 def load_game_events(session_path: Path) -> pd.DataFrame:
-    events_file = session_path / "game_events.jsonl"
-    if not events_file.exists():
+    if not list_session_files(session_path, "game_events.jsonl"):
         return pd.DataFrame()
     try:
-        return pd.read_json(events_file, lines=True)
+        with open_session_file(session_path, "game_events.jsonl") as f:
+            return pd.read_json(f, lines=True)
     except Exception:
-        log.warning(f"Falha ao ler ou parsear o arquivo de eventos: {events_file}", exc_info=True)
+        log.warning(f"Falha ao ler ou parsear o arquivo de eventos: {session_path / 'game_events.jsonl'}", exc_info=True)
         return pd.DataFrame()
 
-def transform_and_merge(eeg_df: pd.DataFrame, events_df: pd.DataFrame) -> pd.DataFrame:
+EEG_BANDS = ['delta', 'theta', 'lowAlpha', 'highAlpha', 'lowBeta', 'highBeta', 'lowGamma', 'highGamma']
+TRUSTED_COLUMNS = ['timestamp', 'player', 'attention', 'meditation', 'poorSignalLevel', 'is_signal_valid', 'game_event_type', 'status', 'source'] + EEG_BANDS
+
+# Schema explícito da camada Trusted. Sem ele o pandas grava float64 para tudo que tem NaN
+# (as linhas de evento não têm EEG), strings como object e timestamp em nanossegundos.
+#  - eSense (0-100) e poorSignalLevel (0-200) cabem em uint8; as bandas do NeuroSky são
+#    inteiros sem sinal de 24 bits, então uint32.
+#  - Colunas categóricas de baixa cardinalidade vão dicionarizadas (lidas como 'category').
+#  - O timestamp de origem já tem resolução de milissegundos.
+TRUSTED_SCHEMA = pa.schema([
+    pa.field('timestamp', pa.timestamp('ms', tz='UTC'), nullable=False),
+    pa.field('player', pa.uint8()),
+    pa.field('attention', pa.uint8()),
+    pa.field('meditation', pa.uint8()),
+    pa.field('poorSignalLevel', pa.uint8()),
+    pa.field('is_signal_valid', pa.bool_(), nullable=False),
+    pa.field('game_event_type', pa.dictionary(pa.int8(), pa.string())),
+    pa.field('status', pa.dictionary(pa.int8(), pa.string())),
+    pa.field('source', pa.dictionary(pa.int8(), pa.string())),
+] + [pa.field(band, pa.uint32()) for band in EEG_BANDS])
+
+# Colunas efetivamente usadas no cálculo de KPIs (leitura com projeção)
+KPI_COLUMNS = ['timestamp', 'player', 'attention', 'meditation', 'is_signal_valid', 'game_event_type', 'theta', 'highBeta']
+
+def to_trusted_table(trusted_df: pd.DataFrame) -> pa.Table:
+    """Converte o DataFrame unificado para uma tabela Arrow no TRUSTED_SCHEMA."""
+    arrays = []
+    for field in TRUSTED_SCHEMA:
+        if field.name in trusted_df.columns:
+            values = trusted_df[field.name]
+        else:
+            values = pd.Series([None] * len(trusted_df), dtype=object)
+        if pa.types.is_dictionary(field.type):
+            values = values.astype(object).where(values.notna(), None)
+            array = pa.array(values, type=pa.string()).dictionary_encode().cast(field.type)
+        else:
+            array = pa.array(values, from_pandas=True).cast(field.type)
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=TRUSTED_SCHEMA)
+
+def _normalize_eeg_frame(eeg_df: pd.DataFrame) -> pd.DataFrame:
+    """Achata o 'eegPower' e padroniza o timestamp de um bloco de leituras de EEG."""
+    eeg_df = eeg_df.reset_index(drop=True)
     eeg_power_df = pd.json_normalize(eeg_df['eegPower'])
     eeg_df = pd.concat([eeg_df.drop('eegPower', axis=1), eeg_power_df], axis=1)
     eeg_df = eeg_df.rename(columns={'timeStamp': 'timestamp'})
     eeg_df['timestamp'] = pd.to_datetime(eeg_df['timestamp'], unit='ms', utc=True)
     eeg_df['game_event_type'] = None
+    return eeg_df
+
+def _normalize_events_frame(events_df: pd.DataFrame) -> pd.DataFrame:
+    """Padroniza o timestamp e o nome da coluna de tipo de um bloco de eventos de jogo."""
+    events_df = events_df.copy()
+    events_df['timestamp'] = pd.to_datetime(events_df['timestamp'], unit='ms', utc=True)
+    return events_df.rename(columns={'eventType': 'game_event_type'})
+
+def _finalize_trusted_frame(combined_df: pd.DataFrame) -> pd.DataFrame:
+    if 'poorSignalLevel' not in combined_df.columns:
+        # Lote só com eventos de jogo (possível no modo chunked)
+        combined_df['poorSignalLevel'] = np.nan
+    combined_df['is_signal_valid'] = (combined_df['poorSignalLevel'] == 0)
+    existing_columns = [col for col in TRUSTED_COLUMNS if col in combined_df.columns]
+    return combined_df[existing_columns]
+
+def transform_and_merge(eeg_df: pd.DataFrame, events_df: pd.DataFrame) -> pd.DataFrame:
+    eeg_df = _normalize_eeg_frame(eeg_df)
     if not events_df.empty:
-        events_df['timestamp'] = pd.to_datetime(events_df['timestamp'], unit='ms', utc=True)
-        events_df = events_df.rename(columns={'eventType': 'game_event_type'})
+        events_df = _normalize_events_frame(events_df)
         combined_df = pd.concat([eeg_df, events_df], ignore_index=True)
     else:
         combined_df = eeg_df
     combined_df = combined_df.sort_values(by='timestamp').reset_index(drop=True)
-    combined_df['is_signal_valid'] = (combined_df['poorSignalLevel'] == 0)
-    final_columns = ['timestamp', 'player', 'attention', 'meditation', 'poorSignalLevel', 'is_signal_valid', 'game_event_type', 'delta', 'theta', 'lowAlpha', 'highAlpha', 'lowBeta', 'highBeta', 'lowGamma', 'highGamma']
-    existing_columns = [col for col in final_columns if col in combined_df.columns]
-    return combined_df[existing_columns]
+    return _finalize_trusted_frame(combined_df)
 
 def process_session(session_id: str, raw_path: Path, trusted_path: Path):
     log.info(f"Iniciando processamento ETL para a Session ID: {session_id}")
     session_raw_path = raw_path / session_id
-    if not session_raw_path.exists():
+    if not session_exists(session_raw_path):
         raise FileNotFoundError(f"Diretório da sessão não encontrado em {session_raw_path}")
     eeg_df = load_eeg_data(session_raw_path)
     events_df = load_game_events(session_raw_path)
@@ -73,9 +150,207 @@ def process_session(session_id: str, raw_path: Path, trusted_path: Path):
     trusted_df = transform_and_merge(eeg_df, events_df)
     trusted_path.mkdir(parents=True, exist_ok=True)
     output_path = trusted_path / f"{session_id}.parquet"
-    trusted_df.to_parquet(output_path, index=False, compression='snappy')
+    pq.write_table(to_trusted_table(trusted_df), output_path, compression='snappy')
     log.info(f"Camada Trusted salva com sucesso em {output_path}")
 
+# ------------------------------------------------------------------------------
+# Modo chunked: para sessões longas (endurance/maratona) em que carregar a sessão
+# inteira em memória estoura o container do worker.
+# ------------------------------------------------------------------------------
+class OutOfOrderInputError(ValueError):
+    """Uma linha chegou mais atrasada que a janela de atraso (`max_lateness_ms`) do seu arquivo."""
+
+def _iter_normalized_chunks(session_path: Path, file_name: str, chunk_size: int, normalize) -> Iterator[pd.DataFrame]:
+    """
+    Lê um .jsonl em blocos de `chunk_size` linhas, já normalizados e ordenados por timestamp.
+
+    Erros de leitura ou parse não são engolidos: um arquivo lido pela metade pareceria
+    encerrado para o merge e a Trusted sairia truncada.
+    """
+    with open_session_file(session_path, file_name) as f, pd.read_json(f, lines=True, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            if chunk.empty:
+                continue
+            yield normalize(chunk).sort_values(by='timestamp', kind='stable')
+
+def iter_merged_session_chunks(session_path: Path, chunk_size: int, max_lateness_ms: int = 10_000) -> Iterator[pd.DataFrame]:
+    """
+    Faz um k-way merge por timestamp dos arquivos da sessão (um por jogador + eventos),
+    com memória limitada pelo `chunk_size` e pela janela de atraso, nunca pela duração da sessão.
+
+    Cada arquivo chega quase em ordem temporal: o coletor grava na ordem de chegada e uma
+    linha pode aparecer depois de outras até `max_lateness_ms` mais novas do mesmo arquivo.
+    Por isso cada arquivo só garante que não produz mais nada anterior à sua "fronteira"
+    (maior timestamp lido - `max_lateness_ms`). A cada rodada emitimos o que está abaixo da
+    menor fronteira entre os arquivos ainda ativos e lemos mais um bloco do arquivo dono dela,
+    então cada arquivo retém no máximo um bloco mais a janela de atraso.
+
+    Uma linha mais atrasada que a janela não tem mais lugar na saída já emitida: levanta
+    OutOfOrderInputError (aumente ETL_MAX_LATENESS_MS) em vez de gravar fora de ordem.
+    """
+    lateness = pd.Timedelta(milliseconds=max_lateness_ms)
+    sources = {}
+    for file_name in list_session_files(session_path, "player_*_eeg.jsonl"):
+        sources[file_name] = _iter_normalized_chunks(session_path, file_name, chunk_size, _normalize_eeg_frame)
+    for file_name in list_session_files(session_path, "game_events.jsonl"):
+        sources[file_name] = _iter_normalized_chunks(session_path, file_name, chunk_size, _normalize_events_frame)
+
+    buffers, frontiers = {}, {}
+    last_emitted = None
+    pending_reads = list(sources)
+    while sources or buffers:
+        for file_name in pending_reads:
+            chunk = next(sources[file_name], None)
+            if chunk is None:
+                del sources[file_name]
+                frontiers.pop(file_name, None)
+                continue
+            if last_emitted is not None and chunk['timestamp'].iloc[0] < last_emitted:
+                raise OutOfOrderInputError(
+                    f"Linha de {chunk['timestamp'].iloc[0]} em {session_path / file_name} chegou depois de "
+                    f"{last_emitted} já ter sido emitido (atraso maior que {max_lateness_ms} ms)")
+            if file_name in buffers:
+                chunk = pd.concat([buffers[file_name], chunk], ignore_index=True).sort_values(by='timestamp', kind='stable')
+            buffers[file_name] = chunk
+            frontier = chunk['timestamp'].iloc[-1] - lateness
+            frontiers[file_name] = max(frontier, frontiers.get(file_name, frontier))
+
+        # Arquivos encerrados não seguram mais nada: sem ativos, esvazia tudo
+        watermark = min(frontiers.values()) if frontiers else None
+        ready_parts = []
+        for file_name, buf in list(buffers.items()):
+            if watermark is None:
+                ready, pending = buf, buf.iloc[0:0]
+            else:
+                is_ready = buf['timestamp'] <= watermark
+                ready, pending = buf[is_ready], buf[~is_ready]
+            if not ready.empty:
+                ready_parts.append(ready)
+            if pending.empty:
+                del buffers[file_name]
+            else:
+                buffers[file_name] = pending
+
+        if ready_parts:
+            merged = pd.concat(ready_parts, ignore_index=True).sort_values(by='timestamp', kind='stable').reset_index(drop=True)
+            last_emitted = merged['timestamp'].iloc[-1]
+            yield _finalize_trusted_frame(merged)
+        # Só o arquivo que segura a marca d'água precisa andar; ler os outros só aumentaria os buffers
+        pending_reads = [min(frontiers, key=frontiers.get)] if frontiers else []
+
+def process_session_chunked(session_id: str, raw_path: Path, trusted_path: Path, chunk_size: int = 50_000,
+                            max_lateness_ms: int = 10_000):
+    """
+    Variante do `process_session` com memória limitada pelo `chunk_size` (e pela janela de
+    atraso `max_lateness_ms`), independente da duração da sessão. Os blocos já ordenados são
+    gravados como row groups em um único `ParquetWriter`; se a leitura ou o merge falhar,
+    o arquivo temporário é descartado e o erro sobe (nada de Trusted parcial).
+    """
+    log.info(f"Iniciando processamento ETL (modo chunked, {chunk_size} linhas/bloco) para a Session ID: {session_id}")
+    session_raw_path = raw_path / session_id
+    if not session_exists(session_raw_path):
+        raise FileNotFoundError(f"Diretório da sessão não encontrado em {session_raw_path}")
+    if not list_session_files(session_raw_path, "player_*_eeg.jsonl"):
+        log.warning("Nenhum dado de EEG encontrado para a sessão. Processo ETL abortado.")
+        return
+
+    trusted_path.mkdir(parents=True, exist_ok=True)
+    output_path = trusted_path / f"{session_id}.parquet"
+    tmp_path = output_path.with_suffix('.parquet.tmp')
+    total_rows = 0
+    try:
+        with pq.ParquetWriter(tmp_path, TRUSTED_SCHEMA, compression='snappy') as writer:
+            for batch_df in iter_merged_session_chunks(session_raw_path, chunk_size, max_lateness_ms):
+                writer.write_table(to_trusted_table(batch_df))
+                total_rows += len(batch_df)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if total_rows == 0:
+        tmp_path.unlink(missing_ok=True)
+        log.warning("Nenhuma linha válida gerada para a sessão. Processo ETL abortado.")
+        return
+    os.replace(tmp_path, output_path)
+    log.info(f"Camada Trusted salva com sucesso em {output_path} ({total_rows} linhas)")
+
+# ------------------------------------------------------------------------------
+# Features espectrais do EEG bruto. Só existem quando a aquisição roda com
+# RAW_EEG_OUTPUT=1: o coletor grava player_<id>_raw.jsonl com pacotes
+# {player, samples, fs, timeStamp} (timeStamp = instante da primeira amostra).
+# ------------------------------------------------------------------------------
+SPECTRAL_SCHEMA = pa.schema(
+    [pa.field('timestamp', pa.timestamp('ms', tz='UTC'), nullable=False),
+     pa.field('player', pa.uint8(), nullable=False)]
+    + [pa.field(col, pa.float32()) for col in FEATURE_COLUMNS]
+)
+
+def _read_raw_eeg_file(session_path: Path, file_name: str):
+    """Lê um player_<id>_raw.jsonl linha a linha (sem DataFrame de listas, que custa ~10x a memória)."""
+    packets, packet_ts, player, fs = [], [], None, RAW_SAMPLE_RATE
+    with open_session_file(session_path, file_name) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            packet = json.loads(line)
+            # rawEeg é um inteiro de 16 bits: float32 representa sem perda
+            packets.append(np.asarray(packet['samples'], dtype=np.float32))
+            packet_ts.append(packet['timeStamp'])
+            player, fs = packet['player'], packet.get('fs', fs)
+    return player, float(fs), packets, np.asarray(packet_ts, dtype=np.float64)
+
+def load_raw_eeg_signals(session_path: Path):
+    """Retorna (player -> amostras, player -> timestamp em ms de cada amostra, taxa de amostragem)."""
+    signals, timestamps, fs = {}, {}, RAW_SAMPLE_RATE
+    for file_name in list_session_files(session_path, "player_*_raw.jsonl"):
+        try:
+            player, fs, packets, packet_ts = _read_raw_eeg_file(session_path, file_name)
+        except Exception:
+            log.warning(f"Falha ao ler ou parsear o arquivo de EEG bruto: {session_path / file_name}", exc_info=True)
+            continue
+        if not packets:
+            continue
+        order = np.argsort(packet_ts, kind='stable')
+        lengths = np.array([len(packets[i]) for i in order])
+        samples = np.concatenate([packets[i] for i in order])
+        # Cada amostra recebe o timestamp do seu pacote mais a sua posição dentro dele
+        packet_starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        sample_ts = np.repeat(packet_ts[order], lengths) + (np.arange(len(samples)) - packet_starts) * 1000.0 / fs
+        signals[int(player)], timestamps[int(player)] = samples, sample_ts
+    return signals, timestamps, fs
+
+def process_spectral_features(session_id: str, raw_path: Path, trusted_path: Path):
+    """Etapa opcional da camada Trusted: grava <session_id>_spectral.parquet, uma linha por janela."""
+    session_raw_path = raw_path / session_id
+    signals, timestamps, fs = load_raw_eeg_signals(session_raw_path)
+    if not signals:
+        log.info("Sessão sem EEG bruto. Etapa de features espectrais ignorada.")
+        return
+    features_df = compute_spectral_features(signals, timestamps, fs)
+    if features_df.empty:
+        log.warning("EEG bruto insuficiente para uma janela completa. Etapa de features espectrais ignorada.")
+        return
+    trusted_path.mkdir(parents=True, exist_ok=True)
+    output_path = trusted_path / f"{session_id}_spectral.parquet"
+    table = pa.Table.from_pandas(features_df, schema=SPECTRAL_SCHEMA, preserve_index=False, safe=False)
+    pq.write_table(table, output_path, compression='snappy')
+    log.info(f"Features espectrais salvas em {output_path} ({len(features_df)} janelas de {len(signals)} player(s))")
+
+def warm_up_etl():
+    """
+    Roda o caminho Raw -> Trusted -> leitura de KPIs com uma sessão mínima em memória, para que
+    os imports internos e caches do pandas/pyarrow sejam pagos no startup e não na primeira corrida.
+    """
+    import io
+    eeg_df = pd.read_json(io.StringIO(json.dumps({
+        'player': 1, 'attention': 50, 'meditation': 50, 'poorSignalLevel': 0, 'status': 'ok', 'source': 'warmup',
+        'eegPower': {band: 1 for band in EEG_BANDS}, 'timeStamp': 0})), lines=True)
+    events_df = pd.read_json(io.StringIO(json.dumps({'player': 1, 'eventType': 'collision', 'timestamp': 1})), lines=True)
+    buffer = io.BytesIO()
+    pq.write_table(to_trusted_table(transform_and_merge(eeg_df, events_df)), buffer, compression='snappy')
+    buffer.seek(0)
+    df = pd.read_parquet(buffer, columns=KPI_COLUMNS)
+    calculate_post_event_metrics(df[df['is_signal_valid']], df[df['game_event_type'].notna()])
+
 # ==============================================================================
 # SEÇÃO 2: LÓGICA DE DATA SCIENCE, COACHING E ATUALIZAÇÃO DE USUÁRIOS
 # ==============================================================================
@@ -117,12 +392,61 @@ def calculate_post_event_metrics(df_valid_signal: pd.DataFrame, events_df: pd.Da
     avg_lfo = results_df['lfo_seconds'].dropna().mean()
     return focus_variation, calm_variation, avg_lfo
 
-def update_global_stats(db, session_kpis):
+class PipelineCancelled(RuntimeError):
+    """O pipeline foi interrompido antes de uma etapa com efeitos externos (ex.: lease perdida)."""
+
+def raise_if_cancelled(cancel: Optional[threading.Event], step: str):
+    if cancel is not None and cancel.is_set():
+        raise PipelineCancelled(f"cancelado antes de: {step}")
+
+def get_firestore_client():
+    """Inicializa o firebase_admin (credenciais padrão) e o cliente Firestore na primeira chamada."""
+    global _firestore_client
+    if _firestore_client is None:
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.ApplicationDefault())
+        _firestore_client = firestore.client()
+    return _firestore_client
+
+def check_firestore(db, timeout: float = 10.0):
+    """
+    Leitura leve de global_stats/summary: valida as credenciais e já deixa o canal gRPC aberto.
+    O prazo é garantido por fora, porque os retries da biblioteca (inclusive na renovação do
+    token) podem ultrapassar o timeout da RPC; levanta TimeoutError se estourar.
+    """
+    outcome = {}
+    def probe():
+        try:
+            db.collection('global_stats').document('summary').get(timeout=timeout)
+        except Exception as e:
+            outcome['error'] = e
+    thread = threading.Thread(target=probe, name="firestore-healthcheck", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(f"Firestore não respondeu em {timeout:g}s")
+    if 'error' in outcome:
+        raise outcome['error']
+
+def _already_applied(session_snapshot, step: str) -> bool:
+    applied = session_snapshot.get(SESSION_APPLIED_FIELD) if session_snapshot.exists else None
+    return bool(applied and applied.get(step))
+
+def _mark_applied(transaction, session_ref, step: str):
+    transaction.set(session_ref, {SESSION_APPLIED_FIELD: {step: True}}, merge=True)
+
+def update_global_stats(db, session_id, session_kpis):
+    from firebase_admin import firestore
     # ... (código existente)
     log.info("Atualizando estatísticas globais...")
     stats_ref = db.collection('global_stats').document('summary')
+    session_ref = db.collection('sessions').document(session_id)
     @firestore.transactional
     def update_in_transaction(transaction, stats_ref, current_session_kpis):
+        if _already_applied(session_ref.get(transaction=transaction), 'globalStats'):
+            return False
         snapshot = stats_ref.get(transaction=transaction)
         stats = snapshot.to_dict() if snapshot.exists else {'all_tzf': [], 'all_lfo': []}
         for _, kpis in current_session_kpis.items():
@@ -141,9 +465,13 @@ def update_global_stats(db, session_kpis):
             'lfoSeconds': {str(p): v for p, v in lfo_percentiles.items()}
         }
         transaction.set(stats_ref, stats)
+        _mark_applied(transaction, session_ref, 'globalStats')
+        return True
     transaction = db.transaction()
-    update_in_transaction(transaction, stats_ref, session_kpis)
-    log.info("Estatísticas globais atualizadas com sucesso.")
+    if update_in_transaction(transaction, stats_ref, session_kpis):
+        log.info("Estatísticas globais atualizadas com sucesso.")
+    else:
+        log.info(f"Sessão {session_id} já contabilizada nas estatísticas globais. Nada a fazer.")
 
 def generate_match_feedback(player_kpis, global_stats):
     # ... (código existente)
@@ -191,8 +519,75 @@ def generate_evolution_feedback(user_profile):
     else:
         return "Você está mantendo um nível de performance consistente, o que é ótimo! O próximo desafio é encontrar novas estratégias para quebrar esse platô e alcançar um novo patamar de foco."
 
+# Cache LRU local (email -> ID do documento). Invalidado quando o commit dos perfis falha.
+_user_id_cache = OrderedDict()
+
+def _email_index_id(email: str) -> str:
+    # IDs de documento no Firestore não podem conter '/'
+    return quote(email.strip().lower(), safe='@.+-_')
+
+def resolve_user_refs(db, emails):
+    """
+    Resolve os documentos de /users para uma lista de emails com no máximo um `get_all`
+    no índice `users_by_email` (emails já em cache não custam leitura). Retorna
+    (email -> DocumentReference, emails que ainda não têm entrada no índice).
+    """
+    users_ref = db.collection('users')
+    index_ref = db.collection(EMAIL_INDEX_COLLECTION)
+    resolved, missing = {}, []
+    for email in emails:
+        user_id = _user_id_cache.get(email)
+        if user_id:
+            _user_id_cache.move_to_end(email)
+            resolved[email] = users_ref.document(user_id)
+        else:
+            missing.append(email)
+
+    unindexed = set()
+    if missing:
+        refs_by_index_id = {_email_index_id(email): email for email in missing}
+        for snapshot in db.get_all([index_ref.document(index_id) for index_id in refs_by_index_id]):
+            if snapshot.exists:
+                resolved[refs_by_index_id[snapshot.id]] = users_ref.document(snapshot.get('userId'))
+        for email in missing:
+            if email in resolved:
+                continue
+            # Usuários criados antes do índice: consulta legada uma única vez, depois o índice é gravado
+            user_query = users_ref.where('email', '==', email).limit(1).get()
+            resolved[email] = user_query[0].reference if user_query else users_ref.document()
+            unindexed.add(email)
+
+    for email, user_ref in resolved.items():
+        _user_id_cache[email] = user_ref.id
+        _user_id_cache.move_to_end(email)
+    while len(_user_id_cache) > USER_ID_CACHE_SIZE:
+        _user_id_cache.popitem(last=False)
+    return resolved, unindexed
+
+def get_race_participants(events_df: pd.DataFrame):
+    """Extrai dos eventos da corrida (player -> email, player -> tempo de prova, player vencedor)."""
+    if events_df.empty:
+        return {}, {}, None
+    start_event_rows = events_df[events_df['eventType'] == 'raceStarted']
+    user_map_list = start_event_rows.iloc[0].get('users', []) if not start_event_rows.empty else []
+    user_mapping = {item['playerId']: item['email'] for item in user_map_list or []}
+    finish_events = events_df[events_df['eventType'] == 'hasFinished']
+    race_times = {row['player']: row['raceTimeSeconds'] for _, row in finish_events.iterrows()}
+    winner_id = min(race_times, key=race_times.get) if race_times else None
+    return user_mapping, race_times, winner_id
+
+def get_race_start_ms(events_df: pd.DataFrame) -> int:
+    """Timestamp (ms) do raceStarted, ou o instante atual se ele não estiver nos eventos."""
+    if not events_df.empty and 'timestamp' in events_df:
+        start_event_rows = events_df[events_df['eventType'] == 'raceStarted']
+        race_start = start_event_rows.iloc[0]['timestamp'] if not start_event_rows.empty else None
+        if pd.notna(race_start):
+            # O read_json converte a coluna 'timestamp' para datetime
+            return int(race_start.value // 10**6) if isinstance(race_start, pd.Timestamp) else int(race_start)
+    return int(datetime.utcnow().timestamp() * 1000)
+
 def update_user_profiles(db, session_id, session_kpis, events_df):
-    # ... (código existente)
+    from firebase_admin import firestore
     log.info("Iniciando atualização de perfis de usuário...")
     start_event_rows = events_df[events_df['eventType'] == 'raceStarted']
     if start_event_rows.empty:
@@ -202,47 +597,71 @@ def update_user_profiles(db, session_id, session_kpis, events_df):
     if not user_map_list:
         log.warning("Mapeamento de usuários (com email) não encontrado. Pulando atualização de perfis.")
         return
-    user_mapping = {item['playerId']: item['email'] for item in user_map_list}
-    finish_events = events_df[events_df['eventType'] == 'hasFinished']
-    race_times = {row['player']: row['raceTimeSeconds'] for _, row in finish_events.iterrows()}
-    winner_id = min(race_times, key=race_times.get) if race_times else None
+    user_mapping, race_times, winner_id = get_race_participants(events_df)
+
+    # Tudo que não depende do documento atual é montado uma vez, fora da transação (e dos retries)
+    race_timestamp = datetime.utcnow().isoformat()
+    player_updates = {}
     for player_id_str, kpis in session_kpis.items():
         player_id = int(player_id_str.split('_')[1])
         email = user_mapping.get(player_id)
         if not email: continue
-        log.info(f"Processando perfil para o email: {email} (Player {player_id})")
-        users_ref = db.collection('users')
-        user_query = users_ref.where('email', '==', email).limit(1).get()
-        user_ref = user_query[0].reference if user_query else users_ref.document()
-        log.info(f"Usuário {'encontrado' if user_query else 'novo'}. ID do Documento: {user_ref.id}")
-        @firestore.transactional
-        def update_in_transaction(transaction, user_ref):
-            snapshot = user_ref.get(transaction=transaction)
-            new_data = snapshot.to_dict() if snapshot.exists else {"email": email, "createdAt": datetime.utcnow().isoformat()}
+        player_updates[email] = {
+            'is_winner': player_id == winner_id,
+            'race_time': race_times.get(player_id),
+            'tzf': kpis['tzf_percentage'],
+            'race_summary': {"sessionId": session_id, "raceTimestamp": race_timestamp, "tzf": kpis['tzf_percentage'], "tzc": kpis['tzc_percentage'], "fatigueSlope": kpis['fatigue_slope'], "lfoSeconds": kpis['lfo_avg_recovery_seconds']},
+        }
+    if not player_updates:
+        return
+
+    user_refs, unindexed = resolve_user_refs(db, list(player_updates))
+    log.info(f"{len(user_refs)} perfil(is) resolvido(s); {len(unindexed)} sem entrada no índice de emails.")
+    session_ref = db.collection('sessions').document(session_id)
+
+    @firestore.transactional
+    def update_in_transaction(transaction):
+        if _already_applied(session_ref.get(transaction=transaction), 'userProfiles'):
+            return False
+        snapshots = {snapshot.id: snapshot for snapshot in transaction.get_all(list(user_refs.values()))}
+        for email, update in player_updates.items():
+            user_ref = user_refs[email]
+            snapshot = snapshots.get(user_ref.id)
+            new_data = snapshot.to_dict() if snapshot is not None and snapshot.exists else {"email": email, "createdAt": race_timestamp}
+            if any(race.get('sessionId') == session_id for race in new_data.get('raceHistory', [])):
+                # Perfil já atualizado por uma execução anterior ao marcador
+                continue
             new_data['totalRaces'] = new_data.get('totalRaces', 0) + 1
-            if player_id == winner_id: new_data['totalWins'] = new_data.get('totalWins', 0) + 1
+            if update['is_winner']: new_data['totalWins'] = new_data.get('totalWins', 0) + 1
             new_data['winPercentage'] = (new_data.get('totalWins', 0) / new_data['totalRaces'])
-            current_race_time = race_times.get(player_id)
-            if current_race_time and current_race_time < new_data.get('bestRaceTimeSeconds', float('inf')):
-                new_data['bestRaceTimeSeconds'] = current_race_time
-            if kpis['tzf_percentage'] > new_data.get('personalBestTzf', 0):
-                new_data['personalBestTzf'] = kpis['tzf_percentage']
+            if update['race_time'] and update['race_time'] < new_data.get('bestRaceTimeSeconds', float('inf')):
+                new_data['bestRaceTimeSeconds'] = update['race_time']
+            if update['tzf'] > new_data.get('personalBestTzf', 0):
+                new_data['personalBestTzf'] = update['tzf']
             history = new_data.get('raceHistory', [])
-            new_race_summary = {"sessionId": session_id, "raceTimestamp": datetime.utcnow().isoformat(), "tzf": kpis['tzf_percentage'], "tzc": kpis['tzc_percentage'],"fatigueSlope": kpis['fatigue_slope'], "lfoSeconds": kpis['lfo_avg_recovery_seconds']}
-            history.append(new_race_summary)
-            new_data['raceHistory'] = history[-10:]
+            history.append(update['race_summary'])
+            new_data['raceHistory'] = history[-RACE_HISTORY_LIMIT:]
             new_data['evolutionFeedback'] = generate_evolution_feedback(new_data)
             transaction.set(user_ref, new_data)
-        transaction = db.transaction()
-        update_in_transaction(transaction, user_ref)
-    log.info("Perfis de usuário atualizados com sucesso.")
+            if email in unindexed:
+                transaction.set(db.collection(EMAIL_INDEX_COLLECTION).document(_email_index_id(email)), {'userId': user_ref.id, 'email': email})
+        _mark_applied(transaction, session_ref, 'userProfiles')
+        return True
+
+    try:
+        applied = update_in_transaction(db.transaction())
+    except Exception:
+        for email in player_updates:
+            _user_id_cache.pop(email, None)
+        raise
+    if applied:
+        log.info("Perfis de usuário atualizados com sucesso.")
+    else:
+        log.info(f"Perfis já atualizados para a sessão {session_id}. Nada a fazer.")
 
 
-def calculate_kpis_for_session(session_id: str, trusted_path: Path, refined_path: Path, raw_path: Path):
-    log.info(f"Iniciando cálculo de KPIs para a Session ID: {session_id}")
-    trusted_file = trusted_path / f"{session_id}.parquet"
-    if not trusted_file.exists(): raise FileNotFoundError("Arquivo da camada Trusted não encontrado.")
-    df = pd.read_parquet(trusted_file)
+def compute_session_kpis(df: pd.DataFrame) -> dict:
+    """KPIs de cada jogador a partir da tabela Trusted (colunas KPI_COLUMNS), sem I/O."""
     players = df['player'].dropna().unique()
     session_kpis = {}
     for player_id in players:
@@ -269,24 +688,34 @@ def calculate_kpis_for_session(session_id: str, trusted_path: Path, refined_path
         player_kpis = {'valid_session_percentage': round(valid_session_pct, 2), 'tzf_percentage': round(tzf_pct, 2), 'tzc_percentage': round(tzc_pct, 2), 'calm_focus_percentage': round(calm_focus_pct, 2), 'cvf_label': cvf_label, 'cvf_attention_std_dev': round(attention_std_dev, 2), 'fatigue_slope': round(fatigue_slope, 5), 'post_event_focus_variation': focus_variation, 'post_event_calm_variation': calm_variation, 'lfo_avg_recovery_seconds': round(avg_lfo, 2) if avg_lfo is not None and pd.notna(avg_lfo) else None}
         session_kpis[f'player_{player_id}'] = player_kpis
         log.debug(f"KPIs calculados para Player {player_id}: {json.dumps(player_kpis, indent=2)}")
+    return session_kpis
+
+def calculate_kpis_for_session(session_id: str, trusted_path: Path, refined_path: Path, raw_path: Path, analytics_store=None,
+                               cancel: Optional[threading.Event] = None):
+    log.info(f"Iniciando cálculo de KPIs para a Session ID: {session_id}")
+    trusted_file = trusted_path / f"{session_id}.parquet"
+    if not trusted_file.exists(): raise FileNotFoundError("Arquivo da camada Trusted não encontrado.")
+    df = pd.read_parquet(trusted_file, columns=KPI_COLUMNS)
+    session_kpis = compute_session_kpis(df)
 
     if session_kpis:
+        events_df = load_game_events(raw_path / session_id)
+        # Daqui em diante há escritas no Firestore, na Refined e no banco analítico
+        raise_if_cancelled(cancel, "gravação dos KPIs")
         try:
-            log.info("Autenticando com Firebase...")
-            if not firebase_admin._apps:
-                cred = credentials.ApplicationDefault()
-                firebase_admin.initialize_app(cred)
-            db = firestore.client()
-            update_global_stats(db, session_kpis)
+            if _firestore_client is None:
+                log.info("Autenticando com Firebase...")
+            db = get_firestore_client()
+            update_global_stats(db, session_id, session_kpis)
             global_stats_doc = db.collection('global_stats').document('summary').get()
             global_stats = global_stats_doc.to_dict() if global_stats_doc.exists else {}
             for player_key, kpis in session_kpis.items():
                 kpis['coachFeedback'] = generate_match_feedback(kpis, global_stats)
             doc_ref = db.collection('sessions').document(session_id)
-            doc_ref.set(session_kpis)
+            # Só os campos dos jogadores: um set completo apagaria o marcador SESSION_APPLIED_FIELD
+            doc_ref.set(session_kpis, merge=list(session_kpis))
             log.info(f"Dados da sessão {session_id} (com feedback) salvos com sucesso!")
             
-            events_df = load_game_events(raw_path / session_id)
             if not events_df.empty:
                 update_user_profiles(db, session_id, session_kpis, events_df)
         except Exception:
@@ -297,4 +726,16 @@ def calculate_kpis_for_session(session_id: str, trusted_path: Path, refined_path
         output_path = refined_path / f"{session_id}_summary.json"
         with open(output_path, 'w') as f:
             json.dump(session_kpis, f, indent=4)
-        log.info(f"Sumário de KPIs salvo localmente em {output_path}")
\ No newline at end of file
+        log.info(f"Sumário de KPIs salvo localmente em {output_path}")
+        user_mapping, race_times, winner_id = get_race_participants(events_df)
+        race_ts = get_race_start_ms(events_df)
+        # Participantes e horário ao lado do sumário: o backfill do banco analítico não depende da Raw
+        write_race_info(race_info_path(refined_path, session_id), race_ts, user_mapping, race_times, winner_id)
+
+        if analytics_store is not None:
+            try:
+                if analytics_store.record_session(session_id, session_kpis, race_ts,
+                                                  user_mapping, race_times, winner_id):
+                    log.info(f"KPIs da sessão {session_id} registrados no banco analítico.")
+            except Exception:
+                log.error(f"Falha ao registrar a sessão {session_id} no banco analítico.", exc_info=True)
\ No newline at end of file
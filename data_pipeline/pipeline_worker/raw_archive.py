@@ -0,0 +1,276 @@
+# raw_archive.py - arquivamento das sessões Raw já processadas em um único arquivo zstd
+#
+# Camadas de armazenamento de uma sessão:
+#   1. raw_data/<sessão>/*.jsonl   quente: onde o coletor escreve
+#   2. raw_data/<sessão>.rawz      morna: sessão processada e encerrada pelo coletor (marcador
+#                                  <sessão>/.closed) há mais que o período de carência
+#   3. removida                    quando os arquivos .rawz passam do orçamento de disco
+#                                  (a Trusted e a Refined continuam lá)
+#
+# Formato do .rawz: cada .jsonl da sessão é um frame zstd independente, seguido de um índice
+# JSON (nome -> offset, tamanhos) e de um rodapé [offset do índice: u64][MAGIC]. Um arquivo
+# é lido sem descompactar os outros, em streaming, linha a linha.
+#
+# Os leitores do processing_logic usam list_session_files/open_session_file, que atendem tanto
+# o diretório quanto o .rawz, então reprocessar uma sessão arquivada é transparente. Se a sessão
+# tem os dois (escrita tardia depois do arquivamento), cada arquivo é lido como o conteúdo do
+# .rawz seguido do que está no diretório, e o próximo arquivamento junta os dois.
+#
+# Uso: python raw_archive.py archive <raw_data> [sessão ...]   arquiva (padrão: todas as sessões)
+#      python raw_archive.py report <raw_data>                 taxa de compressão e velocidade de leitura
+#      python raw_archive.py retention <raw_data> <MB>         aplica o orçamento de disco
+#      python raw_archive.py cat <raw_data> <sessão> <arquivo> escreve um arquivo na saída padrão
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import fnmatch
+import logging
+from pathlib import Path
+from contextlib import ExitStack, contextmanager
+
+import zstandard
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = '.rawz'
+# Gravado pelo coletor no diretório da sessão quando ela é encerrada
+CLOSED_MARKER = '.closed'
+MAGIC = b'NRRAWZ01'
+FOOTER = struct.Struct('>Q8s')
+DEFAULT_LEVEL = 10
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def archive_path_for(session_path: Path) -> Path:
+    return session_path.parent / f"{session_path.name}{ARCHIVE_SUFFIX}"
+
+
+class _FileSlice(io.RawIOBase):
+    """Janela somente leitura [offset, offset + size) de um arquivo aberto: o leitor zstd não passa do frame."""
+
+    def __init__(self, f, offset: int, size: int):
+        self._f = f
+        self._remaining = size
+        f.seek(offset)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self._f.readinto(memoryview(buffer)[:min(len(buffer), self._remaining)])
+        self._remaining -= n
+        return n
+
+
+class _Chain(io.RawIOBase):
+    """Leitura sequencial de vários leitores binários, como se fossem um só."""
+
+    def __init__(self, readers: list):
+        self._readers = list(readers)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._readers:
+            n = self._readers[0].readinto(buffer)
+            if n:
+                return n
+            self._readers.pop(0)
+        return 0
+
+
+class SessionArchive:
+    """Leitura de um .rawz: índice carregado na abertura, arquivos descompactados sob demanda."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            f.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} não é um arquivo de sessão válido")
+            f.seek(index_offset)
+            self.index = json.loads(f.read(os.path.getsize(self.path) - FOOTER.size - index_offset))
+
+    def names(self) -> list:
+        return sorted(self.index['files'])
+
+    @contextmanager
+    def open_binary(self, name: str):
+        entry = self.index['files'][name]
+        with open(self.path, 'rb') as f:
+            frame = _FileSlice(f, entry['offset'], entry['size'])
+            with zstandard.ZstdDecompressor().stream_reader(frame, read_size=COPY_CHUNK_SIZE, closefd=False) as reader:
+                yield reader
+
+    @contextmanager
+    def open(self, name: str):
+        with self.open_binary(name) as reader:
+            yield io.TextIOWrapper(io.BufferedReader(reader, COPY_CHUNK_SIZE), encoding='utf-8')
+
+
+def _archive_or_none(session_path: Path):
+    archive = archive_path_for(session_path)
+    return SessionArchive(archive) if archive.exists() else None
+
+
+def _directory_files(session_path: Path) -> list:
+    if not session_path.is_dir():
+        return []
+    return sorted(p.name for p in session_path.iterdir() if p.is_file() and not p.name.startswith('.'))
+
+
+def list_session_files(session_path: Path, pattern: str) -> list:
+    """Nomes dos arquivos da sessão que casam com `pattern`, no diretório e/ou no .rawz."""
+    archive = _archive_or_none(session_path)
+    names = set(_directory_files(session_path)) | set(archive.names() if archive else [])
+    return sorted(name for name in names if fnmatch.fnmatch(name, pattern))
+
+
+def session_exists(session_path: Path) -> bool:
+    return session_path.is_dir() or archive_path_for(session_path).exists()
+
+
+@contextmanager
+def open_session_binary(session_path: Path, name: str):
+    """Abre um arquivo da sessão em modo binário: o trecho do .rawz (se houver) seguido do diretório."""
+    archive = _archive_or_none(session_path)
+    with ExitStack() as stack:
+        readers = []
+        if archive is not None and name in archive.index['files']:
+            readers.append(stack.enter_context(archive.open_binary(name)))
+        if (session_path / name).is_file():
+            readers.append(stack.enter_context(open(session_path / name, 'rb')))
+        if not readers:
+            raise FileNotFoundError(f"{name} não encontrado na sessão {session_path.name}")
+        yield readers[0] if len(readers) == 1 else _Chain(readers)
+
+
+@contextmanager
+def open_session_file(session_path: Path, name: str):
+    """Abre um arquivo da sessão em modo texto, do diretório e/ou do .rawz (em streaming)."""
+    if session_path.is_dir() and archive_path_for(session_path).exists():
+        log.warning(f"Sessão {session_path.name} tem dados no {ARCHIVE_SUFFIX} e no diretório (escrita tardia); lendo os dois.")
+    with open_session_binary(session_path, name) as reader:
+        yield io.TextIOWrapper(io.BufferedReader(reader, COPY_CHUNK_SIZE), encoding='utf-8')
+
+
+def ready_to_archive(session_path: Path, grace_seconds: float) -> bool:
+    """True se o coletor encerrou a sessão e nada foi escrito nela há mais de `grace_seconds`."""
+    if not (session_path / CLOSED_MARKER).exists():
+        return False
+    last_write = max(p.stat().st_mtime for p in session_path.iterdir())
+    return time.time() - last_write > grace_seconds
+
+
+def archive_session(session_path: Path, level: int = DEFAULT_LEVEL, remove_source: bool = True) -> dict:
+    """
+    Compacta os arquivos da sessão em <sessão>.rawz e, depois de conferir o conteúdo do
+    arquivo gravado, remove o diretório original. Se a sessão já tinha um .rawz (escrita
+    tardia), cada arquivo do novo .rawz é o conteúdo antigo seguido do diretório.
+    Retorna as estatísticas da operação.
+    """
+    archive = archive_path_for(session_path)
+    tmp_archive = archive.with_suffix(ARCHIVE_SUFFIX + '.tmp')
+    previous = _archive_or_none(session_path)
+    names = sorted(set(_directory_files(session_path)) | set(previous.names() if previous else []))
+    expected_sizes = {name: (previous.index['files'][name]['raw_size'] if previous and name in previous.index['files'] else 0)
+                            + ((session_path / name).stat().st_size if (session_path / name).is_file() else 0)
+                      for name in names}
+    if previous:
+        log.warning(f"Sessão {session_path.name} já tinha um {ARCHIVE_SUFFIX}: juntando com {len(_directory_files(session_path))} "
+                    f"arquivo(s) escritos depois do arquivamento.")
+    started = time.perf_counter()
+    cctx = zstandard.ZstdCompressor(level=level, write_content_size=True)
+    index = {'session': session_path.name, 'level': level, 'files': {}}
+    with open(tmp_archive, 'wb') as out:
+        for name in names:
+            offset = out.tell()
+            with open_session_binary(session_path, name) as src:
+                raw_size, _ = cctx.copy_stream(src, out, size=expected_sizes[name],
+                                               read_size=COPY_CHUNK_SIZE, write_size=COPY_CHUNK_SIZE)
+            index['files'][name] = {'offset': offset, 'size': out.tell() - offset, 'raw_size': raw_size}
+        index_offset = out.tell()
+        out.write(json.dumps(index).encode('utf-8'))
+        out.write(FOOTER.pack(index_offset, MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+    compress_seconds = time.perf_counter() - started
+
+    # Confere cada arquivo antes de apagar a origem
+    check = SessionArchive(tmp_archive)
+    for name, entry in check.index['files'].items():
+        with check.open_binary(name) as reader:
+            read_size = sum(len(chunk) for chunk in iter(lambda: reader.read(COPY_CHUNK_SIZE), b''))
+        if read_size != entry['raw_size'] or read_size != expected_sizes[name]:
+            tmp_archive.unlink()
+            raise IOError(f"Verificação do arquivo da sessão {session_path.name} falhou em {name}")
+    os.replace(tmp_archive, archive)
+    if remove_source:
+        shutil.rmtree(session_path)
+
+    raw_bytes = sum(entry['raw_size'] for entry in index['files'].values())
+    archived_bytes = archive.stat().st_size
+    return {'session': session_path.name, 'files': len(names), 'raw_bytes': raw_bytes, 'archived_bytes': archived_bytes,
+            'ratio': raw_bytes / archived_bytes if archived_bytes else 0.0, 'seconds': compress_seconds}
+
+
+def enforce_retention(raw_path: Path, budget_bytes: int) -> list:
+    """Remove os .rawz mais antigos até o total caber em `budget_bytes`. Retorna as sessões removidas."""
+    archives = sorted(raw_path.glob(f'*{ARCHIVE_SUFFIX}'), key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in archives)
+    evicted = []
+    for archive in archives:
+        if total <= budget_bytes:
+            break
+        total -= archive.stat().st_size
+        archive.unlink()
+        evicted.append(archive.name[:-len(ARCHIVE_SUFFIX)])
+    if evicted:
+        log.info(f"Retenção: {len(evicted)} sessão(ões) arquivada(s) removida(s); {total / 1024 / 1024:.1f} MB em arquivos.")
+    return evicted
+
+
+def read_speed(archive_path: Path) -> dict:
+    """Lê (descompacta e decodifica linha a linha) todos os arquivos de um .rawz e mede a vazão."""
+    archive = SessionArchive(archive_path)
+    started = time.perf_counter()
+    lines = 0
+    for name in archive.names():
+        with archive.open(name) as f:
+            lines += sum(1 for _ in f)
+    seconds = time.perf_counter() - started
+    raw_bytes = sum(entry['raw_size'] for entry in archive.index['files'].values())
+    return {'lines': lines, 'seconds': seconds, 'mb_per_second': raw_bytes / 1024 / 1024 / seconds if seconds else 0.0}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    command, raw_path = sys.argv[1], Path(sys.argv[2])
+    if command == 'archive':
+        sessions = sys.argv[3:] or sorted(p.name for p in raw_path.iterdir() if p.is_dir())
+        level = int(os.getenv('RAW_ARCHIVE_LEVEL', DEFAULT_LEVEL))
+        for session_id in sessions:
+            stats = archive_session(raw_path / session_id, level=level)
+            log.info(f"{session_id}: {stats['raw_bytes'] / 1024 / 1024:.1f} MB -> {stats['archived_bytes'] / 1024 / 1024:.1f} MB "
+                     f"(razão {stats['ratio']:.1f}x) em {stats['seconds']:.2f}s")
+    elif command == 'report':
+        for archive_file in sorted(raw_path.glob(f'*{ARCHIVE_SUFFIX}')):
+            index = SessionArchive(archive_file).index
+            raw_bytes = sum(entry['raw_size'] for entry in index['files'].values())
+            speed = read_speed(archive_file)
+            print(f"{archive_file.name}: {raw_bytes / 1024 / 1024:.1f} MB -> {archive_file.stat().st_size / 1024 / 1024:.1f} MB "
+                  f"(razão {raw_bytes / archive_file.stat().st_size:.1f}x, nível {index['level']}) | "
+                  f"leitura {speed['mb_per_second']:.0f} MB/s ({speed['lines']} linhas)")
+    elif command == 'retention':
+        enforce_retention(raw_path, int(float(sys.argv[3]) * 1024 * 1024))
+    elif command == 'cat':
+        with open_session_file(raw_path / sys.argv[3], sys.argv[4]) as f:
+            shutil.copyfileobj(f, sys.stdout)
+    else:
+        sys.exit(f"Comando desconhecido: {command}")
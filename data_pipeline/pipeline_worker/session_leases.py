@@ -0,0 +1,187 @@
+# session_leases.py - distribuição de sessões entre vários pipeline workers
+#
+# Todo worker recebe o mesmo 'hasFinished' do Broker. Para que cada sessão seja processada por um
+# só, o worker precisa antes tomar a lease da sessão, um arquivo no volume compartilhado:
+#
+#   <LEASE_DIR>/<sessão>.lease    dono, token e validade; renovada enquanto o pipeline roda
+#   <LEASE_DIR>/<sessão>.done     pipeline concluído; a sessão não é mais tomada
+#   <LEASE_DIR>/<sessão>.failed   desistência após LEASE_MAX_ATTEMPTS tentativas
+#
+# Toda leitura-e-escrita de uma lease (tomar, roubar uma vencida, renovar, concluir) acontece com
+# um flock exclusivo em <LEASE_DIR>/.NN.lock (um entre LOCK_STRIPES arquivos, escolhido pelo hash
+# da sessão): uma renovação nunca sobrescreve uma lease que outro worker acabou de roubar, e um
+# worker que perdeu a lease não marca a sessão como concluída. Entre containers do mesmo host o
+# flock vale pelo kernel; em NFS o cliente Linux o converte em lock POSIX (requer lockd).
+# Quem perde a lease é avisado pelo Event do heartbeat e deve interromper o pipeline.
+# Os workers varrem as leases vencidas periodicamente, então uma sessão cujo worker caiu é
+# retomada por outro mesmo sem um novo 'hasFinished'. A validade usa o relógio de parede:
+# hosts diferentes precisam de relógios sincronizados (NTP).
+#
+# Uso: python session_leases.py <pasta das leases>   lista leases, concluídas e falhas
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import fcntl
+import logging
+import threading
+from pathlib import Path
+from typing import List, Optional
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+LOCK_STRIPES = 64
+
+
+class SessionLeases:
+    def __init__(self, lease_dir: Path, worker_id: str, lease_seconds: float = 120.0, max_attempts: int = 3):
+        self.lease_dir = Path(lease_dir)
+        self.lease_dir.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._tokens = {}
+
+    def _path(self, session_id: str, kind: str) -> Path:
+        return self.lease_dir / f"{session_id}.{kind}"
+
+    def _read(self, path: Path) -> Optional[dict]:
+        try:
+            return json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_tmp(self, record: dict) -> Path:
+        tmp_path = self.lease_dir / f".{uuid.uuid4().hex}.tmp"
+        tmp_path.write_text(json.dumps(record))
+        return tmp_path
+
+    @contextmanager
+    def _locked(self, session_id: str):
+        """Exclusão mútua (entre processos e hosts) para as operações sobre a lease da sessão."""
+        stripe = zlib.crc32(session_id.encode('utf-8')) % LOCK_STRIPES
+        with open(self.lease_dir / f".{stripe:02d}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _owns(self, session_id: str, current: Optional[dict]) -> bool:
+        return current is not None and current['token'] == self._tokens.get(session_id)
+
+    def _create(self, session_id: str, attempt: int):
+        """Grava uma lease nova deste worker (chamado com o lock da sessão)."""
+        token = uuid.uuid4().hex
+        tmp_path = self._write_tmp({'session': session_id, 'worker': self.worker_id, 'token': token,
+                                    'attempt': attempt, 'expires_at': time.time() + self.lease_seconds})
+        os.replace(tmp_path, self._path(session_id, 'lease'))
+        self._tokens[session_id] = token
+
+    def is_finished(self, session_id: str) -> bool:
+        return self._path(session_id, 'done').exists() or self._path(session_id, 'failed').exists()
+
+    def claim(self, session_id: str) -> bool:
+        """Tenta tomar a sessão. False se ela está com outro worker, concluída ou abandonada."""
+        with self._locked(session_id):
+            if self.is_finished(session_id):
+                return False
+            current = self._read(self._path(session_id, 'lease'))
+            if current is None:
+                self._create(session_id, attempt=1)
+                return True
+            if current['expires_at'] > time.time():
+                return False
+            if current['attempt'] >= self.max_attempts:
+                self._mark(session_id, 'failed', attempts=current['attempt'])
+                self._path(session_id, 'lease').unlink(missing_ok=True)
+                log.error(f"Sessão {session_id} abandonada após {current['attempt']} tentativa(s) (último worker: {current['worker']}).")
+                return False
+            log.warning(f"Lease vencida da sessão {session_id} (worker {current['worker']}). Retomando, tentativa {current['attempt'] + 1}.")
+            self._create(session_id, attempt=current['attempt'] + 1)
+            return True
+
+    def renew(self, session_id: str) -> bool:
+        """Estende a validade da lease. False se ela não pertence mais a este worker."""
+        lease_path = self._path(session_id, 'lease')
+        with self._locked(session_id):
+            current = self._read(lease_path)
+            if not self._owns(session_id, current):
+                return False
+            current['expires_at'] = time.time() + self.lease_seconds
+            os.replace(self._write_tmp(current), lease_path)
+            return True
+
+    def _mark(self, session_id: str, kind: str, **details):
+        tmp_path = self._write_tmp({'session': session_id, 'worker': self.worker_id, 'at': time.time(), **details})
+        os.replace(tmp_path, self._path(session_id, kind))
+
+    def complete(self, session_id: str) -> bool:
+        """Marca a sessão como concluída e libera a lease. False (e nada muda) se a lease não é mais deste worker."""
+        lease_path = self._path(session_id, 'lease')
+        with self._locked(session_id):
+            owned = self._owns(session_id, self._read(lease_path))
+            self._tokens.pop(session_id, None)
+            if not owned:
+                return False
+            self._mark(session_id, 'done')
+            lease_path.unlink(missing_ok=True)
+            return True
+
+    def release(self, session_id: str):
+        """Desiste da sessão sem concluí-la: ela volta a ser tomada quando a lease vencer."""
+        self._tokens.pop(session_id, None)
+
+    @contextmanager
+    def heartbeat(self, session_id: str):
+        """
+        Renova a lease em segundo plano (a cada 1/3 da validade) enquanto o bloco roda. O bloco recebe
+        um threading.Event marcado quando a lease é perdida: a partir daí o trabalho deve ser interrompido.
+        """
+        stop, lost = threading.Event(), threading.Event()
+
+        def renew_loop():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    renewed = self.renew(session_id)
+                except OSError:
+                    log.warning(f"Falha ao renovar a lease da sessão {session_id}. Nova tentativa em seguida.", exc_info=True)
+                    continue
+                if not renewed:
+                    log.warning(f"Lease da sessão {session_id} perdida para outro worker durante o processamento.")
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=renew_loop, name=f"lease-{session_id}", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+
+    def expired_sessions(self) -> List[str]:
+        """Sessões com lease vencida e não concluídas, das mais antigas para as mais novas."""
+        now = time.time()
+        expired = []
+        for lease_path in self.lease_dir.glob('*.lease'):
+            current = self._read(lease_path)
+            if current is not None and current['expires_at'] <= now:
+                expired.append((current['expires_at'], current['session']))
+        return [session_id for _, session_id in sorted(expired)]
+
+
+if __name__ == '__main__':
+    lease_dir = Path(sys.argv[1])
+    now = time.time()
+    for lease_path in sorted(lease_dir.glob('*.lease')):
+        lease = json.loads(lease_path.read_text())
+        remaining = lease['expires_at'] - now
+        state = f"vence em {remaining:.0f}s" if remaining > 0 else f"VENCIDA há {-remaining:.0f}s"
+        print(f"{lease['session']}: {lease['worker']} (tentativa {lease['attempt']}), {state}")
+    print(f"{len(list(lease_dir.glob('*.done')))} concluída(s), {len(list(lease_dir.glob('*.failed')))} abandonada(s)")
+    for failed_path in sorted(lease_dir.glob('*.failed')):
+        print(f"  falhou: {failed_path.stem}")
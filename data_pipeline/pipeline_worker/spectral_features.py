@@ -0,0 +1,283 @@
+# spectral_features.py - features espectrais calculadas a partir do EEG bruto (rawEeg, 512 Hz)
+#
+# Para cada janela deslizante do sinal: PSD de Welch, potência absoluta e relativa por banda,
+# razão alpha/theta e entropia espectral. As janelas de todos os players são visões estridadas
+# de um único sinal concatenado e são processadas com FFTs em lote (uma chamada de rfft por
+# bloco de janelas), sem laço por janela. O mesmo núcleo atende a etapa de ETL (sessão inteira) e o modo em tempo
+# real (SpectralStream, alimentado pacote a pacote).
+#
+# Benchmark: python spectral_features.py  (reporta janelas/s; o FFT do NumPy usa um único núcleo)
+import os
+import time
+import logging
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+if TYPE_CHECKING:
+    import pandas as pd  # só a etapa de ETL usa; o serviço em tempo real não paga o import
+
+log = logging.getLogger(__name__)
+
+RAW_SAMPLE_RATE = 512          # taxa do rawEeg do ThinkGear
+WINDOW_SECONDS = float(os.getenv('SPECTRAL_WINDOW_SECONDS', '2.0'))
+STEP_SECONDS = float(os.getenv('SPECTRAL_STEP_SECONDS', '0.5'))
+WELCH_SEGMENT_SECONDS = 1.0    # resolução de 1 Hz
+# Janelas por bloco de FFT: limita a memória e mantém o bloco no cache (512 foi o mais rápido no benchmark)
+WINDOWS_PER_BLOCK = 512
+
+SPECTRAL_BANDS = {
+    'delta': (0.5, 4.0),
+    'theta': (4.0, 8.0),
+    'alpha': (8.0, 13.0),
+    'beta': (13.0, 30.0),
+    'gamma': (30.0, 45.0),
+}
+TOTAL_POWER_RANGE = (0.5, 45.0)
+
+FEATURE_COLUMNS = ([f'{band}_power' for band in SPECTRAL_BANDS]
+                   + [f'{band}_rel' for band in SPECTRAL_BANDS]
+                   + ['alpha_theta_ratio', 'spectral_entropy'])
+
+
+def welch_psd(windows: np.ndarray, fs: float, nperseg: int, noverlap: Optional[int] = None):
+    """
+    PSD de Welch para um lote de janelas (n_janelas, n_amostras), equivalente a
+    scipy.signal.welch(..., window='hann', detrend='constant', scaling='density').
+    Retorna (frequências, psd com forma (n_janelas, n_frequências)).
+    """
+    noverlap = nperseg // 2 if noverlap is None else noverlap
+    step = nperseg - noverlap
+    # (n_janelas, n_segmentos, nperseg), sem cópia
+    segments = sliding_window_view(windows, nperseg, axis=-1)[:, ::step, :]
+    taper = np.hanning(nperseg + 1)[:-1]  # Hann periódica, como a do scipy
+    segments = (segments - segments.mean(axis=-1, keepdims=True)) * taper
+    spectrum = np.fft.rfft(segments, axis=-1)
+    psd = (spectrum.real ** 2 + spectrum.imag ** 2).mean(axis=1)
+    psd /= fs * (taper ** 2).sum()
+    # Espectro unilateral: dobra tudo menos DC (e Nyquist, quando nperseg é par)
+    psd[:, 1:-1 if nperseg % 2 == 0 else None] *= 2
+    return np.fft.rfftfreq(nperseg, 1.0 / fs), psd
+
+
+def band_features(freqs: np.ndarray, psd: np.ndarray) -> np.ndarray:
+    """Converte PSDs (n_janelas, n_freq) na matriz de features, colunas na ordem de FEATURE_COLUMNS."""
+    df = freqs[1] - freqs[0]
+    total_mask = (freqs >= TOTAL_POWER_RANGE[0]) & (freqs < TOTAL_POWER_RANGE[1])
+    total_psd = psd[:, total_mask]
+    total_power = total_psd.sum(axis=1) * df
+    safe_total = np.where(total_power > 0, total_power, np.nan)
+
+    powers = np.stack([psd[:, (freqs >= low) & (freqs < high)].sum(axis=1) * df
+                       for low, high in SPECTRAL_BANDS.values()], axis=1)
+    relative = powers / safe_total[:, None]
+
+    bands = list(SPECTRAL_BANDS)
+    theta = powers[:, bands.index('theta')]
+    alpha = powers[:, bands.index('alpha')]
+    alpha_theta = alpha / np.where(theta > 0, theta, np.nan)
+
+    # Entropia de Shannon da distribuição de potência, normalizada para [0, 1]
+    p = total_psd / (total_psd.sum(axis=1, keepdims=True) + 1e-30)
+    entropy = -(p * np.log2(p, out=np.zeros_like(p), where=p > 0)).sum(axis=1) / np.log2(total_psd.shape[1])
+
+    return np.column_stack([powers, relative, alpha_theta, entropy])
+
+
+def window_starts(n_samples: int, window: int, step: int) -> np.ndarray:
+    """Índices de início de todas as janelas completas de um sinal com n_samples amostras."""
+    if n_samples < window:
+        return np.empty(0, dtype=np.int64)
+    return np.arange(0, n_samples - window + 1, step)
+
+
+def compute_window_features(signal: np.ndarray, starts: np.ndarray, window: int,
+                            fs: float = RAW_SAMPLE_RATE, nperseg: Optional[int] = None) -> np.ndarray:
+    """
+    Features das janelas signal[s:s + window] para cada s em `starts`. As janelas são visões
+    estridadas do sinal e só viram cópia um bloco de WINDOWS_PER_BLOCK por vez, então a memória
+    não cresce com a duração da sessão.
+    """
+    nperseg = nperseg or int(WELCH_SEGMENT_SECONDS * fs)
+    all_windows = sliding_window_view(np.asarray(signal, dtype=np.float64), window)
+    out = np.empty((len(starts), len(FEATURE_COLUMNS)), dtype=np.float64)
+    for first in range(0, len(starts), WINDOWS_PER_BLOCK):
+        block = all_windows[starts[first:first + WINDOWS_PER_BLOCK]]
+        freqs, psd = welch_psd(block, fs, nperseg)
+        out[first:first + len(block)] = band_features(freqs, psd)
+    return out
+
+
+def _stack_signals(signals: list, starts: list):
+    """Concatena os sinais de vários players e desloca os inícios de janela para o sinal único."""
+    offsets = np.cumsum([0] + [len(signal) for signal in signals[:-1]])
+    return (np.concatenate(signals).astype(np.float64, copy=False),
+            np.concatenate([player_starts + offset for player_starts, offset in zip(starts, offsets)]))
+
+
+def compute_spectral_features(signals: Dict[int, np.ndarray], timestamps: Dict[int, np.ndarray],
+                              fs: float = RAW_SAMPLE_RATE, window_seconds: float = WINDOW_SECONDS,
+                              step_seconds: float = STEP_SECONDS) -> 'pd.DataFrame':
+    """
+    Features de todas as janelas deslizantes de todos os players de uma vez.
+      signals:    player -> amostras brutas (1D)
+      timestamps: player -> timestamp (ms) de cada amostra
+    Cada linha do resultado é uma janela, marcada pelo timestamp da sua última amostra.
+    """
+    import pandas as pd
+    window = int(window_seconds * fs)
+    step = int(step_seconds * fs)
+    player_signals, player_starts, players, window_ts = [], [], [], []
+    for player, signal in signals.items():
+        starts = window_starts(len(signal), window, step)
+        if len(starts) == 0:
+            continue
+        player_signals.append(np.asarray(signal))
+        player_starts.append(starts)
+        players.append(np.full(len(starts), player))
+        window_ts.append(np.asarray(timestamps[player])[starts + window - 1])
+
+    if not player_signals:
+        return pd.DataFrame(columns=['timestamp', 'player'] + FEATURE_COLUMNS)
+
+    features = compute_window_features(*_stack_signals(player_signals, player_starts), window, fs)
+    result = pd.DataFrame(features, columns=FEATURE_COLUMNS)
+    result.insert(0, 'player', np.concatenate(players))
+    result.insert(0, 'timestamp', pd.to_datetime(np.concatenate(window_ts), unit='ms', utc=True))
+    return result
+
+
+class SpectralStream:
+    """
+    Versão incremental para tempo real. Amostras chegam em pacotes por player (push) e, a cada
+    chamada de compute_ready, todas as janelas que se completaram desde a última chamada, de
+    todos os players, são calculadas em um único lote.
+
+    O buffer de cada player precisa ser contínuo: cada pacote é conferido contra o instante
+    esperado (início do buffer + amostras / fs). Uma lacuna maior que um período de amostragem
+    (pacote perdido) descarta o buffer e recomeça no pacote; um pacote atrasado ou repetido
+    (handlers do socketio rodam em paralelo) é descartado, porque o buffer já seguiu sem ele.
+    Pode ser usado de várias threads: push, reset e compute_ready travam o player que tocam.
+    """
+
+    def __init__(self, fs: float = RAW_SAMPLE_RATE, window_seconds: float = WINDOW_SECONDS,
+                 step_seconds: float = STEP_SECONDS):
+        self.fs = fs
+        self.window = int(window_seconds * fs)
+        self.step = int(step_seconds * fs)
+        self._buffers: Dict[int, np.ndarray] = {}
+        # Timestamp (ms) da primeira amostra ainda no buffer de cada player
+        self._buffer_start_ms: Dict[int, float] = {}
+        self._sample_ms = 1000.0 / fs
+        self._player_locks: Dict[int, threading.Lock] = {}
+        self._player_locks_lock = threading.Lock()
+        # Contadores para o log do serviço: buffers descartados por lacuna, pacotes atrasados descartados
+        self.gaps = 0
+        self.late_packets = 0
+
+    def _lock(self, player: int) -> threading.Lock:
+        with self._player_locks_lock:
+            return self._player_locks.setdefault(player, threading.Lock())
+
+    def push(self, player: int, samples, timestamp_ms: float) -> bool:
+        """
+        Acrescenta um pacote de amostras contíguas; timestamp_ms é o instante da primeira delas.
+        Retorna False se o pacote foi descartado por chegar atrasado.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        with self._lock(player):
+            buffer = self._buffers.get(player)
+            if buffer is not None:
+                drift_ms = timestamp_ms - (self._buffer_start_ms[player] + len(buffer) * self._sample_ms)
+                if drift_ms < -self._sample_ms:
+                    self.late_packets += 1
+                    return False
+                if drift_ms > self._sample_ms:
+                    self.gaps += 1
+                    buffer = None
+            if buffer is None:
+                self._buffers[player] = samples
+                self._buffer_start_ms[player] = timestamp_ms
+            else:
+                self._buffers[player] = np.concatenate([buffer, samples])
+            return True
+
+    def reset(self, player: Optional[int] = None):
+        """Descarta o buffer de um player (ex.: após uma falha de sinal) ou de todos."""
+        for key in ([player] if player is not None else list(self._buffers)):
+            with self._lock(key):
+                self._buffers.pop(key, None)
+                self._buffer_start_ms.pop(key, None)
+
+    def compute_ready(self) -> List[dict]:
+        player_signals, player_starts, meta = [], [], []
+        for player in list(self._buffers):
+            with self._lock(player):
+                buffer = self._buffers.get(player)
+                if buffer is None:
+                    continue
+                starts = window_starts(len(buffer), self.window, self.step)
+                if len(starts) == 0:
+                    continue
+                player_signals.append(buffer)
+                player_starts.append(starts)
+                start_ms = self._buffer_start_ms[player]
+                meta.extend((player, start_ms + (s + self.window - 1) * 1000.0 / self.fs) for s in starts)
+                # Mantém só o que ainda fará parte de janelas futuras
+                consumed = starts[-1] + self.step
+                self._buffers[player] = buffer[consumed:].copy()
+                self._buffer_start_ms[player] = start_ms + consumed * 1000.0 / self.fs
+
+        if not player_signals:
+            return []
+        features = compute_window_features(*_stack_signals(player_signals, player_starts), self.window, self.fs)
+        return [dict(zip(FEATURE_COLUMNS, row.tolist()), player=player, timeStamp=int(ts))
+                for (player, ts), row in zip(meta, features)]
+
+
+def synthetic_raw_eeg(n_samples: int, fs: float = RAW_SAMPLE_RATE, seed: int = 0) -> np.ndarray:
+    """Sinal de teste: ritmos theta/alpha/beta sobre ruído rosa aproximado, na escala do rawEeg (int16)."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples) / fs
+    signal = (120 * np.sin(2 * np.pi * 6 * t) + 200 * np.sin(2 * np.pi * 10 * t)
+              + 60 * np.sin(2 * np.pi * 20 * t))
+    noise = np.cumsum(rng.normal(0, 15, n_samples))
+    noise -= np.convolve(noise, np.ones(256) / 256, mode='same')
+    return np.clip(signal + noise, -2048, 2047).round()
+
+
+def run_benchmark(n_players: int = 4, minutes: float = 10.0, repeats: int = 3):
+    fs = RAW_SAMPLE_RATE
+    n_samples = int(minutes * 60 * fs)
+    signals = {p: synthetic_raw_eeg(n_samples, fs, seed=p) for p in range(1, n_players + 1)}
+    timestamps = {p: np.arange(n_samples) * 1000.0 / fs for p in signals}
+
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        features = compute_spectral_features(signals, timestamps)
+        best = min(best, time.perf_counter() - started)
+    n_windows = len(features)
+    log.info(f"ETL em lote: {n_players} players x {minutes:g} min a {fs} Hz -> {n_windows} janelas "
+             f"de {WINDOW_SECONDS:g}s (passo {STEP_SECONDS:g}s) em {best:.3f}s = {n_windows / best:,.0f} janelas/s")
+
+    # Tempo real: pacotes de 64 amostras (125 ms) de cada player, calculando a cada passo
+    stream = SpectralStream(fs)
+    packet = 64
+    per_step = int(STEP_SECONDS * fs) // packet
+    produced, started = 0, time.perf_counter()
+    for i, offset in enumerate(range(0, n_samples, packet)):
+        for player, signal in signals.items():
+            stream.push(player, signal[offset:offset + packet], offset * 1000.0 / fs)
+        if (i + 1) % per_step == 0:
+            produced += len(stream.compute_ready())
+    elapsed = time.perf_counter() - started
+    log.info(f"Tempo real: {produced} janelas em {elapsed:.3f}s = {produced / elapsed:,.0f} janelas/s "
+             f"({elapsed / (n_samples / fs) * 100:.2f}% de um núcleo para {n_players} players)")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] - %(message)s')
+    run_benchmark(n_players=int(os.getenv('BENCH_PLAYERS', '4')), minutes=float(os.getenv('BENCH_MINUTES', '10')))
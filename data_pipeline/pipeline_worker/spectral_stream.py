@@ -0,0 +1,80 @@
+# spectral_stream.py - features espectrais em tempo real
+#
+# Consome os pacotes 'rawEeg' de todos os players pelo Broker, acumula as amostras em um
+# SpectralStream e, a cada passo (SPECTRAL_STEP_SECONDS), calcula num único lote as janelas
+# completadas de todos os players. O resultado volta ao Broker como 'spectralFeatures'.
+# Os handlers do socketio rodam em threads próprias, então os pacotes de um player podem chegar
+# fora de ordem: o SpectralStream confere a continuidade de cada um (e trava por player).
+import os
+import time
+import logging
+import socketio
+from spectral_features import SpectralStream, STEP_SECONDS
+
+# ==============================================================================
+# SEÇÃO DE CONFIGURAÇÃO DO LOGGING
+# ==============================================================================
+log_format = '%(asctime)s - %(levelname)s - [%(name)s] - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format)
+logging.getLogger("engineio.client").setLevel(logging.WARNING)
+logging.getLogger("socketio.client").setLevel(logging.WARNING)
+log = logging.getLogger(__name__)
+
+# ==============================================================================
+# SEÇÃO DE CONFIGURAÇÃO DO SERVIÇO
+# ==============================================================================
+BROKER_URL = os.getenv('BROKER_URL', 'http://localhost:3000')
+STATS_INTERVAL = float(os.getenv('STATS_INTERVAL', '60'))
+
+sio = socketio.Client()
+stream = SpectralStream()
+
+@sio.event
+def connect():
+    log.info("Conectado ao Broker com sucesso. Aguardando EEG bruto...")
+    # Broker em Python: só os pacotes de EEG bruto (o broker em Node ignora e envia tudo)
+    sio.emit('subscribe', {'topics': ['rawEeg']})
+
+@sio.event
+def disconnect():
+    log.warning("Desconectado do Broker. Buffers de EEG bruto descartados.")
+    stream.reset()
+
+@sio.on('rawEeg')
+def on_raw_eeg(data):
+    player = data.get('player')
+    samples = data.get('samples')
+    if not player or not samples:
+        return
+    stream.push(player, samples, data.get('timeStamp', time.time() * 1000))
+
+def run():
+    windows, compute_time = 0, 0.0
+    last_stats_at = time.monotonic()
+    while True:
+        time.sleep(STEP_SECONDS)
+        started = time.perf_counter()
+        features = stream.compute_ready()
+        compute_time += time.perf_counter() - started
+        if sio.connected:
+            for row in features:
+                sio.emit('spectralFeatures', row)
+        windows += len(features)
+        if time.monotonic() - last_stats_at >= STATS_INTERVAL:
+            log.info(f"{windows} janela(s) calculadas em {compute_time * 1000:.1f} ms de CPU nos últimos {STATS_INTERVAL:g}s "
+                     f"(desde o início: {stream.gaps} buffer(s) descartados por lacuna, {stream.late_packets} pacote(s) atrasados).")
+            windows, compute_time = 0, 0.0
+            last_stats_at = time.monotonic()
+
+
+if __name__ == '__main__':
+    try:
+        sio.connect(BROKER_URL, wait=True, wait_timeout=30, transports='websocket')
+        run()
+    except socketio.exceptions.ConnectionError as e:
+        log.critical(f"Não foi possível conectar ao Broker em {BROKER_URL}. Encerrando. Erro: {e}")
+    except KeyboardInterrupt:
+        log.info("Encerrando serviço de features espectrais.")
+    finally:
+        if sio.connected:
+            sio.disconnect()
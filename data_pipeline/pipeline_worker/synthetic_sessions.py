@@ -0,0 +1,142 @@
+# synthetic_sessions.py - gera sessões Raw sintéticas no mesmo formato gravado pelo coletor
+#
+#   <raw_data>/<sessão>/player_<id>_eeg.jsonl   pacotes eSense (~1 Hz)
+#   <raw_data>/<sessão>/player_<id>_raw.jsonl   pacotes rawEeg de 64 amostras (opcional, 512 Hz)
+#   <raw_data>/<sessão>/game_events.jsonl       raceStarted, collision/overtake, hasFinished
+#
+# A geração é determinística para uma mesma seed, então duas execuções produzem bytes idênticos.
+#
+# Uso: SESSION_SECONDS=3600 N_PLAYERS=4 python synthetic_sessions.py <pasta raw_data> [session_id]
+#      (outras variáveis: EVENTS_PER_MINUTE, DROPOUT_RATE, RAW_EEG=1, SEED)
+import os
+import sys
+import json
+from pathlib import Path
+
+import numpy as np
+
+from processing_logic import EEG_BANDS
+from spectral_features import RAW_SAMPLE_RATE, synthetic_raw_eeg
+
+SESSION_START_MS = 1761952135000
+RAW_PACKET_SIZE = 64
+# Média e desvio (em log) de cada banda do eegPower, na faixa observada no simulador
+BAND_LOG_PARAMS = {
+    'delta': (11.8, 0.3), 'theta': (10.2, 0.5), 'lowAlpha': (8.9, 0.7), 'highAlpha': (8.9, 0.7),
+    'lowBeta': (8.5, 0.7), 'highBeta': (8.5, 0.7), 'lowGamma': (8.0, 0.7), 'highGamma': (8.0, 0.7),
+}
+
+
+def _esense_walk(rng, n: int, start: float) -> np.ndarray:
+    """Passeio aleatório com reversão à média em 0-100, parecido com os índices eSense reais."""
+    values = np.empty(n)
+    level = start
+    steps = rng.normal(0, 6, n)
+    for i in range(n):
+        level += steps[i] + 0.05 * (50 - level)
+        values[i] = level
+    return np.clip(values, 0, 100).round()
+
+
+def _dropout_mask(rng, n: int, dropout_rate: float, mean_burst: float = 5.0) -> np.ndarray:
+    """Falhas de sinal em rajadas (cadeia de Markov) cobrindo ~dropout_rate das leituras."""
+    if dropout_rate <= 0:
+        return np.zeros(n, dtype=bool)
+    leave = 1 / mean_burst
+    enter = leave * dropout_rate / (1 - dropout_rate)
+    mask = np.empty(n, dtype=bool)
+    state = False
+    draws = rng.random(n)
+    for i in range(n):
+        state = (draws[i] >= leave) if state else (draws[i] < enter)
+        mask[i] = state
+    return mask
+
+
+def _write_jsonl(path: Path, records):
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def generate_session(raw_path: Path, session_id: str, duration_seconds: float, n_players: int = 2,
+                     events_per_minute: float = 12.0, dropout_rate: float = 0.05, raw_eeg: bool = False,
+                     seed: int = 0) -> Path:
+    """Grava uma sessão sintética em raw_path/session_id e retorna o diretório criado."""
+    rng = np.random.default_rng(seed)
+    session_path = Path(raw_path) / session_id
+    session_path.mkdir(parents=True, exist_ok=True)
+    n_readings = int(duration_seconds)
+    players = list(range(1, n_players + 1))
+
+    for player in players:
+        jitter = rng.integers(0, 15, n_readings)
+        timestamps = SESSION_START_MS + np.arange(n_readings) * 1000 + jitter
+        attention = _esense_walk(rng, n_readings, rng.uniform(30, 70))
+        meditation = _esense_walk(rng, n_readings, rng.uniform(30, 70))
+        bands = {band: np.exp(rng.normal(mu, sigma, n_readings)).astype(np.int64) for band, (mu, sigma) in BAND_LOG_PARAMS.items()}
+        dropped = _dropout_mask(rng, n_readings, dropout_rate)
+        poor_signal = np.where(dropped, rng.choice([26, 51, 200], n_readings), 0)
+        _write_jsonl(session_path / f'player_{player}_eeg.jsonl', (
+            {
+                'player': player,
+                'attention': int(attention[i]),
+                'meditation': int(meditation[i]),
+                'eegPower': {band: int(bands[band][i]) for band in EEG_BANDS},
+                'poorSignalLevel': int(poor_signal[i]),
+                'status': 'ok' if poor_signal[i] == 0 else ('no-signal' if poor_signal[i] >= 200 else 'poor'),
+                'source': 'synthetic',
+                'timeStamp': int(timestamps[i]),
+            }
+            for i in range(n_readings)
+        ))
+
+        if raw_eeg:
+            n_packets = int(duration_seconds * RAW_SAMPLE_RATE) // RAW_PACKET_SIZE
+            samples = synthetic_raw_eeg(n_packets * RAW_PACKET_SIZE, seed=seed * 100 + player).astype(np.int64)
+            packet_ms = RAW_PACKET_SIZE * 1000 / RAW_SAMPLE_RATE
+            _write_jsonl(session_path / f'player_{player}_raw.jsonl', (
+                {
+                    'player': player,
+                    'samples': samples[i * RAW_PACKET_SIZE:(i + 1) * RAW_PACKET_SIZE].tolist(),
+                    'fs': RAW_SAMPLE_RATE,
+                    'source': 'synthetic',
+                    'timeStamp': int(SESSION_START_MS + i * packet_ms),
+                }
+                for i in range(n_packets)
+            ))
+
+    # Eventos de jogo: processo de Poisson por jogador, depois ordenados no tempo
+    events = []
+    for player in players:
+        n_events = rng.poisson(events_per_minute * duration_seconds / 60)
+        for offset_ms in np.sort(rng.uniform(1000, duration_seconds * 1000, n_events)).astype(np.int64):
+            events.append({'sessionId': session_id, 'player': player,
+                           'eventType': str(rng.choice(['collision', 'overtake'])),
+                           'timestamp': int(SESSION_START_MS + offset_ms)})
+    events.sort(key=lambda e: e['timestamp'])
+    race_times = {player: round(duration_seconds - rng.uniform(0, min(10, duration_seconds / 4)), 2) for player in players}
+    finish_events = [{'sessionId': session_id, 'player': player, 'eventType': 'hasFinished',
+                      'raceTimeSeconds': race_times[player],
+                      'timestamp': int(SESSION_START_MS + race_times[player] * 1000)}
+                     for player in sorted(players, key=race_times.get)]
+    start_event = {'sessionId': session_id, 'eventType': 'raceStarted', 'timestamp': SESSION_START_MS,
+                   'users': [{'playerId': player, 'email': f'player{player}@synthetic.neurorace'} for player in players]}
+    _write_jsonl(session_path / 'game_events.jsonl', [start_event] + events + finish_events)
+    return session_path
+
+
+if __name__ == '__main__':
+    raw_path = Path(sys.argv[1])
+    duration = float(os.getenv('SESSION_SECONDS', '180'))
+    session_id = sys.argv[2] if len(sys.argv) > 2 else f'synthetic-{int(duration)}s'
+    path = generate_session(
+        raw_path, session_id, duration,
+        n_players=int(os.getenv('N_PLAYERS', '2')),
+        events_per_minute=float(os.getenv('EVENTS_PER_MINUTE', '12')),
+        dropout_rate=float(os.getenv('DROPOUT_RATE', '0.05')),
+        raw_eeg=os.getenv('RAW_EEG', '0') == '1',
+        seed=int(os.getenv('SEED', '0')),
+    )
+    size_mb = sum(f.stat().st_size for f in path.iterdir()) / 1024 / 1024
+    print(f"Sessão sintética gravada em {path} ({size_mb:.1f} MB)")
@@ -1,8 +1,28 @@
 import os
+import sys
+import json
+import time
+import fcntl
+import socket
+import threading
+STARTED_AT = time.perf_counter()
 import socketio
 from pathlib import Path
+from typing import Optional
 import logging
-from processing_logic import process_session, calculate_kpis_for_session
+from processing_logic import (process_session, process_session_chunked, process_spectral_features,
+                              calculate_kpis_for_session, get_firestore_client, check_firestore, warm_up_etl,
+                              PipelineCancelled, raise_if_cancelled)
+from analytics_store import AnalyticsStore
+from raw_archive import archive_session, enforce_retention, ready_to_archive
+from session_leases import SessionLeases
+try:
+    from durable_consumer import OrderedLogConsumer
+except ImportError:
+    # Fora do Docker o consumidor é importado direto de data_broker_py/ (no Docker ele é copiado para /app)
+    sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'data_broker_py'))
+    from durable_consumer import OrderedLogConsumer
+IMPORTS_DONE_AT = time.perf_counter()
 
 # ==============================================================================
 # SEÇÃO DE CONFIGURAÇÃO DO LOGGING
@@ -20,52 +40,282 @@ BROKER_URL = os.getenv('BROKER_URL', 'http://localhost:3000')
 RAW_DATA_PATH = Path(os.getenv('RAW_DATA_PATH', '/data/raw_data'))
 TRUSTED_DATA_PATH = Path(os.getenv('TRUSTED_DATA_PATH', '/data/trusted_data'))
 REFINED_DATA_PATH = Path(os.getenv('REFINED_DATA_PATH', '/data/refined_data'))
+# 'memory' (padrão) carrega a sessão inteira; 'chunked' limita o uso de memória ao ETL_CHUNK_SIZE
+ETL_MODE = os.getenv('ETL_MODE', 'memory')
+ETL_CHUNK_SIZE = int(os.getenv('ETL_CHUNK_SIZE', '50000'))
+# Quanto uma linha pode chegar atrasada em relação às mais novas do mesmo arquivo no modo chunked
+ETL_MAX_LATENESS_MS = int(os.getenv('ETL_MAX_LATENESS_MS', '10000'))
+# Features espectrais a partir do EEG bruto (player_<id>_raw.jsonl), quando a sessão tiver
+SPECTRAL_FEATURES = os.getenv('SPECTRAL_FEATURES', '1') == '1'
+# Consumo durável (requer o broker em Python com event log): retoma do último offset confirmado
+DURABLE_CONSUMER = os.getenv('DURABLE_CONSUMER', '0') == '1'
+# Banco analítico local (SQLite) com o histórico de KPIs; vazio desativa. Um só arquivo para todos
+# os workers do host: as gravações se serializam no próprio SQLite (WAL + BEGIN IMMEDIATE)
+ANALYTICS_DB_PATH = os.getenv('ANALYTICS_DB_PATH', '/data/analytics/neurorace.db')
+# Warm start: Firebase inicializado e testado no startup, não na primeira corrida
+FIREBASE_WARM_START = os.getenv('FIREBASE_WARM_START', '1') == '1'
+FIREBASE_HEALTHCHECK_TIMEOUT = float(os.getenv('FIREBASE_HEALTHCHECK_TIMEOUT', '10'))
+# Arquivamento: a pasta Raw de uma sessão processada vira um <sessão>.rawz (zstd) quando o coletor
+# já a encerrou há mais de RAW_ARCHIVE_GRACE_SECONDS (varredura a cada RAW_ARCHIVE_SWEEP_INTERVAL);
+# os arquivos mais antigos são removidos quando o total passa do orçamento (0 = sem limite)
+RAW_ARCHIVE = os.getenv('RAW_ARCHIVE', '1') == '1'
+RAW_ARCHIVE_LEVEL = int(os.getenv('RAW_ARCHIVE_LEVEL', '10'))
+RAW_ARCHIVE_BUDGET_MB = float(os.getenv('RAW_ARCHIVE_BUDGET_MB', '10240'))
+RAW_ARCHIVE_GRACE_SECONDS = float(os.getenv('RAW_ARCHIVE_GRACE_SECONDS', '300'))
+RAW_ARCHIVE_SWEEP_INTERVAL = float(os.getenv('RAW_ARCHIVE_SWEEP_INTERVAL', '60'))
+# Vários workers: cada sessão é tomada por um só via lease em LEASE_DIR (volume compartilhado);
+# leases de workers que caíram vencem após LEASE_SECONDS e a sessão é retomada. Vazio desativa.
+LEASE_DIR = os.getenv('LEASE_DIR', '/data/leases')
+LEASE_SECONDS = float(os.getenv('LEASE_SECONDS', '120'))
+LEASE_MAX_ATTEMPTS = int(os.getenv('LEASE_MAX_ATTEMPTS', '3'))
+LEASE_SWEEP_INTERVAL = float(os.getenv('LEASE_SWEEP_INTERVAL', '30'))
+# Dono das leases e nome do consumidor durável. O hostname só serve para as leases: um container
+# recriado ganha outro, e com ele outro arquivo de offset (começaria do fim do log, pulando eventos)
+WORKER_ID = os.getenv('WORKER_ID') or socket.gethostname()
+# Um arquivo de offset por worker: cada um consome o log inteiro e confirma no próprio ritmo
+CONSUMER_OFFSET_FILE = Path(os.getenv('CONSUMER_OFFSET_FILE', f'/data/offsets/pipeline_worker-{WORKER_ID}.offset'))
 
 log.info(f"Worker iniciado. Conectando ao Broker em {BROKER_URL}")
 
 sio = socketio.Client()
+analytics_store = None
+leases = None
+consumer = None
+# Um pipeline por vez neste worker (evento do Broker ou retomada de lease vencida). O cliente
+# socketio entrega cada evento em uma thread própria, então 'hasFinished' que chegam durante um
+# pipeline esperam neste lock (no modo durável o OrderedLogConsumer já entrega um por vez). A lease
+# só é disputada depois do lock: um worker ocupado não segura sessões que outro, livre, pode tomar.
+pipeline_lock = threading.Lock()
+pipeline_backlog = 0
+pipeline_backlog_lock = threading.Lock()
 
 @sio.event
 def connect():
     log.info("Conectado ao Broker com sucesso. Aguardando corridas...")
 
+def load_committed_offset():
+    try:
+        return json.loads(CONSUMER_OFFSET_FILE.read_text()).get('offset')
+    except (FileNotFoundError, ValueError):
+        return None
+
+def commit_offset(offset: int):
+    CONSUMER_OFFSET_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = CONSUMER_OFFSET_FILE.with_suffix('.tmp')
+    tmp_file.write_text(json.dumps({'offset': offset}))
+    os.replace(tmp_file, CONSUMER_OFFSET_FILE)
+
+def durable_auth():
+    # Avaliado a cada (re)conexão, então sempre parte do último offset confirmado
+    return {'topics': ['hasFinished'], 'durable': True, 'fromOffset': load_committed_offset()}
+
 @sio.event
 def disconnect():
     log.warning("Desconectado do Broker.")
 
-@sio.on('hasFinished')
-def on_race_finished(data):
+def warm_start() -> bool:
     """
-    Este é o GATILHO que inicia todo o pipeline de processamento.
+    Prepara no startup tudo o que a primeira corrida pagaria: caminho do ETL, banco analítico,
+    credenciais do Firebase, cliente Firestore e canal gRPC (aberto pelo health-check).
+    Retorna False se o Firestore não respondeu; nesse caso a primeira corrida tenta de novo.
     """
-    session_id = data.get('sessionId')
-    if not session_id:
-        log.error("Evento 'hasFinished' recebido sem 'sessionId'. Ignorando.")
+    global analytics_store
+    timings = {'imports': IMPORTS_DONE_AT - STARTED_AT}
+    healthy = True
+    step_started = time.perf_counter()
+    warm_up_etl()
+    timings['etl_warm_up'] = time.perf_counter() - step_started
+    if ANALYTICS_DB_PATH:
+        step_started = time.perf_counter()
+        analytics_store = AnalyticsStore(Path(ANALYTICS_DB_PATH))
+        timings['analytics_db'] = time.perf_counter() - step_started
+        log.info(f"Banco analítico em {ANALYTICS_DB_PATH} ({analytics_store.total_races()} resultados registrados)")
+    if FIREBASE_WARM_START:
+        try:
+            step_started = time.perf_counter()
+            db = get_firestore_client()
+            timings['firebase_init'] = time.perf_counter() - step_started
+            step_started = time.perf_counter()
+            check_firestore(db, timeout=FIREBASE_HEALTHCHECK_TIMEOUT)
+            timings['firestore_healthcheck'] = time.perf_counter() - step_started
+        except Exception as e:
+            healthy = False
+            log.error(f"Firestore indisponível no startup. Nova tentativa na primeira corrida. Erro: {e}")
+    details = ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items())
+    log.info(f"Worker pronto em {time.perf_counter() - STARTED_AT:.2f}s ({details})")
+    return healthy
+
+def archive_raw_session(session_id: str):
+    """Compacta a pasta Raw de uma sessão já processada e aplica a retenção. Falhas não afetam o pipeline."""
+    session_path = RAW_DATA_PATH / session_id
+    if not session_path.is_dir():
         return
-        
+    try:
+        stats = archive_session(session_path, level=RAW_ARCHIVE_LEVEL)
+        log.info(f"Raw de {session_id} arquivado: {stats['raw_bytes'] / 1024 / 1024:.1f} MB -> "
+                 f"{stats['archived_bytes'] / 1024 / 1024:.1f} MB (razão {stats['ratio']:.1f}x) em {stats['seconds']:.2f}s")
+        if RAW_ARCHIVE_BUDGET_MB > 0:
+            enforce_retention(RAW_DATA_PATH, int(RAW_ARCHIVE_BUDGET_MB * 1024 * 1024))
+    except Exception:
+        log.error(f"Falha ao arquivar o Raw de {session_id}. A pasta original foi mantida.", exc_info=True)
+
+def run_pipeline(session_id: str, cancel: Optional[threading.Event] = None) -> bool:
+    """
+    Executa o pipeline completo de uma sessão. Retorna True se terminou sem erro. Se `cancel`
+    for marcado (lease perdida), o pipeline para antes da próxima etapa que grava algo.
+    """
     log.info("="*60)
-    log.info(f"Sinal de fim de corrida recebido. Iniciando pipeline para Session ID: {session_id}")
+    log.info(f"Iniciando pipeline para Session ID: {session_id} (worker {WORKER_ID})")
     
     try:
         # --- Passo 1: Executar a lógica do ETL (Raw -> Trusted) ---
-        process_session(session_id, RAW_DATA_PATH, TRUSTED_DATA_PATH)
+        raise_if_cancelled(cancel, "ETL")
+        if ETL_MODE == 'chunked':
+            process_session_chunked(session_id, RAW_DATA_PATH, TRUSTED_DATA_PATH, chunk_size=ETL_CHUNK_SIZE,
+                                    max_lateness_ms=ETL_MAX_LATENESS_MS)
+        else:
+            process_session(session_id, RAW_DATA_PATH, TRUSTED_DATA_PATH)
+        if SPECTRAL_FEATURES:
+            raise_if_cancelled(cancel, "features espectrais")
+            process_spectral_features(session_id, RAW_DATA_PATH, TRUSTED_DATA_PATH)
         
         # --- Passo 2: Executar a lógica do Refined (Trusted -> Refined/Firebase) ---
-        calculate_kpis_for_session(session_id, TRUSTED_DATA_PATH, REFINED_DATA_PATH, RAW_DATA_PATH)
+        raise_if_cancelled(cancel, "KPIs")
+        calculate_kpis_for_session(session_id, TRUSTED_DATA_PATH, REFINED_DATA_PATH, RAW_DATA_PATH, analytics_store, cancel)
         
         log.info(f"Pipeline para {session_id} finalizado com sucesso.")
+        # O Raw da sessão é arquivado depois, por sweep_raw_archives, quando o coletor já a encerrou
+        return True
         
+    except PipelineCancelled as e:
+        log.warning(f"Pipeline para {session_id} interrompido ({e}): a sessão está com outro worker.")
     except FileNotFoundError as e:
         log.error(f"Falha no pipeline para {session_id}: Arquivos da sessão não encontrados. Detalhe: {e}")
     except Exception:
         log.critical(f"ERRO CRÍTICO no pipeline para {session_id}.", exc_info=True)
     finally:
         log.info("="*60)
+    return False
+
+def claim_and_run(session_id: str):
+    """Processa a sessão só se este worker conseguir a lease; com erro, ela é retomada quando a lease vencer."""
+    if not leases.claim(session_id):
+        log.info(f"Sessão {session_id} já concluída ou com outro worker. Ignorando.")
+        return
+    with leases.heartbeat(session_id) as lease_lost:
+        success = run_pipeline(session_id, cancel=lease_lost)
+    if success:
+        if not leases.complete(session_id):
+            log.warning(f"Sessão {session_id} processada, mas a lease já era de outro worker: conclusão fica com ele.")
+    else:
+        leases.release(session_id)
+        if not lease_lost.is_set():
+            log.warning(f"Sessão {session_id} será tentada de novo quando a lease vencer ({LEASE_SECONDS:.0f}s).")
+
+def sweep_raw_archives():
+    """
+    Arquiva periodicamente as sessões já processadas (Trusted gravada e, com leases, concluídas)
+    que o coletor encerrou há mais de RAW_ARCHIVE_GRACE_SECONDS. Um lock no RAW_DATA_PATH faz
+    só um worker varrer por vez.
+    """
+    while True:
+        time.sleep(RAW_ARCHIVE_SWEEP_INTERVAL)
+        try:
+            RAW_DATA_PATH.mkdir(parents=True, exist_ok=True)
+            with open(RAW_DATA_PATH / '.archive.lock', 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                for session_path in sorted(p for p in RAW_DATA_PATH.iterdir() if p.is_dir()):
+                    session_id = session_path.name
+                    if not (TRUSTED_DATA_PATH / f"{session_id}.parquet").exists():
+                        continue
+                    if leases and not leases.is_finished(session_id):
+                        continue
+                    if ready_to_archive(session_path, RAW_ARCHIVE_GRACE_SECONDS):
+                        archive_raw_session(session_id)
+        except Exception:
+            log.error("Falha na varredura de arquivamento do Raw.", exc_info=True)
+
+def sweep_expired_leases():
+    """Retoma periodicamente as sessões cuja lease venceu (worker caiu ou falhou no meio do pipeline)."""
+    while True:
+        time.sleep(LEASE_SWEEP_INTERVAL)
+        try:
+            for session_id in leases.expired_sessions():
+                if not pipeline_lock.acquire(blocking=False):
+                    break
+                try:
+                    claim_and_run(session_id)
+                finally:
+                    pipeline_lock.release()
+        except Exception:
+            log.error("Falha na varredura de leases vencidas.", exc_info=True)
+
+@sio.on('hasFinished')
+def on_race_finished(data):
+    """
+    Este é o GATILHO que inicia todo o pipeline de processamento.
+    """
+    session_id = data.get('sessionId')
+    if not session_id:
+        log.error("Evento 'hasFinished' recebido sem 'sessionId'. Ignorando.")
+        return
+
+    log.info(f"Sinal de fim de corrida recebido para Session ID: {session_id}")
+    global pipeline_backlog
+    with pipeline_backlog_lock:
+        pipeline_backlog += 1
+        waiting = pipeline_backlog - 1
+    if waiting:
+        log.warning(f"Pipeline ocupado: sessão {session_id} aguardando, {waiting} corrida(s) à frente neste worker.")
+    started = time.monotonic()
+    try:
+        with pipeline_lock:
+            if waiting:
+                log.info(f"Sessão {session_id} esperou {time.monotonic() - started:.1f}s pelo pipeline.")
+            if leases:
+                claim_and_run(session_id)
+            else:
+                run_pipeline(session_id)
+    finally:
+        with pipeline_backlog_lock:
+            pipeline_backlog -= 1
+
+def handle_log_entry(event, payload):
+    if event == 'hasFinished':
+        on_race_finished(payload)
+
+@sio.on('logEntry')
+def on_log_entry(entry):
+    """
+    Mensagem lida do event log do broker (modo durável). Cada mensagem chega em uma thread própria,
+    então aqui ela só é enfileirada: o consumidor roda os pipelines em ordem de offset e só então confirma.
+    """
+    consumer.submit(entry)
 
 
 if __name__ == '__main__':
+    # 'python worker.py --check': só executa o startup e sai com 0 (pronto) ou 1 (Firestore indisponível)
+    if '--check' in sys.argv:
+        sys.exit(0 if warm_start() else 1)
+    if DURABLE_CONSUMER and not (os.getenv('WORKER_ID') or os.getenv('CONSUMER_OFFSET_FILE')):
+        log.critical("DURABLE_CONSUMER=1 exige WORKER_ID (ou CONSUMER_OFFSET_FILE) fixo: com o hostname, "
+                     "um container recriado não encontraria o próprio offset e pularia eventos. Encerrando.")
+        sys.exit(1)
     try:
-        sio.connect(BROKER_URL, wait=True, wait_timeout=30, transports='websocket')
+        warm_start()
+        if LEASE_DIR:
+            leases = SessionLeases(Path(LEASE_DIR), WORKER_ID, LEASE_SECONDS, LEASE_MAX_ATTEMPTS)
+            log.info(f"Leases de sessão em {LEASE_DIR} (worker {WORKER_ID}, validade {LEASE_SECONDS:.0f}s)")
+            threading.Thread(target=sweep_expired_leases, name="lease-sweep", daemon=True).start()
+        if RAW_ARCHIVE:
+            threading.Thread(target=sweep_raw_archives, name="raw-archive-sweep", daemon=True).start()
+        if DURABLE_CONSUMER:
+            consumer = OrderedLogConsumer(handle_log_entry, commit_offset, load_committed_offset())
+            log.info(f"Modo durável ativo. Retomando a partir do offset {load_committed_offset()} ({CONSUMER_OFFSET_FILE})")
+        sio.connect(BROKER_URL, wait=True, wait_timeout=30, transports='websocket', auth=durable_auth if DURABLE_CONSUMER else None)
         sio.wait()
     except socketio.exceptions.ConnectionError as e:
         log.critical(f"Não foi possível conectar ao Broker em {BROKER_URL}. Encerrando. Erro: {e}")
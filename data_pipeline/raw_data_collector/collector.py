@@ -1,8 +1,18 @@
 import os
+import sys
 import json
+import time
+import signal
+import threading
 import socketio
 from pathlib import Path
 import logging
+try:
+    from durable_consumer import OrderedLogConsumer
+except ImportError:
+    # Fora do Docker o consumidor é importado direto de data_broker_py/ (no Docker ele é copiado para /app)
+    sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'data_broker_py'))
+    from durable_consumer import OrderedLogConsumer
 
 # ==============================================================================
 # SEÇÃO DE CONFIGURAÇÃO DO LOGGING
@@ -20,11 +30,28 @@ log = logging.getLogger(__name__)
 # ==============================================================================
 BROKER_URL = os.getenv('BROKER_URL', 'http://localhost:3000')
 RAW_DATA_PATH = Path(os.getenv('RAW_DATA_PATH', '/data/raw_data'))
+# Consumo durável (requer o broker em Python com event log): retoma do último offset confirmado
+DURABLE_CONSUMER = os.getenv('DURABLE_CONSUMER', '0') == '1'
+CONSUMER_OFFSET_FILE = Path(os.getenv('CONSUMER_OFFSET_FILE', '/data/offsets/collector.offset'))
+# O checkpoint é gravado a cada OFFSET_COMMIT_EVERY entradas ou OFFSET_COMMIT_INTERVAL_MS, e sempre
+# no fim de corrida e no encerramento. Após uma queda, no máximo esse lote é reprocessado (linhas repetidas no Raw).
+OFFSET_COMMIT_EVERY = int(os.getenv('OFFSET_COMMIT_EVERY', '500'))
+OFFSET_COMMIT_INTERVAL_MS = int(os.getenv('OFFSET_COMMIT_INTERVAL_MS', '1000'))
+# Marcador de sessão encerrada e sufixo do arquivo compactado (mesmos nomes do raw_archive do pipeline_worker):
+# o worker só arquiva sessões encerradas, e uma sessão encerrada ou arquivada não é reaberta
+CLOSED_MARKER = '.closed'
+ARCHIVE_SUFFIX = '.rawz'
 
 log.info(f"Coletor iniciado. Conectando ao Broker em {BROKER_URL}")
 log.info(f"Salvando dados brutos em {RAW_DATA_PATH}")
 
 current_session_id = None
+consumer = None
+# Checkpoint ainda não gravado (offset + sessão logo após a última entrada processada)
+pending_checkpoint = None
+entries_since_commit = 0
+commit_now = False
+checkpoint_lock = threading.Lock()
 # Ativa os loggers internos da biblioteca para depuração de conexão
 sio = socketio.Client(logger=True, engineio_logger=False) # EngineIO logger é muito verboso
 
@@ -32,18 +59,73 @@ sio = socketio.Client(logger=True, engineio_logger=False) # EngineIO logger é m
 def connect():
     log.info("Conectado ao Broker com sucesso. Aguardando dados...")
 
+def load_checkpoint() -> dict:
+    """Último offset confirmado e a sessão que estava sendo coletada naquele ponto."""
+    try:
+        return json.loads(CONSUMER_OFFSET_FILE.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def load_committed_offset():
+    return load_checkpoint().get('offset')
+
+def _write_pending_checkpoint():
+    global pending_checkpoint, entries_since_commit
+    if pending_checkpoint is None:
+        return
+    CONSUMER_OFFSET_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = CONSUMER_OFFSET_FILE.with_suffix('.tmp')
+    tmp_file.write_text(json.dumps(pending_checkpoint))
+    os.replace(tmp_file, CONSUMER_OFFSET_FILE)
+    pending_checkpoint, entries_since_commit = None, 0
+
+def commit_offset(offset: int):
+    """Chamado pelo consumidor após cada entrada; só grava o arquivo quando o lote fecha ou no fim de corrida."""
+    global pending_checkpoint, entries_since_commit, commit_now
+    with checkpoint_lock:
+        # A sessão é capturada aqui, na thread do consumidor, junto com o offset a que corresponde
+        pending_checkpoint = {'offset': offset, 'sessionId': current_session_id}
+        entries_since_commit += 1
+        if commit_now or entries_since_commit >= OFFSET_COMMIT_EVERY:
+            commit_now = False
+            _write_pending_checkpoint()
+
+def flush_offset():
+    with checkpoint_lock:
+        _write_pending_checkpoint()
+
+def flush_offsets_periodically():
+    while True:
+        time.sleep(OFFSET_COMMIT_INTERVAL_MS / 1000)
+        try:
+            flush_offset()
+        except Exception:
+            log.error("Falha ao gravar o checkpoint do consumidor.", exc_info=True)
+
+def durable_auth():
+    # Avaliado a cada (re)conexão, então sempre parte do último offset confirmado
+    return {'topics': list(DURABLE_HANDLERS), 'durable': True, 'fromOffset': load_committed_offset()}
+
 @sio.event
 def disconnect():
     log.warning("Desconectado do Broker.")
+    if DURABLE_CONSUMER:
+        # A reconexão pede fromOffset do arquivo: sem lote pendente, o replay é só o que não foi processado
+        flush_offset()
 
 @sio.on('hasFinished')
 def on_race_finished(data):
     """Gatilho para parar a coleta para a sessão atual."""
-    global current_session_id
+    global current_session_id, commit_now
     session_id = data.get('sessionId')
     log.info(f"Recebido evento de fim de corrida para Session ID: {session_id}")
+    commit_now = True
     if current_session_id == session_id:
         current_session_id = None
+        try:
+            (RAW_DATA_PATH / session_id / CLOSED_MARKER).touch()
+        except Exception:
+            log.error(f"Erro ao marcar a sessão {session_id} como encerrada", exc_info=True)
         log.info(f"Coleta para a sessão {session_id} encerrada.")
 
 @sio.on('gameEvent')
@@ -57,6 +139,11 @@ def on_game_event(data):
         if not session_id:
             log.error("Evento 'raceStarted' recebido sem 'sessionId'.")
             return
+        if (RAW_DATA_PATH / session_id / CLOSED_MARKER).exists() or (RAW_DATA_PATH / f"{session_id}{ARCHIVE_SUFFIX}").exists():
+            # Ex.: replay do event log após uma queda; reabrir duplicaria ou espalharia os dados da sessão
+            log.warning(f"'raceStarted' da sessão {session_id}, que já foi encerrada ou arquivada. Ignorando.")
+            current_session_id = None
+            return
         current_session_id = session_id
         log.info(f"Nova corrida iniciada. Coletando para Session ID: {current_session_id}")
         session_path = RAW_DATA_PATH / current_session_id
@@ -90,12 +177,55 @@ def on_esense(data):
     except Exception:
         log.error(f"Erro ao salvar dados de EEG para Player {player_id} na sessão {current_session_id}", exc_info=True)
 
+@sio.on('rawEeg')
+def on_raw_eeg(data):
+    """Handler para os pacotes de EEG bruto (só chegam com RAW_EEG_OUTPUT=1 na aquisição)."""
+    if not current_session_id:
+        return
+    player_id = data.get('player')
+    if not player_id:
+        log.warning("Recebido pacote rawEeg sem 'player_id'. Pacote ignorado.")
+        return
+    try:
+        file_path = RAW_DATA_PATH / current_session_id / f'player_{player_id}_raw.jsonl'
+        with open(file_path, 'a') as f:
+            f.write(json.dumps(data) + '\n')
+    except Exception:
+        log.error(f"Erro ao salvar EEG bruto para Player {player_id} na sessão {current_session_id}", exc_info=True)
+
+DURABLE_HANDLERS = {'gameEvent': on_game_event, 'eSense': on_esense, 'rawEeg': on_raw_eeg, 'hasFinished': on_race_finished}
+
+def handle_log_entry(event, payload):
+    handler = DURABLE_HANDLERS.get(event)
+    if handler:
+        handler(payload)
+
+@sio.on('logEntry')
+def on_log_entry(entry):
+    """
+    Mensagem lida do event log do broker (modo durável). Cada mensagem chega em uma thread própria,
+    então aqui ela só é enfileirada: o consumidor processa em ordem de offset e confirma em seguida.
+    """
+    consumer.submit(entry)
+
 if __name__ == '__main__':
     try:
         RAW_DATA_PATH.mkdir(parents=True, exist_ok=True)
-        sio.connect(BROKER_URL, wait=True, wait_timeout=30, transports='websocket')
+        if DURABLE_CONSUMER:
+            checkpoint = load_checkpoint()
+            current_session_id = checkpoint.get('sessionId')
+            consumer = OrderedLogConsumer(handle_log_entry, commit_offset, checkpoint.get('offset'))
+            threading.Thread(target=flush_offsets_periodically, name="offset-flush", daemon=True).start()
+            # docker stop envia SIGTERM: vira SystemExit para o checkpoint pendente ser gravado no finally
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            log.info(f"Modo durável ativo. Retomando a partir do offset {checkpoint.get('offset')} (sessão: {current_session_id})")
+        sio.connect(BROKER_URL, wait=True, wait_timeout=30, transports='websocket', auth=durable_auth if DURABLE_CONSUMER else None)
         sio.wait()
     except socketio.exceptions.ConnectionError as e:
         log.critical(f"Não foi possível conectar ao Broker em {BROKER_URL}. Encerrando. Erro: {e}")
     except Exception:
-        log.critical("Uma exceção não tratada ocorreu no loop principal do coletor.", exc_info=True)
\ No newline at end of file
+        log.critical("Uma exceção não tratada ocorreu no loop principal do coletor.", exc_info=True)
+    finally:
+        if DURABLE_CONSUMER:
+            flush_offset()
+            log.info(f"Checkpoint gravado no encerramento: {load_checkpoint()}")
\ No newline at end of file
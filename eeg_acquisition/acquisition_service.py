@@ -1,9 +1,18 @@
 import os
+import sys
 import socket
 import json
-import socketio
 import time
 import logging
+from pathlib import Path
+
+try:
+    from broker_client import WebSocketBrokerClient
+except ImportError:
+    # Fora do Docker o cliente é importado direto de gesture_detector/ (no Docker ele é copiado para /app)
+    sys.path.append(str(Path(__file__).resolve().parent.parent / 'gesture_detector'))
+    from broker_client import WebSocketBrokerClient
+from shm_ring import EegRingWriter, default_ring_name
 
 # ==============================================================================
 # SEÇÃO DE CONFIGURAÇÃO DO LOGGING
@@ -29,6 +38,23 @@ log.info(f"Enviando dados para o Broker em {BROKER_URL}")
 BUFFER_SIZE = 4096
 # N_READINGS = int(os.getenv('N_READINGS', '5')) # janela de leituras para média móvel (rolling window)
 POOR_SIGNAL_LEVEL_THRESHOLD = int(os.getenv('POOR_SIGNAL_LEVEL_THRESHOLD', '0'))
+# Fila de saída para o Broker: com o Broker fora do ar, guarda os pacotes mais recentes até reconectar
+BROKER_QUEUE_SIZE = int(os.getenv('BROKER_QUEUE_SIZE', '600'))
+BROKER_STATS_INTERVAL = float(os.getenv('BROKER_STATS_INTERVAL', '60'))
+# EEG bruto (512 Hz) para as features espectrais: as amostras são agrupadas em pacotes 'rawEeg'
+RAW_EEG_OUTPUT = os.getenv('RAW_EEG_OUTPUT', '0') == '1'
+RAW_EEG_BATCH_SIZE = int(os.getenv('RAW_EEG_BATCH_SIZE', '64'))  # 64 amostras = 125 ms
+RAW_SAMPLE_RATE = 512
+# O timestamp do pacote 'rawEeg' sai da contagem de amostras (pacotes contíguos, sem o jitter da
+# leitura do socket); a contagem só é reancorada no relógio quando se afasta dele mais que isto
+RAW_CLOCK_RESYNC_MS = float(os.getenv('RAW_CLOCK_RESYNC_MS', '500'))
+# Transporte local opcional: anel em memória compartilhada para consumidores no mesmo host
+# (leitura: shm_ring.EegRingReader). O envio ao Broker continua igual. As amostras brutas só
+# entram no anel com RAW_EEG_OUTPUT=1. Em Docker, produtor e consumidores precisam de ipc: host.
+SHM_RING = os.getenv('SHM_RING', '0') == '1'
+SHM_RING_NAME = os.getenv('SHM_RING_NAME', default_ring_name(PLAYER_ID))
+SHM_ESENSE_CAPACITY = int(os.getenv('SHM_ESENSE_CAPACITY', '256'))
+SHM_RAW_CAPACITY = int(os.getenv('SHM_RAW_CAPACITY', '8192'))  # 16 s a 512 Hz
 
 # window = []
 
@@ -39,6 +65,40 @@ def signal_status(psl: int | None, threshold: int) -> str:
         return "no-signal"
     return "ok" if psl <= threshold else "poor"
 
+class RawSampleClock:
+    """
+    Instante de cada amostra bruta: âncora + n / fs. As amostras chegam do socket em rajadas, então
+    o relógio na leitura de cada uma oscila mais que o período de amostragem. A âncora é refeita
+    quando o relógio se afasta mais que `resync_ms` (amostras perdidas, pausa da fonte): para os
+    consumidores isso aparece como uma lacuna entre pacotes.
+    """
+
+    def __init__(self, fs: float, resync_ms: float):
+        self.fs = fs
+        self.resync_ms = resync_ms
+        self.anchor_ms: float | None = None
+        self.count = 0
+
+    def tick(self, now_ms: float) -> tuple[float, bool]:
+        """Retorna (instante da amostra, se a âncora foi refeita nela)."""
+        if self.anchor_ms is not None:
+            expected_ms = self.anchor_ms + self.count * 1000 / self.fs
+            if abs(now_ms - expected_ms) <= self.resync_ms:
+                self.count += 1
+                return expected_ms, False
+        self.anchor_ms, self.count = now_ms, 1
+        return now_ms, True
+
+def send_raw_packet(broker, samples: list, first_sample_ms: float):
+    broker.send_event('rawEeg', {
+        'player': PLAYER_ID,
+        'samples': samples,
+        'fs': RAW_SAMPLE_RATE,
+        'source': SOURCE,
+        # Instante da primeira amostra do pacote (contíguo ao fim do anterior, salvo lacuna)
+        'timeStamp': round(first_sample_ms),
+    })
+
 # def extract_attention(packet):
 #     e = packet.get('eSense') or {}
 #     return e.get('attention')
@@ -55,23 +115,32 @@ def signal_status(psl: int | None, threshold: int) -> str:
 
 def start_acquisition_service():
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sio = socketio.Client(logger=True, engineio_logger=False) # EngineIO logger é muito verboso
+    # Envio não bloqueante: o loop de leitura do EEG nunca espera pela rede do Broker
+    broker = WebSocketBrokerClient(BROKER_URL, max_queue=BROKER_QUEUE_SIZE)
+    ring = None
 
     try:
+        if SHM_RING:
+            ring = EegRingWriter(SHM_RING_NAME, PLAYER_ID, SHM_ESENSE_CAPACITY, SHM_RAW_CAPACITY)
+            log.info(f"Anel de memória compartilhada '{SHM_RING_NAME}' criado para consumidores locais.")
+
         # --- Conexões Iniciais ---
         log.info("Tentando conectar à fonte de EEG...")
         client.connect((HOST, ACQ_PORT))
         log.info("Conectado à fonte de EEG com sucesso.")
         
         log.info("Enviando handshake para a fonte de EEG...")
-        client.sendall(b'{"enableRawOutput": false, "format": "Json"}')
+        client.sendall(json.dumps({"enableRawOutput": RAW_EEG_OUTPUT, "format": "Json"}).encode('utf-8'))
         
-        log.info("Tentando conectar ao Broker...")
-        sio.connect(BROKER_URL)
-        log.info("Conectado ao Broker com sucesso.")
+        log.info("Iniciando envio para o Broker (conexão e reconexão em segundo plano)...")
+        broker.start()
 
         # --- Loop Principal de Aquisição ---
         buffer = ''
+        raw_samples = []
+        raw_clock = RawSampleClock(RAW_SAMPLE_RATE, RAW_CLOCK_RESYNC_MS)
+        raw_packet_ms = None
+        last_stats_at = time.monotonic()
         while True:
             data = client.recv(BUFFER_SIZE)
             if not data:
@@ -99,6 +168,21 @@ def start_acquisition_service():
                 #         'blink': packet['blinkStrength'],
                 #         'timeStamp': now_ms
                 #     })
+                if RAW_EEG_OUTPUT and 'rawEeg' in packet:
+                    sample_ms, resynced = raw_clock.tick(now_ms)
+                    if resynced and raw_samples:
+                        # Um pacote nunca atravessa uma lacuna: o que já foi lido sai antes da nova âncora
+                        send_raw_packet(broker, raw_samples, raw_packet_ms)
+                        raw_samples = []
+                    if not raw_samples:
+                        raw_packet_ms = sample_ms
+                    raw_samples.append(packet['rawEeg'])
+                    if ring:
+                        ring.write_raw(packet['rawEeg'], now_ms)
+                    if len(raw_samples) >= RAW_EEG_BATCH_SIZE:
+                        send_raw_packet(broker, raw_samples, raw_packet_ms)
+                        raw_samples = []
+
                 if 'eSense' in packet:
                     psl = packet.get('poorSignalLevel')
                     status = signal_status(psl, POOR_SIGNAL_LEVEL_THRESHOLD)
@@ -113,8 +197,14 @@ def start_acquisition_service():
                         'source': SOURCE,
                         'timeStamp': now_ms,
                     }
-                    sio.emit('eSense', eSense_payload)
-                    log.debug(f"Pacote eSense enviado para o Broker.")
+                    if ring:
+                        ring.write_esense(eSense_payload)
+                    broker.send_event('eSense', eSense_payload)
+                    log.debug(f"Pacote eSense enfileirado para o Broker.")
+
+                if time.monotonic() - last_stats_at >= BROKER_STATS_INTERVAL:
+                    log.info(f"Envio ao Broker: {broker.get_stats()}")
+                    last_stats_at = time.monotonic()
 
                     # att_smooth = filter_attention(packet)
                     # if att_smooth is not None:
@@ -128,15 +218,14 @@ def start_acquisition_service():
         log.info("Encerrando serviço de aquisição por solicitação do usuário.")
     except socket.error as e:
         log.critical(f"Erro de conexão com a fonte de EEG em {HOST}:{ACQ_PORT}. Verifique se o simulador ou dispositivo está rodando. Erro: {e}")
-    except socketio.exceptions.ConnectionError as e:
-        log.critical(f"Não foi possível conectar ao Broker em {BROKER_URL}. Verifique se o broker está rodando. Erro: {e}")
     except Exception:
         log.critical("Uma exceção não tratada ocorreu no loop de aquisição.", exc_info=True)
     finally:
         if client:
             client.close()
-        if sio and sio.connected:
-            sio.disconnect()
+        broker.close()
+        if ring:
+            ring.close()
         log.info("Conexões encerradas.")
 
 if __name__ == '__main__':
@@ -0,0 +1,244 @@
+# shm_ring.py - transporte local (mesmo host) do EEG via memória compartilhada
+#
+# O serviço de aquisição escreve cada pacote eSense e cada amostra bruta em um segmento
+# multiprocessing.shared_memory; consumidores Python na mesma máquina (jogo, gesture detector,
+# visualizadores) leem direto da memória, sem passar pelo Broker. O Broker continua sendo o
+# caminho para consumidores remotos e para o pipeline de dados.
+#
+# Layout do segmento (little-endian, um escritor, N leitores):
+#   cabeçalho (64 bytes): magic, versão, player, capacidades, contadores de sequência, geração
+#   anel eSense: ESENSE_CAPACITY registros de tamanho fixo, cada um com o próprio número de sequência
+#   anel bruto: RAW_CAPACITY amostras int16 (o EEG bruto do NeuroSky é de 16 bits)
+#
+# O escritor invalida o registro (seq = 0), grava os campos, grava a seq do registro e só então
+# avança o contador do cabeçalho. O leitor confere a seq antes e depois de copiar o registro:
+# se mudou, o escritor deu a volta no anel e o registro é descartado (nunca lido pela metade).
+#
+# Quando o serviço de aquisição reinicia, ele cria um segmento novo com o mesmo nome; o leitor
+# continuaria preso ao antigo (desvinculado, mas ainda mapeado). Cada escritor grava no cabeçalho
+# uma geração (o instante da criação) e EegRingReader.refresh() troca para o segmento novo quando
+# ela muda. Em Docker, escritor e leitores precisam do mesmo namespace IPC (ipc: host no compose).
+#
+# Uso: python shm_ring.py [nome]   acompanha o anel (padrão: neurorace_eeg_p1) e mostra a latência
+import sys
+import time
+import struct
+from multiprocessing import shared_memory
+
+MAGIC = b'NREEGRB1'
+VERSION = 2
+HEADER = struct.Struct('<8sIIIIQQqQ')    # magic, versão, player, cap. eSense, cap. bruto, seq eSense, seq bruto, ts da última amostra, geração
+HEADER_SIZE = 64
+ESENSE_SEQ_OFFSET = 24
+RAW_SEQ_OFFSET = 32
+ESENSE_RECORD = struct.Struct('<Qq4B8I4x')  # seq, timeStamp, attention, meditation, poorSignalLevel, status, 8 bandas
+RAW_SAMPLE = struct.Struct('<h')
+SEQ = struct.Struct('<Q')
+SEQ_TS = struct.Struct('<Qq')
+
+EEG_BANDS = ['delta', 'theta', 'lowAlpha', 'highAlpha', 'lowBeta', 'highBeta', 'lowGamma', 'highGamma']
+STATUS_CODES = {'unknown': 0, 'ok': 1, 'poor': 2, 'no-signal': 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+NO_PSL = 255  # poorSignalLevel ausente no pacote
+REATTACH_CHECK_SECONDS = 1.0
+
+
+def default_ring_name(player_id: int) -> str:
+    return f'neurorace_eeg_p{player_id}'
+
+
+def _segment_size(esense_capacity: int, raw_capacity: int) -> int:
+    return HEADER_SIZE + esense_capacity * ESENSE_RECORD.size + raw_capacity * RAW_SAMPLE.size
+
+
+class EegRingWriter:
+    """Lado do serviço de aquisição: cria o segmento e publica os pacotes."""
+
+    def __init__(self, name: str, player_id: int, esense_capacity: int = 256, raw_capacity: int = 8192):
+        size = _segment_size(esense_capacity, raw_capacity)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Segmento que sobrou de uma execução anterior que não encerrou direito
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.buf = self.shm.buf
+        self.esense_capacity, self.raw_capacity = esense_capacity, raw_capacity
+        self.raw_offset = HEADER_SIZE + esense_capacity * ESENSE_RECORD.size
+        self.esense_seq = self.raw_seq = 0
+        self.generation = time.time_ns()
+        self.buf[:size] = bytes(size)
+        # Magic por último: um leitor nunca vê um cabeçalho válido pela metade
+        HEADER.pack_into(self.buf, 0, bytes(len(MAGIC)), VERSION, player_id, esense_capacity, raw_capacity, 0, 0, 0,
+                         self.generation)
+        self.buf[:len(MAGIC)] = MAGIC
+
+    def write_esense(self, payload: dict):
+        seq = self.esense_seq + 1
+        offset = HEADER_SIZE + (seq - 1) % self.esense_capacity * ESENSE_RECORD.size
+        psl = payload.get('poorSignalLevel')
+        power = payload.get('eegPower') or {}
+        SEQ.pack_into(self.buf, offset, 0)
+        ESENSE_RECORD.pack_into(
+            self.buf, offset, 0, payload['timeStamp'],
+            payload.get('attention') or 0, payload.get('meditation') or 0,
+            NO_PSL if psl is None else min(psl, 254), STATUS_CODES.get(payload.get('status'), 0),
+            *(min(int(power.get(band) or 0), 0xFFFFFFFF) for band in EEG_BANDS))
+        SEQ.pack_into(self.buf, offset, seq)
+        SEQ.pack_into(self.buf, ESENSE_SEQ_OFFSET, seq)
+        self.esense_seq = seq
+
+    def write_raw(self, sample: int, timestamp_ms: int):
+        RAW_SAMPLE.pack_into(self.buf, self.raw_offset + self.raw_seq % self.raw_capacity * RAW_SAMPLE.size,
+                             max(-32768, min(32767, sample)))
+        self.raw_seq += 1
+        SEQ_TS.pack_into(self.buf, RAW_SEQ_OFFSET, self.raw_seq, timestamp_ms)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Abre o segmento sem registrá-lo no resource_tracker (senão o leitor o apagaria ao sair)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 não tem track=False
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _is_ring(shm: shared_memory.SharedMemory) -> bool:
+    magic, version = HEADER.unpack_from(shm.buf, 0)[:2]
+    return magic == MAGIC and version == VERSION
+
+
+class EegRingReader:
+    """Lado do consumidor: leitura sem bloqueio e sem passar pelo Broker."""
+
+    def __init__(self, name: str):
+        self.name = name
+        shm = _attach(name)
+        if not _is_ring(shm):
+            shm.close()
+            raise ValueError(f"Segmento '{name}' não é um anel de EEG compatível")
+        self._bind(shm)
+
+    def _bind(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.buf = shm.buf
+        _, _, self.player, self.esense_capacity, self.raw_capacity, _, _, _, self.generation = HEADER.unpack_from(self.buf, 0)
+        self.raw_offset = HEADER_SIZE + self.esense_capacity * ESENSE_RECORD.size
+        # Vista int16 do anel bruto, sem cópia (ex.: numpy.frombuffer(reader.raw_samples, dtype=numpy.int16))
+        self.raw_samples = self.buf[self.raw_offset:self.raw_offset + self.raw_capacity * RAW_SAMPLE.size].cast('h')
+        self._checked_at = time.monotonic()
+
+    def refresh(self) -> bool:
+        """
+        Confere (no máximo a cada REATTACH_CHECK_SECONDS) se o serviço de aquisição recriou o segmento
+        e, nesse caso, passa a ler o novo. Retorna True se trocou: as sequências recomeçam do zero,
+        então as posições guardadas pelo consumidor devem voltar a 0.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < REATTACH_CHECK_SECONDS:
+            return False
+        self._checked_at = now
+        try:
+            current = _attach(self.name)
+        except FileNotFoundError:
+            return False  # escritor parado: segue no segmento antigo até ele voltar
+        if not _is_ring(current) or HEADER.unpack_from(current.buf, 0)[8] == self.generation:
+            current.close()
+            return False
+        self.close()
+        self._bind(current)
+        return True
+
+    @property
+    def esense_seq(self) -> int:
+        return SEQ.unpack_from(self.buf, ESENSE_SEQ_OFFSET)[0]
+
+    @property
+    def raw_seq(self) -> int:
+        return SEQ.unpack_from(self.buf, RAW_SEQ_OFFSET)[0]
+
+    def _esense_record(self, seq: int) -> dict | None:
+        offset = HEADER_SIZE + (seq - 1) % self.esense_capacity * ESENSE_RECORD.size
+        record = ESENSE_RECORD.unpack_from(self.buf, offset)
+        if record[0] != seq or SEQ.unpack_from(self.buf, offset)[0] != seq:
+            return None
+        _, timestamp, attention, meditation, psl, status, *bands = record
+        return {
+            'player': self.player, 'attention': attention, 'meditation': meditation,
+            'eegPower': dict(zip(EEG_BANDS, bands)), 'poorSignalLevel': None if psl == NO_PSL else psl,
+            'status': STATUS_NAMES.get(status, 'unknown'), 'seq': seq, 'timeStamp': timestamp,
+        }
+
+    def latest(self) -> dict | None:
+        """Pacote eSense mais recente (None se ainda não houver nenhum)."""
+        seq = self.esense_seq
+        while seq:
+            record = self._esense_record(seq)
+            if record is not None:
+                return record
+            seq = self.esense_seq
+        return None
+
+    def read_esense(self, since: int = 0) -> tuple:
+        """Pacotes com seq > since: retorna (última seq vista, lista). Os que o escritor já sobrescreveu são pulados."""
+        last = self.esense_seq
+        first = max(since + 1, last - self.esense_capacity + 1)
+        records = [r for r in (self._esense_record(seq) for seq in range(first, last + 1)) if r is not None]
+        return last, records
+
+    def read_raw(self, since: int = 0) -> tuple:
+        """Amostras brutas após a posição `since`: retorna (nova posição, amostras, timestamp da última amostra)."""
+        last, timestamp = SEQ_TS.unpack_from(self.buf, RAW_SEQ_OFFSET)
+        first = max(since, last - self.raw_capacity)
+        start, end = first % self.raw_capacity, last % self.raw_capacity
+        if last > first and end <= start:
+            samples = self.raw_samples[start:].tolist() + self.raw_samples[:end].tolist()
+        else:
+            samples = self.raw_samples[start:end].tolist()
+        # O escritor pode ter avançado durante a cópia: descarta o início que já foi sobrescrito
+        overwritten = self.raw_seq - self.raw_capacity - first
+        if overwritten > 0:
+            samples = samples[overwritten:]
+        return last, samples, timestamp
+
+    def close(self):
+        if getattr(self, 'raw_samples', None) is not None:
+            self.raw_samples.release()
+            self.raw_samples = None
+        self.buf = None
+        self.shm.close()
+
+
+if __name__ == '__main__':
+    reader = EegRingReader(sys.argv[1] if len(sys.argv) > 1 else default_ring_name(1))
+    print(f"Acompanhando o anel do Player {reader.player} (Ctrl+C para sair)")
+    esense_pos, raw_pos = reader.esense_seq, reader.raw_seq
+    try:
+        while True:
+            if reader.refresh():
+                print(f"Serviço de aquisição reiniciado: anel reaberto (Player {reader.player})")
+                esense_pos = raw_pos = 0
+            esense_pos, records = reader.read_esense(esense_pos)
+            raw_pos, samples, _ = reader.read_raw(raw_pos)
+            for record in records:
+                latency_ms = time.time() * 1000 - record['timeStamp']
+                print(f"seq {record['seq']}: attention {record['attention']}, meditation {record['meditation']}, "
+                      f"status {record['status']} | {latency_ms:.2f} ms desde a aquisição")
+            if samples:
+                print(f"{len(samples)} amostras brutas (última: {samples[-1]})")
+            time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
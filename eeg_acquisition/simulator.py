@@ -1,8 +1,10 @@
-import socket, json, time, random, os
+import socket, json, time, random, os, math
 
 HOST_BIND = '0.0.0.0'                         # <- aceita conexões externas
 PORT = int(os.getenv('ACQ_PORT', '13854'))    # <- porta via env
 PACKET_INTERVAL = float(os.getenv('PACKET_INTERVAL', '1.0'))
+RAW_SAMPLE_RATE = 512
+RAW_CHUNKS_PER_SECOND = 16   # o EEG bruto sai em rajadas de 32 pacotes, sem log
 
 def generate_eeg_power():
     return {
@@ -26,17 +28,52 @@ def generate_packet():
         # "blinkStrength": random.choice([0]*9 + [random.randint(50,255)])
     }
 
+def generate_raw_sample(i):
+    # Ritmos theta (6 Hz), alfa (10 Hz) e beta (20 Hz) sobre ruído, na escala do rawEeg
+    t = i / RAW_SAMPLE_RATE
+    value = (120 * math.sin(2 * math.pi * 6 * t) + 200 * math.sin(2 * math.pi * 10 * t)
+             + 60 * math.sin(2 * math.pi * 20 * t) + random.gauss(0, 40))
+    return max(-2048, min(2047, int(value)))
+
+def read_handshake(conn):
+    """Lê a configuração enviada pelo cliente (ex.: {"enableRawOutput": true, "format": "Json"})."""
+    conn.settimeout(2.0)
+    try:
+        return json.loads(conn.recv(1024).decode('utf-8'))
+    except (socket.timeout, ValueError):
+        return {}
+    finally:
+        conn.settimeout(None)
+
+def stream_raw(conn, duration, sample_index):
+    """Envia `duration` segundos de pacotes rawEeg no ritmo de 512 Hz e retorna o próximo índice de amostra."""
+    chunk = RAW_SAMPLE_RATE // RAW_CHUNKS_PER_SECOND
+    for _ in range(max(1, round(duration * RAW_CHUNKS_PER_SECOND))):
+        messages = ''.join(json.dumps({"rawEeg": generate_raw_sample(sample_index + i)}) + '\r' for i in range(chunk))
+        conn.sendall(messages.encode('utf-8'))
+        sample_index += chunk
+        time.sleep(1 / RAW_CHUNKS_PER_SECOND)
+    return sample_index
+
 def handle_client(conn, addr):
     print(f"[+] Conectado em {addr}")
     try:
-        print("Iniciando stream de dados...")
+        raw_output = bool(read_handshake(conn).get('enableRawOutput'))
+        sample_index = 0
+        print(f"Iniciando stream de dados (EEG bruto: {'sim' if raw_output else 'não'})...")
         while True:
             packet = generate_packet()
+            if raw_output:
+                # Com o EEG bruto ligado, rawEeg só aparece nos pacotes de 512 Hz
+                packet.pop('rawEeg', None)
             message = json.dumps(packet) + '\r'
             print("\n-----sent data-----")
             print(message)
             conn.sendall(message.encode('utf-8'))
-            time.sleep(PACKET_INTERVAL)
+            if raw_output:
+                sample_index = stream_raw(conn, PACKET_INTERVAL, sample_index)
+            else:
+                time.sleep(PACKET_INTERVAL)
     except (BrokenPipeError, ConnectionResetError):
         print(f"[-] Cliente desconectou {addr}")
     finally:
@@ -1,41 +1,159 @@
 # broker_client.py
+import time
+import threading
+from collections import deque
 import socketio
 
 class WebSocketBrokerClient:
-    def __init__(self, broker_url: str):
+    def __init__(self, broker_url: str, max_queue: int = 1000, max_event_age: float | None = None,
+                 connect_timeout: float = 5.0, initial_backoff: float = 0.5, max_backoff: float = 10.0):
         """
         broker_url: ex: 'http://localhost:3000' ou 'http://192.168.15.10:3000'
+        max_queue: tamanho máximo da fila de saída; quando cheia, o evento mais antigo é descartado
+        max_event_age: idade máxima (s) de um evento na fila; mais velho que isso é descartado no envio
+        connect_timeout / initial_backoff / max_backoff: reconexão com backoff exponencial
+
+        send_event nunca espera pela rede: só enfileira. Uma thread de envio em segundo plano
+        conecta, reconecta e emite, então o loop de vídeo ou de aquisição não trava se o Broker
+        estiver lento ou fora do ar.
         """
         self.broker_url = broker_url
-        self.sio = socketio.Client()
+        # A reconexão automática do socketio fica desligada: quem reconecta é a thread de envio
+        self.sio = socketio.Client(reconnection=False)
+        self.max_queue = max_queue
+        self.max_event_age = max_event_age
+        self.connect_timeout = connect_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._latencies = deque(maxlen=500)
+        self.stats = {'queued': 0, 'sent': 0, 'dropped': 0, 'expired': 0, 'coalesced': 0, 'failed': 0, 'connect_failures': 0}
 
     def connect_to_broker(self):
+        """Conexão síncrona (bloqueante). O fluxo normal é deixar a thread de envio conectar."""
         if not self.sio.connected:
             try:
                 print(f"Tentando conectar ao Broker em {self.broker_url}...")
-                self.sio.connect(self.broker_url)
+                self.sio.connect(self.broker_url, wait_timeout=self.connect_timeout)
                 print("Conectado ao Broker com sucesso.")
             except socketio.exceptions.ConnectionError as e:
                 print(f"Não foi possível conectar ao Broker em {self.broker_url}. Erro: {e}")
-                # aqui você pode escolher: ou relança, ou apenas loga
                 raise
 
-    def send_event(self, event_type: str, payload: dict | None = None):
-        # Garante que está conectado, mas NÃO fecha depois
-        self.connect_to_broker()
-        try:
-            self.sio.emit(event_type, payload)
-            print(f"Evento '{event_type}' enviado para o Broker.")
-        except Exception as e:
-            print(f"Erro ao enviar evento '{event_type}' ao Broker: {e}")
+    def start(self):
+        """Inicia a thread de envio (idempotente)."""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._sender_loop, name="broker-sender", daemon=True)
+            self._thread.start()
+
+    def send_event(self, event_type: str, payload: dict | None = None,
+                   coalesce_key: str | None = None, max_age: float | None = None) -> bool:
+        """
+        Enfileira o evento e retorna imediatamente.
+          - coalesce_key: se já houver na fila um evento com a mesma chave, ele é substituído
+                          por este (ex.: só o estado mais recente importa)
+          - max_age: sobrescreve o max_event_age do cliente para este evento
+        """
+        item = (event_type, payload, time.monotonic(), coalesce_key,
+                max_age if max_age is not None else self.max_event_age)
+        with self._cond:
+            self.stats['queued'] += 1
+            if coalesce_key is not None:
+                for i, queued in enumerate(self._queue):
+                    if queued[3] == coalesce_key:
+                        self._queue[i] = item
+                        self.stats['coalesced'] += 1
+                        self._cond.notify()
+                        break
+                else:
+                    coalesce_key = None
+            if coalesce_key is None:
+                if len(self._queue) >= self.max_queue:
+                    self._queue.popleft()
+                    self.stats['dropped'] += 1
+                self._queue.append(item)
+                self._cond.notify()
+        self.start()
+        return True
+
+    def _sender_loop(self):
+        backoff = self.initial_backoff
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._queue:
+                    break
+
+            if not self.sio.connected:
+                try:
+                    self.connect_to_broker()
+                    backoff = self.initial_backoff
+                except Exception:
+                    print(f"Nova tentativa de conexão em {backoff:.1f}s ({len(self._queue)} evento(s) na fila).")
+                    self.stats['connect_failures'] += 1
+                    with self._cond:
+                        self._cond.wait_for(lambda: not self._running, timeout=backoff)
+                        if not self._running:
+                            break
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+
+            with self._cond:
+                if not self._queue:
+                    continue
+                item = self._queue.popleft()
+            event_type, payload, enqueued_at, _, max_age = item
+            if max_age is not None and time.monotonic() - enqueued_at > max_age:
+                self.stats['expired'] += 1
+                continue
+            try:
+                self.sio.emit(event_type, payload)
+                self._latencies.append(time.monotonic() - enqueued_at)
+                self.stats['sent'] += 1
+            except Exception as e:
+                if self.sio.connected:
+                    print(f"Erro ao enviar evento '{event_type}' ao Broker: {e}")
+                    self.stats['failed'] += 1
+                else:
+                    # Conexão caiu: o evento volta para o início da fila e será reenviado após reconectar
+                    with self._cond:
+                        self._queue.appendleft(item)
+
+    def get_stats(self) -> dict:
+        """Contadores de envio e latência de entrega (enfileiramento -> emit), em ms."""
+        with self._cond:
+            stats = dict(self.stats, pending=len(self._queue), connected=self.sio.connected)
+        latencies = sorted(self._latencies)
+        if latencies:
+            stats['latency_avg_ms'] = sum(latencies) / len(latencies) * 1000
+            stats['latency_p95_ms'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        return stats
 
-    def close(self):
+    def close(self, flush_timeout: float = 2.0):
+        """Tenta esvaziar a fila por até `flush_timeout` segundos, para a thread de envio e desconecta."""
+        deadline = time.monotonic() + flush_timeout
+        while self._queue and self.sio.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self._cond:
+            self._running = False
+            self._queue.clear()
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=self.connect_timeout + 1)
         if self.sio and self.sio.connected:
             self.sio.disconnect()
             print("Conexão com o Broker encerrada.")
 
     def __enter__(self):
-        self.connect_to_broker()
+        self.start()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
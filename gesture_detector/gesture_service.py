@@ -0,0 +1,190 @@
+# gesture_service.py - serviço headless que atende N câmeras em um único processo
+#
+# Cada fonte (índice de câmera ou arquivo de vídeo, para testes) é mapeada para um PLAYER_ID:
+#   CAMERA_SOURCES="1=0,2=1"                          -> webcams 0 e 1
+#   CAMERA_SOURCES="1=videos/p1.mp4,2=videos/p2.mp4"  -> vídeos gravados
+# A inferência é distribuída em um pool de workers e os eventos 'handGesture' saem por
+# uma única conexão com o Broker. Nada é desenhado nem exibido, a menos que RENDER=1.
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from broker_client import WebSocketBrokerClient
+from hand_fist_detector import HandFistDetector, LatestFrameCapture, PipelineStats
+
+try:
+    import resource  # indisponível no Windows
+except ImportError:
+    resource = None
+
+BROKER_URL = os.getenv('BROKER_URL', 'http://localhost:3000')
+CAMERA_SOURCES = os.getenv('CAMERA_SOURCES', '1=0')
+N_WORKERS = int(os.getenv('N_WORKERS', '0'))  # 0 = um worker por câmera
+INFERENCE_SCALE = float(os.getenv('INFERENCE_SCALE', '1.0'))
+MODEL_COMPLEXITY = int(os.getenv('MODEL_COMPLEXITY', '1'))
+CONSECUTIVE_FRAMES_FOR_EVENT = int(os.getenv('CONSECUTIVE_FRAMES_FOR_EVENT', '5'))
+RENDER = os.getenv('RENDER', '0') == '1'
+STATS_INTERVAL = float(os.getenv('STATS_INTERVAL', '10'))
+GESTURE_MAX_AGE = float(os.getenv('GESTURE_MAX_AGE', '1.0'))
+
+
+def parse_camera_sources(spec: str) -> dict:
+    """'1=0,2=videos/p2.mp4' -> {1: 0, 2: 'videos/p2.mp4'}"""
+    sources = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        player_id, source = item.split('=', 1)
+        source = source.strip()
+        sources[int(player_id)] = int(source) if source.isdigit() else source
+    return sources
+
+
+class PacedVideoCapture:
+    """Entrega um arquivo de vídeo no ritmo do FPS gravado, como se fosse uma câmera ao vivo."""
+
+    def __init__(self, path: str):
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frame_interval = 1.0 / fps
+        self.next_frame_at = time.perf_counter()
+
+    def read(self):
+        delay = self.next_frame_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame_at = max(self.next_frame_at + self.frame_interval, time.perf_counter() - self.frame_interval)
+        return self.cap.read()
+
+    def release(self):
+        self.cap.release()
+
+
+class CameraWorker:
+    """Estado de uma câmera: captura própria, detector próprio (o MediaPipe guarda tracking entre frames)."""
+
+    def __init__(self, player_id: int, source):
+        self.player_id = player_id
+        self.cap = cv2.VideoCapture(source) if isinstance(source, int) else PacedVideoCapture(source)
+        self.capture = LatestFrameCapture(self.cap)
+        self.detector = HandFistDetector(consecutive_frames_for_event=CONSECUTIVE_FRAMES_FOR_EVENT,
+                                         model_complexity=MODEL_COMPLEXITY)
+        self.stats = PipelineStats()
+        self.last_id = 0
+        # Um mesmo detector nunca roda em dois workers ao mesmo tempo
+        self.busy = False
+        self.latest_result = None
+
+    def has_new_frame(self) -> bool:
+        with self.capture.new_frame:
+            return self.capture.frame_id != self.last_id
+
+
+class GestureService:
+    def __init__(self, sources: dict, broker: WebSocketBrokerClient, n_workers: int = 0):
+        self.cameras = [CameraWorker(player_id, source) for player_id, source in sources.items()]
+        self.broker = broker
+        self.n_workers = n_workers or len(self.cameras)
+        self.executor = ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix="inferencia")
+        self.work_done = threading.Event()
+
+    def _infer(self, camera: CameraWorker):
+        try:
+            item = camera.capture.read_latest(camera.last_id, timeout=0)
+            if item is None:
+                return
+            camera.last_id, frame, captured_at = item
+            started_at = time.perf_counter()
+            camera.stats.record("espera", started_at - captured_at)
+            if RENDER:
+                frame = frame.copy()
+            frame, is_closed, event_closed = camera.detector.process_frame(
+                frame, draw=RENDER, inference_scale=INFERENCE_SCALE)
+            finished_at = time.perf_counter()
+            camera.stats.record("inferencia", finished_at - started_at)
+            camera.stats.count("inferencia")
+            if event_closed:
+                camera.stats.record("frame->evento", finished_at - captured_at)
+                self._send_gesture(camera.player_id)
+            if RENDER:
+                camera.latest_result = (frame, is_closed)
+        except Exception as e:
+            print(f"[WARN] Falha na inferência do player {camera.player_id}: {e}")
+        finally:
+            camera.busy = False
+            self.work_done.set()
+
+    def _send_gesture(self, player_id: int):
+        self.broker.send_event(
+            event_type="handGesture",
+            payload={'player': player_id, 'timeStamp': int(time.time() * 1000)}
+        )
+        print(f"[EVENTO] Punho fechado de player {player_id} detectado!")
+
+    def _render(self):
+        for camera in self.cameras:
+            result, camera.latest_result = camera.latest_result, None
+            if result is None:
+                continue
+            frame, is_closed = result
+            status_text = "PUNHO FECHADO" if is_closed else "MAO ABERTA/INDEFINIDA"
+            cv2.putText(frame, status_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            cv2.imshow(f"Player {camera.player_id}", frame)
+        return cv2.waitKey(1) & 0xFF == ord('q')
+
+    def report_stats(self, cpu_started, wall_started):
+        cpu_pct = (time.process_time() - cpu_started) / (time.perf_counter() - wall_started) * 100
+        rss = f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB" if resource else "n/d"
+        print(f"[STATS] {len(self.cameras)} câmera(s) | CPU do processo: {cpu_pct:.0f}% "
+              f"({cpu_pct / len(self.cameras):.0f}% por câmera) | pico de RSS: {rss}")
+        for camera in self.cameras:
+            print(f"  player {camera.player_id}: {camera.stats.report()} | frames descartados: {camera.capture.dropped}")
+        print(f"  broker: {self.broker.get_stats()}")
+
+    def run(self):
+        for camera in self.cameras:
+            camera.capture.start()
+        print(f"Serviço de gestos atendendo players {[c.player_id for c in self.cameras]} "
+              f"com {self.n_workers} worker(s).")
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        last_report = wall_started
+        try:
+            while any(c.capture.running or c.has_new_frame() or c.busy for c in self.cameras):
+                self.work_done.clear()
+                for camera in self.cameras:
+                    if not camera.busy and camera.has_new_frame():
+                        camera.busy = True
+                        self.executor.submit(self._infer, camera)
+                if RENDER and self._render():
+                    break
+                # Acorda quando alguma inferência termina, ou a cada 5 ms para pegar frames novos
+                self.work_done.wait(0.005)
+                if time.perf_counter() - last_report >= STATS_INTERVAL:
+                    self.report_stats(cpu_started, wall_started)
+                    cpu_started, wall_started = time.process_time(), time.perf_counter()
+                    last_report = wall_started
+        except KeyboardInterrupt:
+            print("Encerrando serviço de gestos.")
+        finally:
+            self.report_stats(cpu_started, wall_started)
+            self.stop()
+
+    def stop(self):
+        for camera in self.cameras:
+            camera.capture.stop()
+        self.executor.shutdown(wait=True)
+        for camera in self.cameras:
+            camera.cap.release()
+        if RENDER:
+            cv2.destroyAllWindows()
+
+
+def main():
+    sources = parse_camera_sources(CAMERA_SOURCES)
+    with WebSocketBrokerClient(BROKER_URL, max_event_age=GESTURE_MAX_AGE) as broker:
+        GestureService(sources, broker, N_WORKERS).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
 import os
 import time
+import threading
+from collections import deque
 import cv2
 from broker_client import WebSocketBrokerClient
 import mediapipe as mp
 
 class HandFistDetector:
     def __init__(self, min_detection_confidence=0.7, min_tracking_confidence=0.6,
-                 consecutive_frames_for_event=5):
+                 consecutive_frames_for_event=5, model_complexity=1):
         self.mp_hands = mp.solutions.hands
         self.hands = self.mp_hands.Hands(
             max_num_hands=1,
+            model_complexity=model_complexity,  # 0 = modelo "lite", mais barato em CPU
             min_detection_confidence=min_detection_confidence,
             min_tracking_confidence=min_tracking_confidence,
         )
@@ -42,16 +45,22 @@ class HandFistDetector:
         # Considera punho se os 4 dedos estiverem dobrados
         return folded_count == len(self.finger_tips)
 
-    def process_frame(self, frame):
+    def process_frame(self, frame, draw=True, inference_scale=1.0):
         """
         Processa um frame BGR do OpenCV.
+          - draw: desenha os pontos da mão no frame (desligue quando não houver visualização)
+          - inference_scale: fator (< 1.0) para reduzir o frame antes da inferência. Os
+                             landmarks são normalizados, então o desenho continua no frame original.
         Retorna:
           - frame_annotated: frame com as marcações dos pontos da mão
           - is_closed: bool indicando se a mão está fechada AGORA
           - event_closed: bool que só é True no frame em que a mão
                           acabou de ser detectada como fechada (borda de subida)
         """
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        small = frame
+        if inference_scale < 1.0:
+            small = cv2.resize(frame, None, fx=inference_scale, fy=inference_scale, interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
         results = self.hands.process(rgb)
         is_closed = False
         event_closed = False
@@ -59,11 +68,12 @@ class HandFistDetector:
         if results.multi_hand_landmarks:
             for hand_landmarks in results.multi_hand_landmarks:
                 # Desenha a mão no frame para debug / visualização
-                self.mp_drawing.draw_landmarks(
-                    frame,
-                    hand_landmarks,
-                    self.mp_hands.HAND_CONNECTIONS
-                )
+                if draw:
+                    self.mp_drawing.draw_landmarks(
+                        frame,
+                        hand_landmarks,
+                        self.mp_hands.HAND_CONNECTIONS
+                    )
 
                 if self._is_fist(hand_landmarks):
                     is_closed = True
@@ -90,6 +100,190 @@ class HandFistDetector:
         return frame, current_state_closed, event_closed
 
 
+class LatestFrameCapture:
+    """
+    Thread de captura que guarda só o frame mais recente da câmera. Se a inferência
+    estiver lenta, os frames intermediários são descartados em vez de enfileirados,
+    então o detector sempre trabalha sobre a imagem mais atual.
+    """
+
+    def __init__(self, cap):
+        self.cap = cap
+        self.new_frame = threading.Condition()
+        self.frame = None
+        self.frame_id = 0
+        self.captured_at = 0.0
+        self.consumed_id = 0
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="captura", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            captured_at = time.perf_counter()
+            with self.new_frame:
+                if not ret:
+                    print("Não foi possível ler da webcam.")
+                    self.running = False
+                    self.new_frame.notify_all()
+                    break
+                if self.frame_id != self.consumed_id:
+                    self.dropped += 1
+                self.frame, self.captured_at = frame, captured_at
+                self.frame_id += 1
+                self.new_frame.notify_all()
+
+    def read_latest(self, last_id, timeout=1.0):
+        """
+        Bloqueia até existir um frame mais novo que `last_id`.
+        Retorna (frame_id, frame, captured_at) ou None se a captura terminou.
+        """
+        with self.new_frame:
+            while self.running and self.frame_id == last_id:
+                self.new_frame.wait(timeout)
+            if self.frame_id == last_id:
+                return None
+            self.consumed_id = self.frame_id
+            return self.frame_id, self.frame, self.captured_at
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+
+
+class PipelineStats:
+    """Latência por estágio (média móvel) e FPS efetivo de cada estágio."""
+
+    def __init__(self, window=120):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counts = {}
+        self.window = window
+        self.started_at = time.perf_counter()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.latencies.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, stage):
+        with self.lock:
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def report(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started_at
+            parts = [f"{stage}: {sum(v) / len(v) * 1000:.1f} ms" for stage, v in self.latencies.items() if v]
+            parts += [f"{stage}: {n / elapsed:.1f} FPS" for stage, n in self.counts.items()]
+            self.counts = {}
+            self.started_at = time.perf_counter()
+        return " | ".join(parts)
+
+
+class GesturePipeline:
+    """
+    Modo em pipeline: captura (thread) -> inferência (thread) -> renderização (opcional,
+    na thread principal, onde o OpenCV exige o imshow/waitKey).
+      - inference_scale: reduz o frame antes do MediaPipe
+      - max_inference_fps: limita a taxa de inferência (0 = sem limite)
+      - on_event: chamado na thread de inferência quando o punho acaba de fechar
+    """
+
+    def __init__(self, cap, detector, on_event, inference_scale=1.0, max_inference_fps=0.0, render=True):
+        self.capture = LatestFrameCapture(cap)
+        self.detector = detector
+        self.on_event = on_event
+        self.inference_scale = inference_scale
+        self.min_interval = 1.0 / max_inference_fps if max_inference_fps > 0 else 0.0
+        self.render = render
+        self.stats = PipelineStats()
+        self.result_lock = threading.Lock()
+        self.latest_result = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.capture.start()
+        self.thread = threading.Thread(target=self._inference_loop, name="inferencia", daemon=True)
+        self.thread.start()
+
+    def _inference_loop(self):
+        last_id = 0
+        while self.running:
+            item = self.capture.read_latest(last_id)
+            if item is None:
+                break
+            last_id, frame, captured_at = item
+            started_at = time.perf_counter()
+            self.stats.record("espera", started_at - captured_at)
+            if self.render:
+                frame = frame.copy()
+            frame, is_closed, event_closed = self.detector.process_frame(
+                frame, draw=self.render, inference_scale=self.inference_scale)
+            finished_at = time.perf_counter()
+            self.stats.record("inferencia", finished_at - started_at)
+            self.stats.count("inferencia")
+            if event_closed:
+                self.stats.record("frame->evento", finished_at - captured_at)
+                self.on_event()
+            with self.result_lock:
+                self.latest_result = (frame, is_closed)
+            remaining = self.min_interval - (time.perf_counter() - started_at)
+            if remaining > 0:
+                time.sleep(remaining)
+        self.running = False
+
+    def get_latest_result(self):
+        with self.result_lock:
+            return self.latest_result
+
+    def stop(self):
+        self.running = False
+        self.capture.stop()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+
+def run_pipelined(cap, detector, send_gesture, inference_scale, max_inference_fps, render, stats_interval):
+    pipeline = GesturePipeline(cap, detector, send_gesture, inference_scale, max_inference_fps, render)
+    pipeline.start()
+    last_report = time.perf_counter()
+    last_rendered = None
+    try:
+        while pipeline.running:
+            if render:
+                result = pipeline.get_latest_result()
+                if result is not None and result is not last_rendered:
+                    last_rendered = result
+                    render_started = time.perf_counter()
+                    frame, is_closed = result
+                    status_text = "PUNHO FECHADO" if is_closed else "MAO ABERTA/INDEFINIDA"
+                    cv2.putText(frame, status_text, (10, 30),
+                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                    cv2.imshow("Deteccao de Punho - Pressione 'q' para sair", frame)
+                    pipeline.stats.record("render", time.perf_counter() - render_started)
+                    pipeline.stats.count("render")
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+            else:
+                time.sleep(0.05)
+
+            if time.perf_counter() - last_report >= stats_interval:
+                print(f"[STATS] {pipeline.stats.report()} | frames descartados: {pipeline.capture.dropped}")
+                last_report = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+
+
 def main():
     
     cap = cv2.VideoCapture(0)  # 0 = webcam padrão
@@ -99,8 +293,34 @@ def main():
 
     PLAYER_ID = int(os.getenv('PLAYER_ID', '1'))
     BROKER_URL = os.getenv('BROKER_URL', 'http://localhost:3000')
-    
-    with WebSocketBrokerClient(BROKER_URL) as broker:
+    # 'serial' (padrão) roda tudo em um loop; 'threaded' separa captura, inferência e renderização
+    PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'serial')
+    INFERENCE_SCALE = float(os.getenv('INFERENCE_SCALE', '1.0'))
+    INFERENCE_MAX_FPS = float(os.getenv('INFERENCE_MAX_FPS', '0'))
+    RENDER = os.getenv('RENDER', '1') == '1'
+    STATS_INTERVAL = float(os.getenv('STATS_INTERVAL', '5'))
+    # Um gesto que ficou mais que isso na fila (Broker fora do ar) já não serve para o jogo
+    GESTURE_MAX_AGE = float(os.getenv('GESTURE_MAX_AGE', '1.0'))
+
+    if PIPELINE_MODE == 'threaded':
+        with WebSocketBrokerClient(BROKER_URL, max_event_age=GESTURE_MAX_AGE) as broker:
+            def send_gesture():
+                broker.send_event(
+                    event_type="handGesture",
+                    payload={
+                    'player': PLAYER_ID,
+                    'timeStamp': int(time.time() * 1000)
+                    }
+                )
+                print(f"[EVENTO] Punho fechado de player {PLAYER_ID} detectado! Enviando ao Broker em {BROKER_URL}")
+
+            run_pipelined(cap, detector, send_gesture, INFERENCE_SCALE, INFERENCE_MAX_FPS, RENDER, STATS_INTERVAL)
+            print(f"[STATS] Broker: {broker.get_stats()}")
+        cap.release()
+        cv2.destroyAllWindows()
+        return
+
+    with WebSocketBrokerClient(BROKER_URL, max_event_age=GESTURE_MAX_AGE) as broker:
         while True:
             ret, frame = cap.read()
             if not ret:
@@ -119,18 +339,16 @@ def main():
             if event_closed:
                 now_ms = int(time.time() * 1000)
 
-                try:
-                    broker.send_event(
-                        event_type="handGesture",
-                        payload={
-                        'player': PLAYER_ID,
-                        'timeStamp': now_ms
-                        }
-                    )
-                    print(f"[EVENTO] Punho fechado de player {PLAYER_ID} detectado! Enviando ao Broker em {BROKER_URL}")
-                except Exception as e:
-                    print(f"[WARN] Não foi possível enviar evento ao Broker: {e}")
-                
+                # Só enfileira: o envio acontece na thread do cliente, sem travar o loop de vídeo
+                broker.send_event(
+                    event_type="handGesture",
+                    payload={
+                    'player': PLAYER_ID,
+                    'timeStamp': now_ms
+                    }
+                )
+                print(f"[EVENTO] Punho fechado de player {PLAYER_ID} detectado! Enviando ao Broker em {BROKER_URL}")
+
 
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break